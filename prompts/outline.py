@@ -17,6 +17,46 @@ Important guidelines:
 4. Do not make assumptions or add details that are not present in the given concept.
 
 
+Respond in JSON format with the following structure:
+{{
+  "title": "Story Title",
+  "concept": "Brief concept description",
+  "acts": [
+    {{
+      "act_number": 1,
+      "title": "Act 1 Title",
+      "description": "Act 1 description"
+    }},
+    ...
+  ]
+}}
+Start with {{... and end with ...}}. Only return valid json as response.
+
+Ensure that your response includes the exact number of acts as specified or implied in the concept.
+"""
+
+REVISE_ACTS = """
+Concept:
+```
+{concept}
+```
+
+Acts generated from an earlier version of the concept:
+```
+{previous_acts}
+```
+
+
+Task:
+The concept has been revised since the acts above were generated from it. Update the high-level structure of the story to match the revised concept. Keep every act that the revision doesn't affect exactly as it is, with the same act number, title and description. Only change, add or remove acts where the revised concept requires it.
+
+Important guidelines:
+1. Use only the information provided in the concept. Do not introduce any elements that are not explicitly mentioned.
+2. Pay special attention to use correct names, events, and concepts as described in the concept.
+3. The acts should follow the progression outlined in the concept.
+4. Do not make assumptions or add details that are not present in the given concept.
+
+
 Respond in JSON format with the following structure:
 {{
   "title": "Story Title",
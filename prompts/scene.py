@@ -4,8 +4,8 @@ Outline:
 
 Current Scene: 
 {current_scene}
-
-Script Context (Last {context_length} characters to be continued with the current scene): 
+{story_so_far}{story_elements}
+Script Context ({context_length} characters of the previous script, ending with the text to be continued with the current scene): 
 \"\"\"
 ...{full_script_context}
 \"\"\"
@@ -44,15 +44,15 @@ Ensure all required fields are included and formatted correctly.
 
 EVALUATE_SCENE = """
 Data:
-Outline:
-{outline}
-
 Characters: 
 {characters}
 
 Themes: 
 {themes}
 
+Outline:
+{outline}
+
 Current Scene Information: 
 {scene_details}
 
@@ -96,18 +96,18 @@ Characters:
 Themes: 
 {themes}
 
+Scene Details: 
+{scene_details}
+{story_so_far}{story_elements}
+Full Script Context ({context_length} characters of the previous script): 
+{full_script_context}
+
 Original Scene (in JSON format): 
 {scene_content}
 
 Feedback: 
 {feedback}
 
-Scene Details: 
-{scene_details}
-
-Full Script Context (Last {context_length} characters): 
-{full_script_context}
-
 Task:
 As a skilled script doctor specializing in {genre}, your task is to refine the given scene based on the provided feedback. Your goal is to address the issues raised while maintaining the scene's core elements, purpose, and style consistency with the initial script.
 
@@ -167,6 +167,26 @@ Provide the extracted story elements in JSON format:
 }}
         """
 
+SUMMARIZE_SCENE = """
+Scene (in Markdown format):
+{scene_content}
+
+Task:
+As the script supervisor of a {genre} screenplay, summarize the scene above in at most {length} words for the writers of the scenes that follow. Keep everything later scenes have to stay consistent with: who is present, what happens, what is revealed or decided, how relationships and emotional states change, and where and when the scene ends. Leave out the wording of the dialogue and descriptions.
+
+Respond with the summary only.
+"""
+
+SUMMARIZE_SECTION = """
+Summaries of the consecutive parts of {section}, in script order:
+{summaries}
+
+Task:
+As the script supervisor of a {genre} screenplay, condense these summaries into one summary of {section} of at most {length} words. Keep the plot developments, the state of each character at the end, the open conflicts and questions, and any setups that have not paid off yet.
+
+Respond with the summary only.
+"""
+
 EVALUATE_FULL_SCRIPT = """
 Given Data:
 Full Script: {full_script}
@@ -207,4 +227,46 @@ Respond in the following JSON format:
   "total_score": 0,
   "feedback": "Overall feedback here, summarizing the script's strengths and weaknesses",
 }}
-"""
\ No newline at end of file
+"""
+
+EVALUATE_ACT = """
+Given Data:
+Act {act_number} of the Script: {act_script}
+Outline: {outline}
+Characters: {characters}
+Themes: {themes}
+
+Task:
+As a veteran showrunner and {genre} aficionado, evaluate act {act_number} of the script as part of the whole story (Outline). The other acts are evaluated separately. Assess how well this act works as a cohesive part of the narrative, paying special attention to its flow, the character arcs within it, and its thematic exploration. Evaluate based on these criteria:
+
+1. Overall narrative coherence (0-25 points)
+2. Character development across scenes (0-25 points)
+3. Thematic consistency and exploration (0-20 points)
+4. Pacing and structure (0-15 points)
+5. Dialogue consistency across scenes (0-15 points)
+
+For each criterion, provide a score and a detailed justification. Be specific in your feedback, referencing particular scenes or story elements that stand out, both positively and negatively.
+
+Additionally, identify any specific scenes of this act that could be improved to enhance the overall script quality. For each scene identified, provide a clear reason for why it needs improvement and how it could better serve the overall narrative. Use the scene number from the script's scene headings (e.g. "{act_number}.1.1") as the scene identifier.
+
+Output Format:
+Respond in the following JSON format:
+{{
+  "criteria": {{
+    "narrative_coherence": {{"justification": "","score": 0}},
+    "character_development": {{"justification": "","score": 0}},
+    "thematic_consistency": {{"justification": "","score": 0}},
+    "pacing_and_structure": {{"justification": "","score": 0}},
+    "dialogue_consistency": {{"justification": "","score": 0}}
+  }},
+  "scenes_to_improve": [
+    {{
+      "scene_id": "scene number",
+      "reason": "Reason for improvement",
+      "suggestions": "Specific suggestions for enhancement"
+    }}
+  ],
+  "total_score": 0,
+  "feedback": "Overall feedback on this act, summarizing its strengths and weaknesses"
+}}
+"""
@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Generator, Iterator, List, Sequence, Tuple
+
+from src.llm.LLMService import LLMService
+from src.llm.PromptBudget import DEFAULT_RESPONSE_TOKENS
+from src.llm.ResponseCache import ResponseCache
+from src.llm.Telemetry import Telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Stops sending traffic to a provider after repeated failures. Once the cool-down has passed a
+    single trial request is let through; its outcome closes or re-opens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, cooldown_seconds: float = 60):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """A request ended without an outcome (e.g. it was cancelled); if it was the trial, the next one is."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+
+class LLMRouter:
+    """
+    Sends each call to the first provider/model in an ordered chain whose circuit is closed,
+    falling through to the next entry when a call fails.
+    """
+    _breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, chain: List[Tuple[str, str]], cache: ResponseCache = None, telemetry: Telemetry = None,
+                 failure_threshold: int = 3, cooldown_seconds: float = 60,
+                 response_tokens: int = DEFAULT_RESPONSE_TOKENS):
+        self.services = [LLMService(provider_name=provider, default_model=model, cache=cache, telemetry=telemetry,
+                                    response_tokens=response_tokens)
+                         for provider, model in chain]
+        self.telemetry = telemetry
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], cache: ResponseCache = None, telemetry: Telemetry = None,
+                    validation: bool = False) -> "LLMRouter":
+        suffix = "_validation" if validation else ""
+        chain = [(entry['provider'], entry['model']) for entry in config.get(f'llm_chain{suffix}', [])]
+        if not chain:
+            chain = [(config.get(f'llm_provider{suffix}', 'ollama'), config.get(f'llm_model{suffix}', 'gemma2:27b'))]
+            fallback = (config.get('llm_fallback_provider', 'openai'), config.get('llm_fallback_model', 'gpt-4o'))
+            if fallback not in chain:
+                chain.append(fallback)
+
+        breaker_settings = config.get('circuit_breaker', {})
+        return cls(chain, cache=cache, telemetry=telemetry,
+                   failure_threshold=breaker_settings.get('failure_threshold', 3),
+                   cooldown_seconds=breaker_settings.get('cooldown_seconds', 60),
+                   response_tokens=config.get('response_tokens', DEFAULT_RESPONSE_TOKENS))
+
+    def breaker_for(self, service: LLMService) -> CircuitBreaker:
+        # Breakers are per provider and model and shared by all routers, so an outage seen by one stage is
+        # seen by all, while another model of the same provider can still be used as a fallback
+        key = (service.provider.name(), service.default_model)
+        with LLMRouter._lock:
+            breaker = LLMRouter._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.cooldown_seconds)
+                LLMRouter._breakers[key] = breaker
+            return breaker
+
+    @property
+    def primary(self) -> LLMService:
+        return self.services[0]
+
+    @property
+    def default_model(self) -> str:
+        return self.primary.default_model
+
+    @property
+    def models(self) -> List[str]:
+        return [service.default_model for service in self.services]
+
+    def _candidates(self) -> Iterator[Tuple[LLMService, CircuitBreaker]]:
+        # A breaker is asked only right before its entry is tried: allow() lets the trial request of an
+        # expired circuit through, so that request has to be sent
+        tried = False
+        for service in self.services:
+            breaker = self.breaker_for(service)
+            if breaker.allow():
+                tried = True
+                yield service, breaker
+        if not tried:
+            # Every circuit is open: try the primary rather than failing without a request
+            logger.warning("All provider circuits are open. Trying the primary provider anyway.")
+            yield self.primary, self.breaker_for(self.primary)
+
+    @staticmethod
+    def _watched(stream: Iterator, breaker: CircuitBreaker) -> Generator:
+        # A stream's outcome is only known once it has been consumed
+        received = False
+        try:
+            for chunk in stream:
+                received = True
+                yield chunk
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:  # Closed early or cancelled: a stream that delivered shows the provider works
+            if received:
+                breaker.record_success()
+            else:
+                breaker.record_abandoned()
+            raise
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        breaker.record_success()
+
+    @staticmethod
+    async def _awatched(stream: AsyncIterator, breaker: CircuitBreaker) -> AsyncGenerator:
+        received = False
+        try:
+            async for chunk in stream:
+                received = True
+                yield chunk
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            if received:
+                breaker.record_success()
+            else:
+                breaker.record_abandoned()
+            raise
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        breaker.record_success()
+
+    def generate(self, prompt: str, **kwargs) -> Any:
+        last_error = None
+        for service, breaker in self._candidates():
+            try:
+                result = service.generate(prompt, **kwargs)
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning(f"{service.name()} failed ({breaker.state}). Falling back. Error: {str(e)}")
+                last_error = e
+                continue
+            except BaseException:
+                breaker.record_abandoned()
+                raise
+            if kwargs.get('stream') and not isinstance(result, (str, dict)):
+                return self._watched(result, breaker)
+            breaker.record_success()
+            return result
+        raise last_error
+
+    async def agenerate(self, prompt: str, **kwargs) -> Any:
+        last_error = None
+        for service, breaker in self._candidates():
+            try:
+                result = await service.agenerate(prompt, **kwargs)
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning(f"{service.name()} failed ({breaker.state}). Falling back. Error: {str(e)}")
+                last_error = e
+                continue
+            except BaseException:
+                breaker.record_abandoned()
+                raise
+            if kwargs.get('stream') and not isinstance(result, (str, dict)):
+                return self._awatched(result, breaker)
+            breaker.record_success()
+            return result
+        raise last_error
+
+    def generate_many(self, prompts: Sequence[str], **kwargs) -> Generator[Tuple[int, Any], None, None]:
+        # Prompts that fail on one provider are retried as a batch on the next one in the chain
+        remaining = dict(enumerate(prompts))
+        last_error = None
+        for service, breaker in self._candidates():
+            indices = list(remaining)
+            try:
+                for position, result in service.generate_many([remaining[index] for index in indices], **kwargs):
+                    if isinstance(result, Exception):
+                        last_error = result
+                        continue
+                    del remaining[indices[position]]
+                    yield indices[position], result
+            except Exception as e:
+                last_error = e
+            except BaseException:  # The batch was closed early or cancelled
+                if len(remaining) < len(indices):
+                    breaker.record_success()
+                else:
+                    breaker.record_abandoned()
+                raise
+            if len(remaining) < len(indices):
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if not remaining:
+                return
+            logger.warning(f"{service.name()} failed {len(remaining)} of {len(indices)} prompts ({breaker.state}). "
+                           f"Falling back. Error: {str(last_error)}")
+        for index in remaining:
+            yield index, last_error
+
+    def invalidate(self, prompt: str, **kwargs):
+        for service in self.services:
+            service.invalidate(prompt, **kwargs)
+
+    def name(self) -> str:
+        return " -> ".join(service.name() for service in self.services)
@@ -1,27 +1,108 @@
 import json
 import logging
-from typing import Union, Dict, Generator, List
+import time
+from typing import Any, Union, Dict, Generator, List, AsyncGenerator, Optional, Tuple, Callable, Sequence
 
 from langchain_core.outputs import GenerationChunk
 
 from src.llm.LLMServiceFactory import LLMServiceFactory
+from src.llm.PromptBudget import DEFAULT_RESPONSE_TOKENS
+from src.llm.RequestScheduler import priority_for
+from src.llm.ResponseCache import ResponseCache
+from src.llm.Telemetry import Telemetry
 
 logger = logging.getLogger(__name__)
+# Called when a stream ends with the full text, the outcome ("ok", "aborted", "error")
+# and the time the first chunk arrived
+StreamCallback = Callable[[str, str, Optional[float]], None]
+
+
 def _process_response(response: Union[str, Dict, Generator],
                       stream: bool,
-                      use_chat: bool) -> Union[str, Dict, Generator[str, None, None]]:
+                      use_chat: bool,
+                      on_finish: StreamCallback = None) -> Union[str, Dict, Generator[str, None, None]]:
     if not stream:
         return response  # This could be str or Dict depending on the provider's implementation
 
     def chunk_generator() -> Generator[str, None, None]:
-        for chunk in response:
-            content = _extract_content(chunk, use_chat)
-            if content:
-                yield content
+        texts = []
+        first_chunk_at = None
+        outcome = "aborted"
+        try:
+            for chunk in response:
+                content = _extract_content(chunk, use_chat)
+                if content:
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    texts.append(content.text)
+                    yield content
+            outcome = "ok"
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            # Closing early (e.g. an aborted generation) cancels the underlying request
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
+            if on_finish is not None:
+                on_finish("".join(texts), outcome, first_chunk_at)
 
     return chunk_generator()
 
 
+def _aprocess_response(response: Union[str, Dict, AsyncGenerator],
+                       stream: bool,
+                       use_chat: bool,
+                       on_finish: StreamCallback = None) -> Union[str, Dict, AsyncGenerator[str, None]]:
+    if not stream:
+        return response
+
+    async def chunk_generator() -> AsyncGenerator[str, None]:
+        texts = []
+        first_chunk_at = None
+        outcome = "aborted"
+        try:
+            async for chunk in response:
+                content = _extract_content(chunk, use_chat)
+                if content:
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    texts.append(content.text)
+                    yield content
+            outcome = "ok"
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            aclose = getattr(response, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            if on_finish is not None:
+                on_finish("".join(texts), outcome, first_chunk_at)
+
+    return chunk_generator()
+
+
+def _replay(cached: Union[str, Dict]) -> Generator[GenerationChunk, None, None]:
+    yield GenerationChunk(text=cached if isinstance(cached, str) else json.dumps(cached))
+
+
+async def _areplay(cached: Union[str, Dict]) -> AsyncGenerator[GenerationChunk, None]:
+    yield GenerationChunk(text=cached if isinstance(cached, str) else json.dumps(cached))
+
+
+def _estimate_tokens(*texts: str) -> int:
+    # Rough estimate (~4 characters per token), only used for rate limiting
+    return sum(len(text) for text in texts) // 4
+
+
+def _cache_kwargs(kwargs: Dict, variant: Any = None) -> Dict:
+    # A variant keeps otherwise identical requests (e.g. best-of-N candidates) apart in the cache;
+    # it is not sent to the provider
+    return kwargs if variant is None else {**kwargs, "variant": variant}
+
+
 def _extract_content(chunk, use_chat: bool) -> GenerationChunk:
     if hasattr(chunk, 'text'):
         return chunk
@@ -36,33 +117,256 @@ def _extract_content(chunk, use_chat: bool) -> GenerationChunk:
 
 
 class LLMService:
-    def __init__(self, provider_name: str = None, default_model: str = None):
+    def __init__(self, provider_name: str = None, default_model: str = None, cache: ResponseCache = None,
+                 telemetry: Telemetry = None, response_tokens: int = DEFAULT_RESPONSE_TOKENS):
         if provider_name is None:
             provider_name = "ollama"
         if default_model is None:
             default_model = "gemma2:27b"
         self.provider = LLMServiceFactory.get_provider(provider_name)
+        self.scheduler = LLMServiceFactory.get_scheduler(provider_name)
         self.default_model = default_model
+        self.cache = cache
+        self.telemetry = telemetry
+        self.response_tokens = response_tokens
+
+    def _request_tokens(self, kwargs: Dict, *texts: str) -> int:
+        # Token limits count the completion too; reserve the most it can take (max_tokens, else response_tokens)
+        return _estimate_tokens(*texts) + kwargs.get('max_tokens', self.response_tokens)
+
+    def _scheduled(self, call, stream: bool, priority: int, tokens: int, timing: Dict = None):
+        self.scheduler.acquire(priority, tokens)
+        if timing is not None:
+            timing['admitted'] = time.perf_counter()
+        try:
+            response = call()
+        except BaseException:
+            self.scheduler.release()
+            raise
+        if stream and not isinstance(response, (str, dict)):
+            return self.scheduler.hold(response)
+        self.scheduler.release()
+        return response
+
+    async def _ascheduled(self, call, stream: bool, priority: int, tokens: int, timing: Dict = None):
+        await self.scheduler.aacquire(priority, tokens)
+        if timing is not None:
+            timing['admitted'] = time.perf_counter()
+        try:
+            response = await call()
+        except BaseException:
+            self.scheduler.release()
+            raise
+        if stream and not isinstance(response, (str, dict)):
+            return self.scheduler.hold(response)
+        self.scheduler.release()
+        return response
+
+    def _observe(self, timing: Dict, prompt_type: str, model: str, prompt: str, response: Any, stream: bool,
+                 attempt: int, outcome: str, first_chunk_at: float = None, usage: Dict = None):
+        if self.telemetry is None:
+            return
+        now = time.perf_counter()
+        admitted = timing.get('admitted', timing['started'])
+        usage = usage or {}
+        text = response if isinstance(response, str) else json.dumps(response) if response is not None else ""
+        self.telemetry.record(prompt_type=prompt_type,
+                              provider=self.provider.name(),
+                              model=model,
+                              prompt_chars=len(prompt),
+                              response_chars=len(text),
+                              prompt_tokens=usage.get("prompt_tokens"),
+                              completion_tokens=usage.get("completion_tokens"),
+                              latency=now - admitted,
+                              ttft=first_chunk_at - admitted if first_chunk_at is not None else None,
+                              stream=stream,
+                              attempt=attempt,
+                              outcome=outcome,
+                              queue_wait_seconds=admitted - timing['started'])
+
+    def _stream_finisher(self, timing: Dict, cache_key: Optional[str], prompt_type: str, model: str, prompt: str,
+                         format: str, attempt: int, usage: Dict) -> StreamCallback:
+        def on_finish(text: str, outcome: str, first_chunk_at: Optional[float]):
+            if outcome == "ok":
+                self._store_text(cache_key, text, format, prompt_type)
+            # The provider fills in `usage` when the stream ends, e.g. from its last chunk
+            self._observe(timing, prompt_type, model, prompt, text, True, attempt, outcome, first_chunk_at, usage)
+        return on_finish
 
     def generate(self,
                  prompt: str,
                  model: str = None,
                  stream: bool = False,
                  format: str = None,
+                 prompt_type: str = None,
+                 priority: int = None,
+                 attempt: int = 0,
+                 variant: Any = None,
                  **kwargs) -> Union[str, Dict, Generator[str, None, None]]:
         model = model or self.default_model
-        response = self.provider.generate(model, prompt, stream, format, **kwargs)
+        timing = {'started': time.perf_counter()}
+        cache_key, cached = self._cache_lookup(prompt, model, format, prompt_type, _cache_kwargs(kwargs, variant))
+        if cached is not None:
+            self._observe(timing, prompt_type, model, prompt, cached, stream, attempt, "cached")
+            return _replay(cached) if stream else cached
 
-        if format == "json":
+        usage = {}
+        try:
+            response = self._scheduled(
+                lambda: self.provider.generate(model, prompt, stream, format, usage=usage, **kwargs), stream,
+                priority if priority is not None else priority_for(prompt_type), self._request_tokens(kwargs, prompt),
+                timing)
+        except Exception:
+            self._observe(timing, prompt_type, model, prompt, None, stream, attempt, "error")
+            raise
+        if stream:
+            return _process_response(response, stream, use_chat=False,
+                                     on_finish=self._stream_finisher(timing, cache_key, prompt_type, model, prompt,
+                                                                     format, attempt, usage))
+        result = self._finalize(response, stream, format, cache_key, prompt_type)
+        outcome = "invalid_json" if format == "json" and not isinstance(result, (dict, list)) else "ok"
+        self._observe(timing, prompt_type, model, prompt, result, stream, attempt, outcome, usage=usage)
+        return result
+
+    async def agenerate(self,
+                        prompt: str,
+                        model: str = None,
+                        stream: bool = False,
+                        format: str = None,
+                        prompt_type: str = None,
+                        priority: int = None,
+                        attempt: int = 0,
+                        variant: Any = None,
+                        **kwargs) -> Union[str, Dict, AsyncGenerator[str, None]]:
+        model = model or self.default_model
+        timing = {'started': time.perf_counter()}
+        cache_key, cached = self._cache_lookup(prompt, model, format, prompt_type, _cache_kwargs(kwargs, variant))
+        if cached is not None:
+            self._observe(timing, prompt_type, model, prompt, cached, stream, attempt, "cached")
+            return _areplay(cached) if stream else cached
+
+        usage = {}
+        try:
+            response = await self._ascheduled(
+                lambda: self.provider.agenerate(model, prompt, stream, format, usage=usage, **kwargs), stream,
+                priority if priority is not None else priority_for(prompt_type), self._request_tokens(kwargs, prompt),
+                timing)
+        except Exception:
+            self._observe(timing, prompt_type, model, prompt, None, stream, attempt, "error")
+            raise
+        if stream:
+            return _aprocess_response(response, stream, use_chat=False,
+                                      on_finish=self._stream_finisher(timing, cache_key, prompt_type, model, prompt,
+                                                                      format, attempt, usage))
+        result = self._finalize(response, stream, format, cache_key, prompt_type)
+        outcome = "invalid_json" if format == "json" and not isinstance(result, (dict, list)) else "ok"
+        self._observe(timing, prompt_type, model, prompt, result, stream, attempt, outcome, usage=usage)
+        return result
+
+    def generate_many(self,
+                      prompts: Sequence[str],
+                      model: str = None,
+                      format: str = None,
+                      prompt_type: str = None,
+                      priority: int = None,
+                      **kwargs) -> Generator[Tuple[int, Any], None, None]:
+        """
+        Runs a batch of prompts and yields (index, result) as they complete. Cached prompts are yielded
+        first; failed prompts yield the exception instead of raising, so the rest of the batch survives.
+        """
+        model = model or self.default_model
+        timing = {'started': time.perf_counter()}
+        cache_keys = {}
+        uncached = []
+        for index, prompt in enumerate(prompts):
+            cache_key, cached = self._cache_lookup(prompt, model, format, prompt_type, kwargs)
+            if cached is not None:
+                self._observe(timing, prompt_type, model, prompt, cached, False, 0, "cached")
+                yield index, cached
+            else:
+                cache_keys[index] = cache_key
+                uncached.append(index)
+        if not uncached:
+            return
+
+        priority = priority if priority is not None else priority_for(prompt_type)
+
+        def admit(prompt: str, block: bool) -> bool:
+            # Every request in flight holds its own slot, so batches and single calls share the provider's limit
+            if block:
+                self.scheduler.acquire(priority, self._request_tokens(kwargs, prompt))
+            elif not self.scheduler.try_acquire(priority, self._request_tokens(kwargs, prompt)):
+                return False
+            timing.setdefault('admitted', time.perf_counter())
+            return True
+
+        usages = [{} for _ in uncached]
+        results = self.provider.generate_many(model, [prompts[index] for index in uncached], format,
+                                              max_in_flight=self.scheduler.max_concurrency, admit=admit,
+                                              release=self.scheduler.release, usages=usages, **kwargs)
+        for position, response in results:
+            index = uncached[position]
+            if isinstance(response, Exception):
+                self._observe(timing, prompt_type, model, prompts[index], None, False, 0, "error")
+                yield index, response
+                continue
+            result = self._finalize(response, False, format, cache_keys[index], prompt_type)
+            outcome = "invalid_json" if format == "json" and not isinstance(result, (dict, list)) else "ok"
+            self._observe(timing, prompt_type, model, prompts[index], result, False, 0, outcome,
+                          usage=usages[position])
+            yield index, result
+
+    def _cache_lookup(self, prompt: str, model: str, format: str, prompt_type: str,
+                      kwargs: Dict) -> Tuple[Optional[str], Optional[Union[str, Dict]]]:
+        if self.cache is None or self.cache.should_bypass(prompt_type):
+            return None, None
+
+        cache_key = ResponseCache.make_key(self.provider.name(), model, prompt, format, kwargs)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Cache hit for {prompt_type or 'prompt'} ({self.provider.name()} - {model})")
+        return cache_key, cached
+
+    def _finalize(self, response: Union[str, Dict, Generator], stream: bool, format: str, cache_key: Optional[str],
+                  prompt_type: str) -> Union[str, Dict, Generator[str, None, None]]:
+        if format == "json" and not stream:
             if isinstance(response, dict):
+                self._store(cache_key, response, prompt_type)
                 return response
             try:
-                return json.loads(response) # type: ignore
+                result = json.loads(response) # type: ignore
+                self._store(cache_key, result, prompt_type)
+                return result
             except json.JSONDecodeError as e:
                 logger.error(f"Error decoding JSON\n\tMessage: {response}\n\tError:{str(e)}")
+        elif isinstance(response, str):
+            self._store(cache_key, response, prompt_type)
 
         return _process_response(response, stream, use_chat=False)
 
+    def _store(self, cache_key: str, response: Union[str, Dict], prompt_type: str = None):
+        if cache_key is not None:
+            self.cache.set(cache_key, response, prompt_type)
+
+    def _store_text(self, cache_key: str, text: str, format: str, prompt_type: str = None):
+        # Completed streams are cached like their non-streamed equivalent
+        if cache_key is None:
+            return
+        if format == "json":
+            try:
+                self._store(cache_key, json.loads(text), prompt_type)
+            except json.JSONDecodeError:
+                pass
+        else:
+            self._store(cache_key, text, prompt_type)
+
+    def invalidate(self, prompt: str, model: str = None, format: str = None, variant: Any = None, **kwargs):
+        """Drops a cached response, e.g. after it failed validation, so the next call regenerates it."""
+        if self.cache is not None:
+            model = model or self.default_model
+            self.cache.delete(ResponseCache.make_key(self.provider.name(), model, prompt, format,
+                                                     _cache_kwargs(kwargs, variant)))
+
     def chat(self,
              messages: List[Dict],
              model: str = None,
@@ -70,9 +374,37 @@ class LLMService:
              format: str = None,
              **kwargs) -> Union[str, Dict, Generator[str, None, None]]:
         model = model or self.default_model
-        response = self.provider.chat(model, messages, stream, format, **kwargs)
+        response = self._scheduled(lambda: self.provider.chat(model, messages, stream, format, **kwargs), stream,
+                                   priority_for(None),
+                                   self._request_tokens(kwargs, *[m.get('content', '') for m in messages]))
         return _process_response(response, stream, use_chat=True)
 
+    async def achat(self,
+                    messages: List[Dict],
+                    model: str = None,
+                    stream: bool = True,
+                    format: str = None,
+                    **kwargs) -> Union[str, Dict, AsyncGenerator[str, None]]:
+        model = model or self.default_model
+        response = await self._ascheduled(lambda: self.provider.achat(model, messages, stream, format, **kwargs),
+                                          stream, priority_for(None),
+                                          self._request_tokens(kwargs, *[m.get('content', '') for m in messages]))
+        return _aprocess_response(response, stream, use_chat=True)
+
+    def generate_embeddings(self, input: Union[str, List[str]], model: str = None, **kwargs) -> Dict:
+        texts = [input] if isinstance(input, str) else input
+        with self.scheduler.slot(priority_for(None), _estimate_tokens(*texts)):
+            return self.provider.generate_embeddings(model or self.default_model, input, **kwargs)
+
+    async def agenerate_embeddings(self, input: Union[str, List[str]], model: str = None, **kwargs) -> Dict:
+        texts = [input] if isinstance(input, str) else input
+        async with self.scheduler.aslot(priority_for(None), _estimate_tokens(*texts)):
+            return await self.provider.agenerate_embeddings(model or self.default_model, input, **kwargs)
+
+    @property
+    def models(self) -> List[str]:
+        return [self.default_model]
+
     def name(self):
         return f"{self.provider.name()} - {self.default_model} (default)"
 
@@ -1,16 +1,74 @@
+import threading
+from typing import Any, Dict
+
+from src.llm.RequestScheduler import RequestScheduler
+
 from src.llm.provider.BaseProvider import BaseProvider
 from src.llm.provider.OllamaProvider import OllamaProvider
 from src.llm.provider.ReplicateProvider import ReplicateProvider
 from src.llm.provider.OpenAIProvider import OpenAIProvider
+from src.utils.file_handlers import load_json
+
+SETTINGS_PATH = 'config/settings.json'
+
 
 class LLMServiceFactory:
+    _providers: Dict[str, BaseProvider] = {}
+    _schedulers: Dict[str, RequestScheduler] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_provider_settings(provider_name: str) -> Dict[str, Any]:
+        return load_json(SETTINGS_PATH).get('providers', {}).get(provider_name, {})
+
     @staticmethod
     def get_provider(provider_name: str) -> BaseProvider:
+        # Providers (and their HTTP clients) are created once and reused by every LLMService
+        with LLMServiceFactory._lock:
+            provider = LLMServiceFactory._providers.get(provider_name)
+            if provider is None:
+                provider = LLMServiceFactory._create_provider(provider_name)
+                LLMServiceFactory._providers[provider_name] = provider
+            return provider
+
+    @staticmethod
+    def _create_provider(provider_name: str) -> BaseProvider:
+        settings = LLMServiceFactory.get_provider_settings(provider_name)
         if provider_name == "openai":
             return OpenAIProvider()
         elif provider_name == "replicate":
-            return ReplicateProvider()
+            return ReplicateProvider(poll_interval=settings.get('poll_interval', 0.5),
+                                     max_poll_interval=settings.get('max_poll_interval', 5.0),
+                                     max_in_flight=settings.get('max_concurrency'))
         elif provider_name == "ollama":
-            return OllamaProvider()
+            return OllamaProvider(base_url=settings.get('base_url'),
+                                  pool_size=settings.get('pool_size', 10),
+                                  connect_timeout=settings.get('connect_timeout', 10),
+                                  read_timeout=settings.get('read_timeout', 600),
+                                  keep_alive=settings.get('keep_alive', "30m"),
+                                  num_ctx=settings.get('num_ctx'))
         else:
-            raise ValueError(f"Unsupported provider: {provider_name}")
\ No newline at end of file
+            raise ValueError(f"Unsupported provider: {provider_name}")
+
+    @staticmethod
+    def get_scheduler(provider_name: str) -> RequestScheduler:
+        # One scheduler per provider, shared by every LLMService using it
+        with LLMServiceFactory._lock:
+            scheduler = LLMServiceFactory._schedulers.get(provider_name)
+            if scheduler is None:
+                settings = LLMServiceFactory.get_provider_settings(provider_name)
+                scheduler = RequestScheduler.from_settings(provider_name, settings)
+                LLMServiceFactory._schedulers[provider_name] = scheduler
+            return scheduler
+
+    @staticmethod
+    def scheduler_stats() -> Dict[str, Dict[str, Any]]:
+        with LLMServiceFactory._lock:
+            schedulers = list(LLMServiceFactory._schedulers.values())
+        return {scheduler.name: scheduler.stats() for scheduler in schedulers}
+
+    @staticmethod
+    def provider_stats() -> Dict[str, Dict[str, Any]]:
+        with LLMServiceFactory._lock:
+            providers = dict(LLMServiceFactory._providers)
+        return {name: provider.stats() for name, provider in providers.items() if provider.stats()}
@@ -0,0 +1,180 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # Optional: without it token counts are estimated from the text length
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+DEFAULT_CONTEXT_WINDOW = 8192
+DEFAULT_RESPONSE_TOKENS = 4096
+
+
+def _model_id(model: str) -> str:
+    # Configured models may name their provider too, e.g. "openai | gpt-4o"
+    return model.split("|")[-1].strip()
+
+
+class Tokenizer:
+    """
+    Counts tokens with tiktoken when it is installed (the model's own encoding, or cl100k_base as an
+    approximation for non-OpenAI models), otherwise estimates ~4 characters per token.
+    """
+    _encodings: Dict[str, Any] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model: str = None):
+        self.model = model
+        self.encoding = self._encoding_for(model)
+
+    @classmethod
+    def _encoding_for(cls, model: str = None) -> Optional[Any]:
+        if tiktoken is None:
+            return None
+        with cls._lock:
+            if model not in cls._encodings:
+                try:
+                    cls._encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    cls._encodings[model] = cls._load("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"No tokenizer for {model}, estimating token counts: {str(e)}")
+                    cls._encodings[model] = None
+            return cls._encodings[model]
+
+    @staticmethod
+    def _load(name: str) -> Optional[Any]:
+        try:
+            return tiktoken.get_encoding(name)
+        except Exception as e:  # The encoding file is downloaded on first use
+            logger.warning(f"Tokenizer {name} unavailable, estimating token counts: {str(e)}")
+            return None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, tokens: int, keep: str = "end") -> str:
+        """Shortens text to `tokens` tokens, keeping its end (e.g. the most recent script) or its start."""
+        if tokens <= 0:
+            return ""
+        if self.encoding is None:
+            chars = tokens * CHARS_PER_TOKEN
+            if len(text) <= chars:
+                return text
+            return text[-chars:] if keep == "end" else text[:chars]
+        encoded = self.encoding.encode(text, disallowed_special=())
+        if len(encoded) <= tokens:
+            return text
+        return self.encoding.decode(encoded[-tokens:] if keep == "end" else encoded[:tokens])
+
+
+class PromptSection:
+    """
+    A variable part of a prompt. `variants` go from the full text to the most reduced one; if even the
+    last variant doesn't fit it is cut to size (`trim` = "start" drops the beginning, "end" the end) or,
+    with `trim` None, sent as is. Sections with a higher `priority` value are degraded first.
+    """
+    __slots__ = ("name", "variants", "priority", "trim")
+
+    def __init__(self, name: str, variants: Sequence[str], priority: int = 0, trim: str = None):
+        self.name = name
+        self.variants = list(variants)
+        self.priority = priority
+        self.trim = trim
+
+
+class PromptBudget:
+    """
+    Fits prompts into the context window of the models that may receive them, leaving room for the
+    response. Token counts come from a local tokenizer per model.
+    """
+
+    def __init__(self, model: str = None, context_window: int = DEFAULT_CONTEXT_WINDOW,
+                 response_tokens: int = DEFAULT_RESPONSE_TOKENS):
+        self.tokenizer = Tokenizer(model)
+        self.context_window = context_window
+        self.response_tokens = response_tokens
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], models: Sequence[str]) -> "PromptBudget":
+        # A prompt may fall back to any model of the chain, so the smallest window applies
+        windows = config.get('context_windows', {})
+        default = windows.get('default', DEFAULT_CONTEXT_WINDOW)
+        models = [_model_id(model) for model in models]
+        model = min(models, key=lambda m: windows.get(m, default)) if models else None
+        return cls(model, windows.get(model, default), config.get('response_tokens', DEFAULT_RESPONSE_TOKENS))
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.context_window - self.response_tokens
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def fit(self, template: str, sections: List[PromptSection], limits: Dict[str, int] = None,
+            **values: Any) -> Dict[str, str]:
+        """
+        Chooses the text of each section so that `template` formatted with them and `values` fits the
+        budget. `limits` caps individual sections in tokens. Returns the chosen text per section name.
+        """
+        limits = limits or {}
+        overhead = self.count(template.format(**values, **{section.name: "" for section in sections}))
+        budget = self.prompt_tokens - overhead
+
+        chosen = {}
+        tokens = {}
+        untrimmed = {}
+        for section in sections:
+            chosen[section.name] = section.variants[0]
+            tokens[section.name] = self.count(chosen[section.name])
+            limit = limits.get(section.name)
+            if limit is not None and tokens[section.name] > limit:
+                self._reduce(section, chosen, tokens, untrimmed, limit)
+
+        for section in sorted(sections, key=lambda s: s.priority, reverse=True):
+            used = sum(tokens.values())
+            if used <= budget:
+                break
+            self._reduce(section, chosen, tokens, untrimmed, tokens[section.name] - (used - budget))
+
+        # A section cut early may get room back once more important sections have been reduced
+        for section in sorted(sections, key=lambda s: s.priority):
+            if section.name not in untrimmed:
+                continue
+            allowance = budget - (sum(tokens.values()) - tokens[section.name])
+            limit = limits.get(section.name)
+            if limit is not None:
+                allowance = min(allowance, limit)
+            if allowance > tokens[section.name]:
+                self._trim(section, chosen, tokens, untrimmed[section.name], allowance)
+
+        used = sum(tokens.values())
+        if used > budget:
+            logger.warning(f"Prompt needs ~{used + overhead} tokens, more than the {self.prompt_tokens} available "
+                           f"for {self.tokenizer.model}")
+        return chosen
+
+    def _reduce(self, section: PromptSection, chosen: Dict[str, str], tokens: Dict[str, int],
+                untrimmed: Dict[str, str], allowance: int):
+        for variant in section.variants[1:]:
+            if tokens[section.name] <= allowance:
+                return
+            chosen[section.name] = variant
+            tokens[section.name] = self.count(variant)
+        if tokens[section.name] > allowance and section.trim is not None:
+            untrimmed.setdefault(section.name, chosen[section.name])
+            self._trim(section, chosen, tokens, untrimmed[section.name], allowance)
+
+    def _trim(self, section: PromptSection, chosen: Dict[str, str], tokens: Dict[str, int], text: str,
+              allowance: int):
+        keep = "end" if section.trim == "start" else "start"
+        chosen[section.name] = self.tokenizer.truncate(text, max(0, allowance), keep)
+        tokens[section.name] = self.count(chosen[section.name])
@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple
+
+# Lower value = served first. Scene work on the critical path outranks background evaluation.
+DEFAULT_PRIORITY = 5
+PRIORITIES = {
+    "GENERATE_SCENE": 0,
+    "REFINE_SCENE": 0,
+    "EVALUATE_SCENE": 1,
+    "SUMMARIZE_SCENE": 1,
+    "SUMMARIZE_SECTION": 1,
+    "GENERATE_ACTS": 2,
+    "REVISE_ACTS": 2,
+    "VALIDATE_ACTS": 2,
+    "GENERATE_KEY_SCENES": 2,
+    "VALIDATE_KEY_SCENES": 2,
+    "GENERATE_SUB_SCENES": 2,
+    "VALIDATE_SUB_SCENES": 2,
+    "REVIEW_OUTLINE": 3,
+    "VALIDATE_FINAL_OUTLINE": 3,
+    "DEVELOP_CHARACTERS": 3,
+    "IDENTIFY_THEMES": 3,
+    "EXTRACT_STORY_ELEMENTS": 6,
+    "EVALUATE_FULL_SCRIPT": 8,
+    "EVALUATE_ACT": 8,
+}
+
+
+def priority_for(prompt_type: str = None) -> int:
+    return PRIORITIES.get(prompt_type, DEFAULT_PRIORITY)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        # Requests larger than the bucket are let through once it is full, otherwise they would wait forever
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _SlotHoldingStream:
+    """Keeps a scheduler slot until the wrapped stream is exhausted, closed or garbage collected."""
+
+    def __init__(self, stream: Any, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def _finish(self):
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        try:
+            if close is not None and not self._released:
+                close()
+        finally:
+            self._finish()
+
+    def __aiter__(self) -> AsyncIterator:
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self._stream.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        aclose = getattr(self._stream, "aclose", None)
+        try:
+            if aclose is not None and not self._released:
+                await aclose()
+        finally:
+            self._finish()
+
+    def __del__(self):
+        self._finish()
+
+
+class RequestScheduler:
+    """
+    Admission control for one provider: a priority queue in front of a concurrency limit and
+    optional request/token rate limits (token buckets, per minute).
+    """
+
+    def __init__(self, name: str, max_concurrency: int = None, requests_per_minute: float = None,
+                 tokens_per_minute: float = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        # Futures of async waiters, resolved on their loop whenever a slot might have become available
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._admitted = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @classmethod
+    def from_settings(cls, name: str, settings: Dict[str, Any]) -> "RequestScheduler":
+        return cls(name,
+                   max_concurrency=settings.get('max_concurrency'),
+                   requests_per_minute=settings.get('requests_per_minute'),
+                   tokens_per_minute=settings.get('tokens_per_minute'))
+
+    def _rate_delay(self, tokens: int) -> float:
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.time_until(1))
+        if self.token_bucket is not None and tokens:
+            delay = max(delay, self.token_bucket.time_until(tokens))
+        return delay
+
+    def acquire(self, priority: int = DEFAULT_PRIORITY, tokens: int = 0):
+        entry = (priority, next(self._sequence))
+        enqueued = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            while True:
+                if self._admissible(entry):
+                    delay = self._rate_delay(tokens)
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+
+            heapq.heappop(self._queue)
+            self._admit(tokens, time.monotonic() - enqueued)
+            # The next entry in line may be admissible as well
+            self._notify()
+
+    def _admissible(self, entry: Tuple[int, int]) -> bool:
+        return self._queue[0] == entry and (self.max_concurrency is None or self._active < self.max_concurrency)
+
+    def _notify(self):
+        # Wakes sync and async waiters alike; called with the condition held
+        self._condition.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            if not loop.is_closed():  # A waiter that timed out may outlive its loop
+                loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    def try_acquire(self, priority: int = DEFAULT_PRIORITY, tokens: int = 0) -> bool:
+        """Takes a slot only if one is free right now and no request of the same or a higher priority waits."""
+        with self._condition:
+            if self._queue and self._queue[0][0] <= priority:
+                return False
+            if self.max_concurrency is not None and self._active >= self.max_concurrency:
+                return False
+            if self._rate_delay(tokens) > 0:
+                return False
+            self._admit(tokens, 0.0)
+            return True
+
+    def _admit(self, tokens: int, waited: float):
+        self._active += 1
+        if self.request_bucket is not None:
+            self.request_bucket.consume(1)
+        if self.token_bucket is not None and tokens:
+            self.token_bucket.consume(tokens)
+        self._admitted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._notify()
+
+    @contextmanager
+    def slot(self, priority: int = DEFAULT_PRIORITY, tokens: int = 0):
+        self.acquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def hold(self, stream: Any) -> _SlotHoldingStream:
+        """Transfers an acquired slot to a streamed response; it is released once the stream is done."""
+        return _SlotHoldingStream(iter(stream) if not hasattr(stream, "__anext__") else stream, self.release)
+
+    async def aacquire(self, priority: int = DEFAULT_PRIORITY, tokens: int = 0):
+        # Waits on the event loop rather than in a worker thread, so waiting requests don't tie up the executor
+        entry = (priority, next(self._sequence))
+        enqueued = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+        try:
+            while True:
+                with self._condition:
+                    delay = None
+                    if self._admissible(entry):
+                        delay = self._rate_delay(tokens)
+                        if delay <= 0:
+                            heapq.heappop(self._queue)
+                            self._admit(tokens, time.monotonic() - enqueued)
+                            self._notify()
+                            return
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+                await asyncio.wait({waiter}, timeout=delay)
+        except BaseException:
+            # Cancelled while queued: leave the queue so the entries behind can move up
+            with self._condition:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._notify()
+            raise
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = DEFAULT_PRIORITY, tokens: int = 0):
+        await self.aacquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "provider": self.name,
+                "queue_depth": len(self._queue),
+                "active": self._active,
+                "admitted": self._admitted,
+                "avg_wait_seconds": self._total_wait / self._admitted if self._admitted else 0.0,
+                "max_wait_seconds": self._max_wait,
+            }
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache for LLM responses, backed by SQLite.
+    Entries are keyed by a hash of provider, model, prompt, format and kwargs.
+    """
+
+    def __init__(self,
+                 path: str = "output/cache/llm_responses.sqlite",
+                 max_entries: int = None,
+                 max_bytes: int = None,
+                 max_age_seconds: float = None,
+                 bypass: Iterable[str] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bypass = set(bypass or [])
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                prompt_type TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._connection.commit()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["ResponseCache"]:
+        settings = config.get('response_cache', {})
+        if not settings.get('enabled', False):
+            return None
+
+        max_size_mb = settings.get('max_size_mb')
+        max_age_days = settings.get('max_age_days')
+        return cls(path=settings.get('path', "output/cache/llm_responses.sqlite"),
+                   max_entries=settings.get('max_entries'),
+                   max_bytes=int(max_size_mb * 1024 * 1024) if max_size_mb else None,
+                   max_age_seconds=max_age_days * 86400 if max_age_days else None,
+                   bypass=settings.get('bypass', []))
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: str, format: str = None, kwargs: Dict = None) -> str:
+        material = json.dumps({
+            "provider": provider,
+            "model": model,
+            "prompt": prompt,
+            "format": format,
+            "kwargs": kwargs or {},
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def should_bypass(self, prompt_type: str = None) -> bool:
+        if prompt_type is not None and prompt_type in self.bypass:
+            with self._lock:
+                self.bypassed += 1
+            return True
+        return False
+
+    def get(self, key: str) -> Optional[Union[str, Dict]]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, created_at FROM responses WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Union[str, Dict], prompt_type: str = None):
+        if value is None:
+            return
+
+        serialized = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, prompt_type, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, prompt_type, serialized, len(serialized), now, now))
+            self._evict(now)
+            self._connection.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def _evict(self, now: float):
+        # Expired entries first, then least recently used ones until the size limits are met.
+        if self.max_age_seconds is not None:
+            self._connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+
+        if self.max_entries is not None:
+            self._connection.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+
+        if self.max_bytes is not None:
+            total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((key,))
+                    total -= size
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "size_bytes": size,
+            }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "scriptwriter_llm"
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percentile * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Telemetry:
+    """
+    Records one entry per LLM call (prompt type, provider, model, sizes, tokens, latency,
+    time-to-first-token, retries, outcome). Entries are appended to a JSONL file as they happen
+    and summarised into a Prometheus textfile at the end of a run.
+    """
+
+    def __init__(self, jsonl_path: str = None, prometheus_path: str = None):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        for path in (jsonl_path, prometheus_path):
+            if path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["Telemetry"]:
+        settings = config.get('telemetry', {})
+        if not settings.get('enabled', False):
+            return None
+        return cls(jsonl_path=settings.get('jsonl_path', 'output/telemetry/llm_calls.jsonl'),
+                   prometheus_path=settings.get('prometheus_path', 'output/telemetry/llm_calls.prom'))
+
+    def record(self, prompt_type: str = None, provider: str = None, model: str = None, prompt_chars: int = 0,
+               response_chars: int = 0, prompt_tokens: int = None, completion_tokens: int = None,
+               latency: float = None, ttft: float = None, stream: bool = False, attempt: int = 0,
+               outcome: str = "ok", **extra: Any):
+        entry = {
+            "timestamp": time.time(),
+            "prompt_type": prompt_type or "UNKNOWN",
+            "provider": provider,
+            "model": model,
+            "prompt_chars": prompt_chars,
+            "response_chars": response_chars,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_seconds": latency,
+            "ttft_seconds": ttft,
+            "stream": stream,
+            "retries": attempt,
+            "outcome": outcome,
+            **extra,
+        }
+        with self._lock:
+            self.records.append(entry)
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def summary(self) -> Dict[tuple, Dict[str, Any]]:
+        with self._lock:
+            records = list(self.records)
+
+        groups = defaultdict(list)
+        for entry in records:
+            groups[(entry["prompt_type"], entry["provider"], entry["model"])].append(entry)
+
+        summary = {}
+        for key, entries in groups.items():
+            # Cache hits take no time at the provider and would drag the percentiles down; they are counted
+            # in the outcomes only
+            timed = [e for e in entries if e["outcome"] != "cached"]
+            latencies = [e["latency_seconds"] for e in timed if e["latency_seconds"] is not None]
+            ttfts = [e["ttft_seconds"] for e in timed if e["ttft_seconds"] is not None]
+            outcomes = defaultdict(int)
+            for e in entries:
+                outcomes[e["outcome"]] += 1
+            summary[key] = {
+                "calls": len(entries),
+                "outcomes": dict(outcomes),
+                "retries": sum(e["retries"] for e in entries),
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p95": _percentile(latencies, 0.95),
+                "latency_sum": sum(latencies),
+                "latency_count": len(latencies),
+                "ttft_p50": _percentile(ttfts, 0.5),
+                "ttft_p95": _percentile(ttfts, 0.95),
+                "ttft_sum": sum(ttfts),
+                "ttft_count": len(ttfts),
+                "prompt_chars": sum(e["prompt_chars"] for e in entries),
+                "response_chars": sum(e["response_chars"] for e in entries),
+                "prompt_tokens": sum(e["prompt_tokens"] or 0 for e in entries),
+                "completion_tokens": sum(e["completion_tokens"] or 0 for e in entries),
+            }
+        return summary
+
+    def write_prometheus(self, path: str = None):
+        path = path or self.prometheus_path
+        if not path:
+            return
+
+        lines = [
+            f"# HELP {METRIC_PREFIX}_latency_seconds Latency of LLM calls not served from the cache.",
+            f"# TYPE {METRIC_PREFIX}_latency_seconds summary",
+        ]
+        summary = self.summary()
+        for (prompt_type, provider, model), stats in summary.items():
+            labels = dict(prompt_type=prompt_type, provider=provider, model=model)
+            for quantile, value in (("0.5", stats["latency_p50"]), ("0.95", stats["latency_p95"])):
+                if value is not None:
+                    lines.append(f"{METRIC_PREFIX}_latency_seconds{_labels(**labels, quantile=quantile)} {value}")
+            lines.append(f"{METRIC_PREFIX}_latency_seconds_sum{_labels(**labels)} {stats['latency_sum']}")
+            lines.append(f"{METRIC_PREFIX}_latency_seconds_count{_labels(**labels)} {stats['latency_count']}")
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_ttft_seconds Time to first token of streamed LLM calls.",
+            f"# TYPE {METRIC_PREFIX}_ttft_seconds summary",
+        ]
+        for (prompt_type, provider, model), stats in summary.items():
+            if not stats["ttft_count"]:
+                continue
+            labels = dict(prompt_type=prompt_type, provider=provider, model=model)
+            for quantile, value in (("0.5", stats["ttft_p50"]), ("0.95", stats["ttft_p95"])):
+                lines.append(f"{METRIC_PREFIX}_ttft_seconds{_labels(**labels, quantile=quantile)} {value}")
+            lines.append(f"{METRIC_PREFIX}_ttft_seconds_sum{_labels(**labels)} {stats['ttft_sum']}")
+            lines.append(f"{METRIC_PREFIX}_ttft_seconds_count{_labels(**labels)} {stats['ttft_count']}")
+
+        counters = [
+            ("calls_total", "LLM calls by outcome."),
+            ("retries_total", "Retried LLM calls."),
+            ("prompt_chars_total", "Characters sent in prompts."),
+            ("response_chars_total", "Characters received in responses."),
+            ("prompt_tokens_total", "Prompt tokens reported by the provider."),
+            ("completion_tokens_total", "Completion tokens reported by the provider."),
+        ]
+        for name, help_text in counters:
+            lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}", f"# TYPE {METRIC_PREFIX}_{name} counter"]
+            for (prompt_type, provider, model), stats in summary.items():
+                labels = dict(prompt_type=prompt_type, provider=provider, model=model)
+                if name == "calls_total":
+                    for outcome, count in stats["outcomes"].items():
+                        lines.append(f"{METRIC_PREFIX}_{name}{_labels(**labels, outcome=outcome)} {count}")
+                else:
+                    lines.append(f"{METRIC_PREFIX}_{name}{_labels(**labels)} {stats[name[:-len('_total')]]}")
+
+        # Write-then-rename so a node exporter never reads a half-written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        logger.info(f"Saved LLM metrics to {path}")
+
+    def log_summary(self):
+        for (prompt_type, provider, model), stats in sorted(self.summary().items(), key=lambda item: str(item[0])):
+            logger.info(f"{prompt_type} [{provider} - {model}]: {stats['calls']} calls {stats['outcomes']}, "
+                        f"p50 {stats['latency_p50']}s, p95 {stats['latency_p95']}s, "
+                        f"{stats['prompt_tokens']} prompt / {stats['completion_tokens']} completion tokens")
@@ -1,13 +1,49 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict, Union, Generator
+from typing import Any, List, Dict, Union, Generator, AsyncGenerator, Iterator, Sequence, Tuple, Callable, Optional, \
+    Awaitable
+
+# Takes a scheduler slot for a prompt before it is sent: blocking, or only if one is free right away
+Admit = Callable[[str, bool], bool]
+
+async def _aiter_sync(iterator: Iterator) -> AsyncGenerator:
+    # Drains a blocking iterator from a worker thread so the event loop stays responsive
+    sentinel = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, sentinel)
+        if item is sentinel:
+            break
+        yield item
+
+
+def close_on_loop(close: Callable[[], Awaitable], loop: Optional[asyncio.AbstractEventLoop]):
+    """
+    Closes an async client that is being replaced, on the event loop it was created on. A client whose
+    loop is closed has lost its connections with it; one whose loop is idle is closed when it runs again.
+    """
+    if loop is None or loop.is_closed():
+        return
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(close(), loop)
+    else:
+        loop.call_soon_threadsafe(lambda: loop.create_task(close()))
+
 
 class BaseProvider(ABC):
+    @staticmethod
+    def record_usage(usage: Optional[Dict], prompt_tokens: int = None, completion_tokens: int = None, **extra):
+        # Calls report their token counts into the `usage` dict of the caller, which works whatever thread
+        # or task the response (or the end of its stream) arrives on
+        if usage is not None:
+            usage.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, **extra)
+
     @abstractmethod
     def name(self) -> str:
         pass
 
     @abstractmethod
-    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, **kwargs) -> Union[Dict, Generator]:
+    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                 **kwargs) -> Union[Dict, Generator]:
         pass
 
     @abstractmethod
@@ -48,4 +84,43 @@ class BaseProvider(ABC):
 
     @abstractmethod
     def list_running_models(self) -> Dict:
-        pass
\ No newline at end of file
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        # Provider-specific statistics logged at the end of a run
+        return {}
+
+    def generate_many(self, model: str, prompts: Sequence[str], format: str = None, max_in_flight: int = None,
+                      admit: Optional[Admit] = None, release: Optional[Callable[[], None]] = None,
+                      usages: Optional[List[Dict]] = None, **kwargs) -> Generator[Tuple[int, Any], None, None]:
+        # Yields (index, result) per prompt, failures as the exception. Providers with a batch
+        # API override this; the default runs the prompts one after another. Each request in
+        # flight holds a slot taken with `admit` and given back with `release`; the usage of
+        # each prompt goes into its dict in `usages`.
+        for index, prompt in enumerate(prompts):
+            if admit is not None:
+                admit(prompt, True)
+            try:
+                result = self.generate(model, prompt, False, format,
+                                       usage=usages[index] if usages is not None else None, **kwargs)
+            except Exception as e:
+                result = e
+            finally:
+                if release is not None:
+                    release()
+            yield index, result
+
+    # Async interface. The defaults run the blocking implementation in a worker thread;
+    # providers with a native async client override these.
+    async def agenerate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                        **kwargs) -> Union[Dict, AsyncGenerator]:
+        response = await asyncio.to_thread(self.generate, model, prompt, stream, format, usage=usage, **kwargs)
+        return _aiter_sync(iter(response)) if stream else response
+
+    async def achat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
+        Dict, AsyncGenerator]:
+        response = await asyncio.to_thread(self.chat, model, messages, stream, format, **kwargs)
+        return _aiter_sync(iter(response)) if stream else response
+
+    async def agenerate_embeddings(self, model: str, input: Union[str, List[str]], **kwargs) -> Dict:
+        return await asyncio.to_thread(self.generate_embeddings, model, input, **kwargs)
@@ -1,60 +1,203 @@
+import asyncio
+import httpx
+import os
 import requests
 import json
-from typing import List, Dict, Union, Generator
+import threading
+from collections import defaultdict
+from typing import Any, List, Dict, Union, Generator, AsyncGenerator
 
-from src.llm.provider.BaseProvider import BaseProvider
+from src.llm.provider.BaseProvider import BaseProvider, close_on_loop
+from src.llm.provider.SessionPool import SessionPool
+
+
+class PrefixStats:
+    """
+    Estimates how much prompt evaluation Ollama's prompt cache saves. Each prompt is compared with the
+    previous prompt for the same model; the tokens-per-character ratio is calibrated on calls that shared
+    no prefix, so the difference between expected and actually evaluated prompt tokens is the reuse.
+    """
+
+    def __init__(self):
+        self._last_prompt: Dict[str, str] = {}
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, prompt: str, evaluated: int, duration_ns: int = None):
+        with self._lock:
+            stats = self._stats[model]
+            shared = len(os.path.commonprefix([self._last_prompt.get(model, ""), prompt]))
+            self._last_prompt[model] = prompt
+            if shared == 0 and evaluated:
+                stats["calibration_chars"] += len(prompt)
+                stats["calibration_tokens"] += evaluated
+            tokens_per_char = (stats["calibration_tokens"] / stats["calibration_chars"]
+                               if stats["calibration_chars"] else 0.25)
+            saved = max(0.0, len(prompt) * tokens_per_char - evaluated)
+            seconds_per_token = duration_ns / 1e9 / evaluated if duration_ns and evaluated else 0.0
+
+            stats["requests"] += 1
+            stats["prompt_chars"] += len(prompt)
+            stats["shared_prefix_chars"] += shared
+            stats["evaluated_tokens"] += evaluated
+            stats["prompt_eval_seconds"] += (duration_ns or 0) / 1e9
+            stats["reused_tokens_estimate"] += saved
+            stats["saved_seconds_estimate"] += saved * seconds_per_token
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {model: {"requests": int(stats["requests"]),
+                            "shared_prefix_ratio": stats["shared_prefix_chars"] / stats["prompt_chars"]
+                            if stats["prompt_chars"] else 0.0,
+                            "evaluated_tokens": int(stats["evaluated_tokens"]),
+                            "reused_tokens_estimate": int(stats["reused_tokens_estimate"]),
+                            "prompt_eval_seconds": round(stats["prompt_eval_seconds"], 2),
+                            "saved_seconds_estimate": round(stats["saved_seconds_estimate"], 2)}
+                    for model, stats in self._stats.items()}
 
 
 class OllamaProvider(BaseProvider):
-    def __init__(self, base_url: str = "http://localhost:11434"):
-        self.base_url = base_url
+    def __init__(self, base_url: str = None, pool_size: int = 10, connect_timeout: float = 10,
+                 read_timeout: float = 600, keep_alive: Union[str, int] = "30m", num_ctx: int = None):
+        self.base_url = (base_url or "http://localhost:11434").rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        # A loaded model keeps the KV cache of its last prompt, which the next prompt with the same
+        # prefix reuses. keep_alive stops the model from being unloaded between calls; num_ctx must fit
+        # the longest prompt, otherwise Ollama truncates its start and the shared prefix is lost.
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.prefix_stats = PrefixStats()
+        self.session = SessionPool.get(self.base_url, pool_size)
+        self._async_client = None
+        self._async_client_loop = None
 
     def name(self) -> str:
         return "ollama"
 
-    def _make_request(self, endpoint: str, data: Dict, stream: bool = False) -> Union[Dict, Generator]:
+    def _make_request(self, endpoint: str, data: Dict, stream: bool = False,
+                      usage: Dict = None) -> Union[Dict, Generator]:
         url = f"{self.base_url}{endpoint}"
-        headers = {"Content-Type": "application/json"}
 
         if stream:
-            response = requests.post(url, json=data, headers=headers, stream=True)
-            return self._stream_response(response)
+            response = self.session.post(url, json=data, stream=True, timeout=self.timeout)
+            return self._stream_response(response, data, usage)
         else:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()
+            response = self.session.post(url, json=data, timeout=self.timeout)
+            return self._record_usage(response.json(), data, usage)
 
-    def _stream_response(self, response: requests.Response) -> Generator:
-        for line in response.iter_lines():
-            if line:
-                yield json.loads(line)
+    def _stream_response(self, response: requests.Response, request: Dict, usage: Dict = None) -> Generator:
+        # Closing the response hands the connection back to the pool, also when the consumer stops early
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield self._record_usage(json.loads(line), request, usage)
+        finally:
+            response.close()
 
-    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, **kwargs) -> Union[
-        Dict, Generator]:
+    def _record_usage(self, data: Dict, request: Dict = None, usage: Dict = None) -> Dict:
+        # Final generate/chat responses carry token counts and timings (in nanoseconds)
+        if isinstance(data, dict) and "eval_count" in data:
+            self.record_usage(usage,
+                              prompt_tokens=data.get("prompt_eval_count"),
+                              completion_tokens=data.get("eval_count"),
+                              prompt_eval_duration=data.get("prompt_eval_duration"),
+                              eval_duration=data.get("eval_duration"),
+                              load_duration=data.get("load_duration"))
+            if request is not None:
+                prompt = request.get("prompt") or "".join(m.get("content", "") for m in request.get("messages", []))
+                self.prefix_stats.observe(request.get("model"), prompt, data.get("prompt_eval_count") or 0,
+                                          data.get("prompt_eval_duration"))
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        return {"prefix_reuse": self.prefix_stats.summary()}
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # httpx clients are bound to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            if self._async_client is not None:
+                close_on_loop(self._async_client.aclose, self._async_client_loop)
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def _amake_request(self, endpoint: str, data: Dict, stream: bool = False,
+                             usage: Dict = None) -> Union[Dict, AsyncGenerator]:
+        client = self._get_async_client()
+        if stream:
+            return self._astream_response(client, endpoint, data, usage)
+        response = await client.post(endpoint, json=data)
+        return self._record_usage(response.json(), data, usage)
+
+    async def _astream_response(self, client: httpx.AsyncClient, endpoint: str, data: Dict,
+                                usage: Dict = None) -> AsyncGenerator:
+        async with client.stream("POST", endpoint, json=data) as response:
+            async for line in response.aiter_lines():
+                if line:
+                    yield self._record_usage(json.loads(line), data, usage)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _options(self, **options) -> Dict:
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        return options
+
+    def _generate_payload(self, model: str, prompt: str, stream: bool, format: str, **kwargs) -> Dict:
         data = {
             "model": model,
             "prompt": prompt,
             "stream": stream,
-            "options":{
-                "num_predict": -1,
-                      },
+            "keep_alive": self.keep_alive,
+            "options": self._options(num_predict=-1),
             **kwargs
         }
         if format == "json":
             data["format"] = "json"
-        response = self._make_request("/api/generate", data, stream)
-        return response.get("response") if isinstance(response, dict) else response
+        return data
 
-    def chat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
-        Dict, Generator]:
+    def _chat_payload(self, model: str, messages: List[Dict], stream: bool, format: str, **kwargs) -> Dict:
         data = {
             "model": model,
             "messages": messages,
             "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": self._options(),
             **kwargs
         }
         if format == "json":
             data["format"] = "json"
-        return self._make_request("/api/chat", data, stream)
+        return data
+
+    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                 **kwargs) -> Union[Dict, Generator]:
+        data = self._generate_payload(model, prompt, stream, format, **kwargs)
+        response = self._make_request("/api/generate", data, stream, usage)
+        return response.get("response") if isinstance(response, dict) else response
+
+    async def agenerate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                        **kwargs) -> Union[Dict, AsyncGenerator]:
+        data = self._generate_payload(model, prompt, stream, format, **kwargs)
+        response = await self._amake_request("/api/generate", data, stream, usage)
+        return response.get("response") if isinstance(response, dict) else response
+
+    def chat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
+        Dict, Generator]:
+        return self._make_request("/api/chat", self._chat_payload(model, messages, stream, format, **kwargs), stream)
+
+    async def achat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
+        Dict, AsyncGenerator]:
+        return await self._amake_request("/api/chat", self._chat_payload(model, messages, stream, format, **kwargs),
+                                         stream)
+
     def create_model(self, name: str, modelfile: str, stream: bool = True) -> Union[Dict, Generator]:
         data = {
             "name": name,
@@ -64,7 +207,7 @@ class OllamaProvider(BaseProvider):
         return self._make_request("/api/create", data, stream)
 
     def list_models(self) -> List:
-        return requests.get(f"{self.base_url}/api/tags").json().get("models")
+        return self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout).json().get("models")
 
     def show_model(self, name: str) -> Dict:
         data = {"name": name}
@@ -78,7 +221,7 @@ class OllamaProvider(BaseProvider):
         return self._make_request("/api/copy", data)
 
     def delete_model(self, name: str) -> Dict:
-        return requests.delete(f"{self.base_url}/api/delete", json={"name": name}).json()
+        return self.session.delete(f"{self.base_url}/api/delete", json={"name": name}, timeout=self.timeout).json()
 
     def pull_model(self, name: str, stream: bool = True) -> Union[Dict, Generator]:
         data = {
@@ -102,8 +245,16 @@ class OllamaProvider(BaseProvider):
         }
         return self._make_request("/api/embed", data)
 
+    async def agenerate_embeddings(self, model: str, input: Union[str, List[str]], **kwargs) -> Dict:
+        data = {
+            "model": model,
+            "input": input,
+            **kwargs
+        }
+        return await self._amake_request("/api/embed", data)
+
     def list_running_models(self) -> Dict:
-        return requests.get(f"{self.base_url}/api/ps").json()
+        return self.session.get(f"{self.base_url}/api/ps", timeout=self.timeout).json()
 
 # Example usage:
 # ollama = OllamaProvider()
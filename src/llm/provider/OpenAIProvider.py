@@ -1,30 +1,48 @@
+import asyncio
 import os
 import json
 import logging
 import re
-from typing import List, Dict, Union, Generator
+from typing import List, Dict, Union, Generator, AsyncGenerator, Optional
 
-from openai import OpenAI, Stream
+from openai import OpenAI, AsyncOpenAI, Stream, AsyncStream
 from openai.types.chat import ChatCompletionChunk
 from openai.types.completion import Completion
 
-from src.llm.provider.BaseProvider import BaseProvider
+from src.llm.provider.BaseProvider import BaseProvider, close_on_loop
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class OpenAIProvider(BaseProvider):
     def __init__(self, api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"), base_url="http://192.168.0.254:4000")
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.base_url = "http://192.168.0.254:4000"
+        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        self._async_client = None
+        self._async_client_loop = None
         self.logger = logging.getLogger(__name__)
 
+    def _get_async_client(self) -> AsyncOpenAI:
+        # The underlying httpx client is bound to the event loop it was first used on
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            if self._async_client is not None:
+                close_on_loop(self._async_client.close, self._async_client_loop)
+            self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+            self._async_client_loop = loop
+        return self._async_client
+
     def name(self) -> str:
         return "openai"
 
-    def _generate(self, model: str, messages: List[Dict], stream: bool = False, **kwargs) -> Union[
+    def _generate(self, model: str, messages: List[Dict], stream: bool = False, usage: Dict = None,
+                  **kwargs) -> Union[
         Completion, Stream[ChatCompletionChunk]]:
+        if stream:
+            kwargs.setdefault("stream_options", {"include_usage": True})
         try:
-            return self.client.chat.completions.create(
+            response = self.client.chat.completions.create(
                 model=model,
                 messages=messages,
                 stream=stream,
@@ -33,32 +51,74 @@ class OpenAIProvider(BaseProvider):
         except Exception as e:
             self.logger.error(f"Error in generate: {str(e)}")
             raise
+        if not stream:
+            self._record_completion_usage(usage, response.usage)
+        return response
 
-    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, **kwargs) -> Union[
-        Dict, Generator]:
+    async def _agenerate(self, model: str, messages: List[Dict], stream: bool = False, usage: Dict = None,
+                         **kwargs) -> Union[
+        Completion, AsyncStream[ChatCompletionChunk]]:
+        if stream:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        try:
+            response = await self._get_async_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=stream,
+                **kwargs
+            )
+        except Exception as e:
+            self.logger.error(f"Error in agenerate: {str(e)}")
+            raise
+        if not stream:
+            self._record_completion_usage(usage, response.usage)
+        return response
+
+    def _record_completion_usage(self, usage: Optional[Dict], completion_usage):
+        if completion_usage is not None:
+            self.record_usage(usage, prompt_tokens=completion_usage.prompt_tokens,
+                              completion_tokens=completion_usage.completion_tokens)
+
+    def _parse_content(self, content: str, format: str = None) -> Union[str, Dict]:
+        try:
+            try:
+                try:
+                    return json.loads(content) if format == "json" else content
+                except json.JSONDecodeError as e:
+                    p = re.compile('(?<!\\\\)\'')
+                    content = p.sub('\"', content)
+                    return json.loads(content) if format == "json" else content
+            except json.JSONDecodeError as e:
+                content = content.split("\n",1)[1]
+        except Exception as e:
+            self.logger.error(f"Error in generate: {str(e)}")
+            return content
+
+    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                 **kwargs) -> Union[Dict, Generator]:
         messages = [{"role": "user", "content": prompt}]
         if format == "json":
             kwargs["response_format"] = {"type": "json_object"}
 
-        response = self._generate(model, messages, stream, **kwargs)
+        response = self._generate(model, messages, stream, usage, **kwargs)
 
         if stream:
-            return self._stream_generate(response)
+            return self._stream_generate(response, usage)
         else:
-            content = response.choices[0].message.content
-            try:
-                try:
-                    try:
-                        return json.loads(content) if format == "json" else content
-                    except json.JSONDecodeError as e:
-                        p = re.compile('(?<!\\\\)\'')
-                        content = p.sub('\"', content)
-                        return json.loads(content) if format == "json" else content
-                except json.JSONDecodeError as e:
-                    content = content.split("\n",1)[1]
-            except Exception as e:
-                self.logger.error(f"Error in generate: {str(e)}")
-                return content
+            return self._parse_content(response.choices[0].message.content, format)
+
+    async def agenerate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                        **kwargs) -> Union[Dict, AsyncGenerator]:
+        messages = [{"role": "user", "content": prompt}]
+        if format == "json":
+            kwargs["response_format"] = {"type": "json_object"}
+
+        response = await self._agenerate(model, messages, stream, usage, **kwargs)
+
+        if stream:
+            return self._astream_generate(response, usage)
+        else:
+            return self._parse_content(response.choices[0].message.content, format)
 
     def chat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
         Dict, Generator]:
@@ -73,10 +133,42 @@ class OpenAIProvider(BaseProvider):
             content = response.choices[0].message.content
             return json.loads(content) if format == "json" else content
 
-    def _stream_generate(self, response: Stream[ChatCompletionChunk]) -> Generator[str, None, None]:
-        for chunk in response:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+    async def achat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
+        Dict, AsyncGenerator]:
+        if format == "json":
+            kwargs["response_format"] = {"type": "json_object"}
+
+        response = await self._agenerate(model, messages, stream, **kwargs)
+
+        if stream:
+            return self._astream_generate(response)
+        else:
+            content = response.choices[0].message.content
+            return json.loads(content) if format == "json" else content
+
+    def _stream_generate(self, response: Stream[ChatCompletionChunk],
+                         usage: Dict = None) -> Generator[str, None, None]:
+        # Closing the stream aborts the request when the consumer stops early
+        try:
+            for chunk in response:
+                # With include_usage the final chunk has no choices, only the usage
+                if chunk.usage is not None:
+                    self._record_completion_usage(usage, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    async def _astream_generate(self, response: AsyncStream[ChatCompletionChunk],
+                                usage: Dict = None) -> AsyncGenerator[str, None]:
+        try:
+            async for chunk in response:
+                if chunk.usage is not None:
+                    self._record_completion_usage(usage, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
 
     def create_model(self, name: str, modelfile: str, stream: bool = True) -> Union[Dict, Generator]:
         self.logger.warning("create_model is not supported by OpenAI.")
@@ -118,15 +210,31 @@ class OpenAIProvider(BaseProvider):
                 input=input,
                 **kwargs
             )
-            return {
-                "embeddings": [embedding.embedding for embedding in response.data],
-                "model": response.model,
-                "usage": response.usage.dict()
-            }
+            return self._embeddings_result(response)
         except Exception as e:
             self.logger.error(f"Error in generate_embeddings: {str(e)}")
             raise
 
+    async def agenerate_embeddings(self, model: str, input: Union[str, List[str]], **kwargs) -> Dict:
+        try:
+            response = await self._get_async_client().embeddings.create(
+                model=model,
+                input=input,
+                **kwargs
+            )
+            return self._embeddings_result(response)
+        except Exception as e:
+            self.logger.error(f"Error in agenerate_embeddings: {str(e)}")
+            raise
+
+    @staticmethod
+    def _embeddings_result(response) -> Dict:
+        return {
+            "embeddings": [embedding.embedding for embedding in response.data],
+            "model": response.model,
+            "usage": response.usage.dict()
+        }
+
     def list_running_models(self) -> Dict:
         self.logger.warning("list_running_models is not applicable to OpenAI. Returning available models instead.")
         return self.list_models()
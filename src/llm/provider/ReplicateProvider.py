@@ -1,19 +1,28 @@
 import json
 import logging
 import os
+import time
 import replicate
-from typing import List, Dict, Union, Generator, Any, Iterator
+from typing import List, Dict, Union, Generator, Any, Iterator, AsyncGenerator, AsyncIterator, Sequence, Tuple, \
+    Callable, Optional
 
+from replicate.prediction import Prediction
 from replicate.stream import ServerSentEvent
 
-from src.llm.provider.BaseProvider import BaseProvider
+from src.llm.provider.BaseProvider import Admit, BaseProvider
 
 logger = logging.getLogger(__name__)
 
+TERMINAL_STATES = ("succeeded", "failed", "canceled")
+
 
 class ReplicateProvider(BaseProvider):
-    def __init__(self, api_token: str = None):
+    def __init__(self, api_token: str = None, poll_interval: float = 0.5, max_poll_interval: float = 5.0,
+                 max_in_flight: int = None):
         self.client = replicate.Client(api_token=api_token or os.environ.get("REPLICATE_API_TOKEN"))
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_in_flight = max_in_flight
 
     def name(self) -> str:
         return f"replicate"
@@ -32,12 +41,31 @@ class ReplicateProvider(BaseProvider):
             logger.error(f"Unexpected error: {str(e)}")
             raise
 
-    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, **kwargs) -> Union[
-        Dict, Generator]:
+    async def _agenerate(self, model: str, input_data: Dict, stream: bool = False) -> AsyncIterator[
+        ServerSentEvent] | Any:
+        try:
+            if stream:
+                return await self.client.async_stream(model, input=input_data)
+            output = await self.client.async_run(model, input=input_data)
+            if hasattr(output, "__aiter__"):
+                return "".join([chunk async for chunk in output])
+            return "".join(output) if isinstance(output, list) else output
+        except replicate.exceptions.ModelError as e:
+            logger.error(f"Model error: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            raise
+
+    @staticmethod
+    def _input_data(prompt: str, format: str = None, **kwargs) -> Dict:
         input_data = {"prompt": prompt, "max_tokens": 8138, **kwargs}
         if format == "json":
             input_data["format"] = "json"
-        response = self._generate(model, input_data, stream)
+        return input_data
+
+    @staticmethod
+    def _parse_response(response: Any, format: str = None) -> Any:
         if format == "json":
             try:
                 return json.loads(response)
@@ -45,12 +73,113 @@ class ReplicateProvider(BaseProvider):
                 logger.error(f"Error decoding JSON\n\tMessage: {response}\n\tError:{str(e)}")
         return response
 
+    def generate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                 **kwargs) -> Union[Dict, Generator]:
+        # run and stream don't return the prediction's metrics, so only batched predictions report usage
+        response = self._generate(model, self._input_data(prompt, format, **kwargs), stream)
+        return response if stream else self._parse_response(response, format)
+
+    async def agenerate(self, model: str, prompt: str, stream: bool = True, format: str = None, usage: Dict = None,
+                        **kwargs) -> Union[Dict, AsyncGenerator]:
+        response = await self._agenerate(model, self._input_data(prompt, format, **kwargs), stream)
+        return response if stream else self._parse_response(response, format)
+
+    def _create_prediction(self, model: str, input_data: Dict) -> Prediction:
+        # "owner/name:version" pins a version, "owner/name" runs the model's latest version
+        if ":" in model:
+            return self.client.predictions.create(version=model.split(":", 1)[1], input=input_data)
+        owner, name = model.split("/", 1)
+        return self.client.models.predictions.create(model=(owner, name), input=input_data)
+
+    def _prediction_result(self, prediction: Prediction, format: str = None, usage: Dict = None) -> Any:
+        if prediction.status != "succeeded":
+            logger.error(f"Prediction {prediction.id} {prediction.status}: {prediction.error}")
+            return replicate.exceptions.ModelError(prediction)
+        metrics = prediction.metrics or {}
+        self.record_usage(usage, metrics.get("input_token_count"), metrics.get("output_token_count"),
+                          predict_time=metrics.get("predict_time"))
+        output = prediction.output
+        response = "".join(output) if isinstance(output, list) else output
+        return self._parse_response(response, format)
+
+    def generate_many(self, model: str, prompts: Sequence[str], format: str = None, max_in_flight: int = None,
+                      admit: Optional[Admit] = None, release: Optional[Callable[[], None]] = None,
+                      usages: Optional[List[Dict]] = None, **kwargs) -> Generator[Tuple[int, Any], None, None]:
+        """
+        Submits one prediction per prompt and polls them together, yielding (index, result) in completion
+        order. Failed predictions yield a ModelError. Closing the generator cancels the predictions still running.
+        The token counts of each prediction go into its dict in `usages`.
+        Each prediction holds a scheduler slot taken with `admit`: the batch waits for one slot when nothing
+        is in flight and otherwise only grows into slots that are free.
+        """
+        max_in_flight = max_in_flight or self.max_in_flight
+        queued = list(enumerate(prompts))[::-1]
+        in_flight: Dict[int, Prediction] = {}
+        interval = self.poll_interval
+        try:
+            while queued or in_flight:
+                while queued and (max_in_flight is None or len(in_flight) < max_in_flight):
+                    index, prompt = queued[-1]
+                    if admit is not None and not admit(prompt, not in_flight):
+                        break
+                    queued.pop()
+                    try:
+                        in_flight[index] = self._create_prediction(model, self._input_data(prompt, format, **kwargs))
+                    except Exception:
+                        if release is not None:
+                            release()
+                        raise
+
+                finished = []
+                for index, prediction in in_flight.items():
+                    if prediction.status not in TERMINAL_STATES:
+                        try:
+                            prediction.reload()
+                        except Exception as e:
+                            logger.warning(f"Polling prediction {prediction.id} failed, retrying: {str(e)}")
+                            continue
+                    if prediction.status in TERMINAL_STATES:
+                        finished.append(index)
+
+                for index in finished:
+                    prediction = in_flight.pop(index)
+                    if release is not None:
+                        release()
+                    yield index, self._prediction_result(prediction, format,
+                                                         usages[index] if usages is not None else None)
+
+                if finished:
+                    interval = self.poll_interval
+                elif in_flight:
+                    # Back off while nothing completes, up to max_poll_interval between polls
+                    time.sleep(interval)
+                    interval = min(interval * 2, self.max_poll_interval)
+        finally:
+            self.cancel([prediction.id for prediction in in_flight.values()
+                         if prediction.status not in TERMINAL_STATES])
+            if release is not None:
+                for _ in in_flight:
+                    release()
+
+    def cancel(self, prediction_ids: Sequence[str]):
+        for prediction_id in prediction_ids:
+            try:
+                self.client.predictions.cancel(prediction_id)
+                logger.info(f"Canceled prediction {prediction_id}")
+            except Exception as e:
+                logger.warning(f"Could not cancel prediction {prediction_id}: {str(e)}")
+
     def chat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
         Dict, Generator]:
         # Replicate doesn't distinguish between chat and generate, so we'll use the same method. This method is just a wrapper to align with the necessary interface.
         prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
         return self.generate(model, prompt, stream, format, **kwargs)
 
+    async def achat(self, model: str, messages: List[Dict], stream: bool = True, format: str = None, **kwargs) -> Union[
+        Dict, AsyncGenerator]:
+        prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+        return await self.agenerate(model, prompt, stream, format, **kwargs)
+
     def create_model(self, name: str, modelfile: str, stream: bool = True) -> Union[Dict, Generator]:
         logger.warning("create_model is not directly supported by Replicate. Using model creation API instead.")
         try:
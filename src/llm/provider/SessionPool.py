@@ -0,0 +1,35 @@
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool:
+    """
+    Process-wide registry of pooled keep-alive HTTP sessions, one per base URL and pool size.
+    Sessions are shared between provider instances and threads.
+    """
+    _sessions: Dict[Tuple[str, int], requests.Session] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, base_url: str, pool_size: int = 10) -> requests.Session:
+        key = (base_url.rstrip("/"), pool_size)
+        with cls._lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+                cls._sessions[key] = session
+            return session
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
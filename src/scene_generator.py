@@ -1,31 +1,74 @@
+import hashlib
 import json
 import os
-from copy import deepcopy
-from functools import cmp_to_key
-from math import inf
-from typing import Dict, Any, List, Optional, Tuple
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Tuple, Callable
 import logging
 
 from tqdm import tqdm
 
-from prompts.scene import GENERATE_SCENE, EVALUATE_SCENE, REFINE_SCENE, EXTRACT_STORY_ELEMENTS, EVALUATE_FULL_SCRIPT
+from prompts.scene import GENERATE_SCENE, EVALUATE_SCENE, REFINE_SCENE, EXTRACT_STORY_ELEMENTS, EVALUATE_FULL_SCRIPT, \
+    EVALUATE_ACT
 from src.llm.LLMService import LLMService
+from src.llm.PromptBudget import PromptBudget, PromptSection, CHARS_PER_TOKEN
+from src.llm.Telemetry import Telemetry
+from src.utils.ContextIndex import ContextIndex
 from src.utils.JSONValidator import JSONValidator
-from src.utils.file_handlers import load_txt, save_json, save_txt
-from src.utils.sort_and_compare import compare_scene_numbers
+from src.utils.OutlineIndex import OutlineIndex, OutlineView
+from src.utils.OutlineModel import SceneContent, scene_key
+from src.utils.SceneJournal import SceneJournal, SceneProgress
+from src.utils.SceneManifest import SceneManifest
+from src.utils.ScriptBuffer import ScriptBuffer
+from src.utils.ScriptSummaries import ScriptSummaries
+from src.utils.StoryElementStore import StoryElementStore
+from src.utils.StreamingSceneParser import StreamingSceneParser, SceneStreamError
+from src.utils.file_handlers import load_json, load_txt, save_json, save_txt
 
 logger = logging.getLogger(__name__)
 
 
-def generate_scene_with_validation(llm_service: LLMService, prompt: str, max_attempts: int = 3) -> Optional[
-    Dict[str, Any]]:
+def _generate_scene_streaming(llm_service: LLMService, prompt: str, prompt_type: str, attempt: int = 0,
+                              variant: Any = None, cancel: threading.Event = None) -> Optional[Dict[str, Any]]:
+    parser = StreamingSceneParser()
+    stream = llm_service.generate(prompt, stream=True, format="json", prompt_type=prompt_type, attempt=attempt,
+                                  variant=variant)
+    try:
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                return None
+            parser.feed(chunk.text)
+    except SceneStreamError as e:
+        logger.warning(f"Aborted scene generation after {parser.items_validated} valid content items: {e}")
+        return None
+    finally:
+        stream.close()
+    return parser.result()
+
+
+def generate_scene_with_validation(llm_service: LLMService, prompt: str, max_attempts: int = 3,
+                                   prompt_type: str = "GENERATE_SCENE", stream: bool = False, variant: Any = None,
+                                   cancel: threading.Event = None) -> Optional[Dict[str, Any]]:
     for attempt in range(max_attempts):
-        scene_json = llm_service.generate(prompt, format="json")
-        validated_scene = JSONValidator.validate_scene_json(scene_json)
+        if cancel is not None and cancel.is_set():
+            return None
+        if stream:
+            # Invalid structure is detected while tokens arrive and cancels the request early
+            validated_scene = _generate_scene_streaming(llm_service, prompt, prompt_type, attempt, variant, cancel)
+        else:
+            scene_json = llm_service.generate(prompt, format="json", prompt_type=prompt_type, attempt=attempt,
+                                              variant=variant)
+            validated_scene = JSONValidator.validate_scene_json(scene_json)
 
+        if cancel is not None and cancel.is_set():
+            return None
         if validated_scene:
             return validated_scene
         else:
+            # Don't let a cached invalid scene short-circuit the retry
+            llm_service.invalidate(prompt, format="json", variant=variant)
             print(f"Attempt {attempt + 1} failed. Retrying...")
 
     print(f"Failed to generate valid JSON after {max_attempts} attempts.")
@@ -36,11 +79,11 @@ def _parse_json_to_markdown(scene_json: Dict[str, Any], current_act: int = None)
     markdown = ""
 
     # Extract act number from scene number (assuming format "1.2.3" where 1 is the act number)
-    try:
-        scene_act = int(scene_json['scene_number'].split('.')[0])
-    except Exception as e:
+    scene = SceneContent(scene_json)
+    scene_act = scene.act
+    if scene_act is None:
         try:
-            scene_act = int(scene_json['scene_number'].split(' ')[1][0])
+            scene_act = int(scene.scene_number.split(' ')[1][0])
         except Exception as e:
             scene_act = -1
 
@@ -49,9 +92,9 @@ def _parse_json_to_markdown(scene_json: Dict[str, Any], current_act: int = None)
         markdown += f"# ACT {scene_act}\n\n---\n\n"
         current_act = scene_act
 
-    markdown += f"## Scene {scene_json['scene_number']}: {scene_json['location']} - {scene_json['time']}\n\n"
+    markdown += f"## Scene {scene.scene_number}: {scene.location} - {scene.time}\n\n"
 
-    for item in scene_json['content']:
+    for item in scene.content:
         if item['type'] == 'action':
             markdown += f"{item['text']}\n\n"
         elif item['type'] == 'dialog':
@@ -61,59 +104,79 @@ def _parse_json_to_markdown(scene_json: Dict[str, Any], current_act: int = None)
 
     return markdown, current_act
 
-def _truncate_story(story: Dict[str, Any], sub_scene: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Truncates the story to only include all subscenes for the current subscene,
-    all other subscenes in the story are removed.
-    """
-    truncated_story = deepcopy(story)
-    for act in truncated_story['acts']:
-        for scene in act['scenes']:
-            sub_scene_numbers = [sub_scene['sub_scene_number'] for sub_scene in scene['sub_scenes']]
-            if sub_scene['sub_scene_number'] not in sub_scene_numbers:
-                # delete key sub_scenes from scene
-                scene.pop('sub_scenes', None)
-
-
-    return truncated_story
-
-def _save_scene_output(scene_content: Dict[str, Any], scene_markdown: str, scene_number: str):
-    save_json(f'output/scenes/scene_{scene_number}.json', scene_content)
-    save_txt(f'output/scenes/scene_{scene_number}.md', scene_markdown)
-
-
-def _load_existing_scenes(start_with_scene: str) -> Tuple[List[Dict[str, Any]], str]:
-    generated_scenes = []
-    full_script_markdown = ""
+def _total_score(evaluation: Any) -> float:
+    try:
+        return evaluation.get('total_score', 0)
+    except AttributeError:
+        return 0
 
-    def extract_scene_number(filename):
-        nr = filename.split('_')[1].split('.')[:-1]
-        return ".".join(nr)
 
-    scene_files = [f for f in os.listdir('output/scenes') if f.startswith('scene_')]
-    scene_files.sort(
-        key=cmp_to_key(lambda x, y: compare_scene_numbers(extract_scene_number(x), extract_scene_number(y))))
+def _scene_act(scene_number: str) -> int:
+    try:
+        return int(scene_number.split('.')[0])
+    except ValueError:
+        return -1
 
-    for scene_file in scene_files:
-        scene_number = extract_scene_number(scene_file)
-        if compare_scene_numbers(scene_number, start_with_scene) >= 0:
-            break
 
-        if scene_file.endswith('.json'):
-            with open(f'output/scenes/{scene_file}', 'r') as f:
-                scene_content = json.load(f)
-            generated_scenes.append(scene_content)
+def _dependency_group(scene_number: str, mode: str) -> Any:
+    """
+    A sub-scene depends on the sub-scenes before it in its group: sub-scenes of a group are generated in
+    order, groups concurrently. A sub-scene's context is only the script of its own group, which is
+    finished by the time it is generated, so the same outline always gives the same prompts.
+    """
+    parts = scene_number.split('.')
+    if mode == "act":
+        return parts[0]
+    if mode == "scene":
+        return tuple(parts[:2])
+    if mode == "none":
+        return scene_number
+    return None  # "previous": every sub-scene depends on all of the script before it
 
-        elif scene_file.endswith('.md'):
-            with open(f'output/scenes/{scene_file}', 'r') as f:
-                full_script_markdown += f.read() + "\n"
 
-    return generated_scenes, full_script_markdown
+def _merge_evaluations(evaluations: List[Tuple[str, int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Combines per-act evaluations (act number, act length, evaluation) into the shape of a full script
+    evaluation. Scores are averaged weighted by the length of each act; the rest is concatenated in act order.
+    """
+    criteria = {}
+    weights = defaultdict(int)
+    total_score = 0.0
+    total_weight = 0
+    scenes_to_improve = []
+    feedback = []
+    for act, weight, evaluation in evaluations:
+        for name, criterion in (evaluation.get('criteria') or {}).items():
+            if not isinstance(criterion, dict):
+                continue
+            merged = criteria.setdefault(name, {'justification': "", 'score': 0.0})
+            merged['score'] += (criterion.get('score') or 0) * weight
+            merged['justification'] += f"Act {act}: {criterion.get('justification', '')}\n"
+            weights[name] += weight
+        total_score += _total_score(evaluation) * weight
+        total_weight += weight
+        scenes_to_improve += [scene for scene in evaluation.get('scenes_to_improve') or [] if isinstance(scene, dict)]
+        feedback.append(f"Act {act}: {evaluation.get('feedback', '')}")
+
+    for name, merged in criteria.items():
+        merged['score'] = round(merged['score'] / weights[name]) if weights[name] else 0
+        merged['justification'] = merged['justification'].strip()
+    return {
+        'criteria': criteria,
+        'scenes_to_improve': scenes_to_improve,
+        'total_score': round(total_score / total_weight) if total_weight else 0,
+        'feedback': "\n\n".join(feedback),
+    }
+
+
+def _load_existing_scenes(manifest: SceneManifest, start_with_scene: str) -> List[Dict[str, Any]]:
+    # The scenes before start_with_scene, from the scene manifest instead of listing the scenes directory
+    return manifest.load(manifest.before(start_with_scene))
 
 
 class SceneGenerator:
     def __init__(self, llm_service: LLMService, llm_service_validation: LLMService, config: Dict[str, Any], characters: Dict[str, Any],
-                 themes: Dict[str, Any]):
+                 themes: Dict[str, Any], telemetry: Telemetry = None):
         self.llm_service = llm_service
         self.llm_service_validation = llm_service_validation
         self.config = config
@@ -123,69 +186,292 @@ class SceneGenerator:
         self.good_scene_threshold = config.get('good_scene_threshold', 80)
         self.max_iterations = config.get('max_scene_iterations', 5)
         self.full_script_threshold = config.get('full_script_threshold', 85)
+        self.stream_scenes = config.get('stream_scene_generation', False)
+        self.context_index = ContextIndex.from_config(config, telemetry)
+        self.summaries = ScriptSummaries.from_config(config, llm_service_validation)
+        self.story_elements = StoryElementStore.from_config(config, llm_service_validation)
+        self.journal = SceneJournal.from_config(config)
+        self.scene_manifest = SceneManifest.from_config(config)
+        self.scene_dependencies = config.get('scene_dependencies', 'previous')
+        self.scene_workers = config.get('scene_workers', 4)
+        self.pipeline_scenes = config.get('pipeline_scenes', False)
+        self.pipeline_depth = config.get('pipeline_depth', 1)
+        self.budget = PromptBudget.from_config(config, llm_service.models)
+        self.validation_budget = PromptBudget.from_config(config, llm_service_validation.models)
+        # Token cap for the script context; falls back to the old character-based context_length
+        self.context_tokens = config.get('context_tokens', config.get('context_length', 0) // CHARS_PER_TOKEN)
+        # "single" sends the whole script in one call, "per_act" evaluates acts in parallel and merges the
+        # results, "auto" does the latter only when the script doesn't fit the context window
+        self.full_script_evaluation = config.get('full_script_evaluation', 'auto')
+        self.act_evaluations_path = config.get('act_evaluations_path', 'output/cache/act_evaluations.json')
+        self.refine_workers = config.get('refine_workers', 4)
+        self.scene_strategy = config.get('scene_strategy', 'refine')
+        self.scene_candidates = config.get('scene_candidates', 3)
+        if self.pipeline_scenes and self.scene_strategy == "best_of_n":
+            logger.warning("scene_strategy 'best_of_n' doesn't apply with pipeline_scenes: "
+                           "each sub-scene is drafted once and refined")
 
     def generate_scenes(self, story: Dict[str, Any], start_with_scene: str = None) -> List[Dict[str, Any]]:
-        generated_scenes = []
-        full_script_markdown = ""
-        current_act = None
-
-        # Load existing scenes if start_with_scene is specified
+        outline = OutlineIndex(story)
+        sub_scenes = outline.sub_scenes()
+        order = [sub_scene['sub_scene_number'] for sub_scene in sub_scenes]
+        # The act header is written before the first sub-scene of each act in canonical order
+        previous_act = dict(zip(order, [None] + [_scene_act(number) for number in order[:-1]]))
+
+        results = {}
+        # The whole script, shared by refinement and export
+        script = ScriptBuffer(_parse_json_to_markdown)
+        # The script each dependency group generates against: only scenes the group has waited for
+        contexts = defaultdict(lambda: ScriptBuffer(_parse_json_to_markdown))
+
+        # Load existing scenes if start_with_scene is specified, otherwise continue where the journal stopped
+        generated_scenes, progress = [], {}
         if start_with_scene:
-            generated_scenes, full_script_markdown = _load_existing_scenes(start_with_scene)
-            current_act = int(start_with_scene.split('.')[0])
-
-        total_sub_scenes = sum([len(scene.get('sub_scenes', [])) for act in story['acts'] for scene in act['scenes']])
-        with tqdm(total=total_sub_scenes, desc="Generating scenes", unit="sub-scene") as pbar:
-            for act in story['acts']:
-                for scene in act['scenes']:
-                    for sub_scene in scene.get('sub_scenes', []):
-                        if start_with_scene and compare_scene_numbers(sub_scene['sub_scene_number'], start_with_scene) < 0:
-                            pbar.update(1)
-                            continue
-
-                        scene_content = self._generate_single_scene(sub_scene, story, full_script_markdown)
-                        generated_scenes.append(scene_content)
-
-                        scene_markdown, current_act = _parse_json_to_markdown(scene_content['content'], current_act)
-                        full_script_markdown += "\n" + scene_markdown
-
-                        _save_scene_output(scene_content, scene_markdown, sub_scene['sub_scene_number'])
-
-                        pbar.update(1)
+            generated_scenes = _load_existing_scenes(self.scene_manifest, start_with_scene)
+            missing = self.scene_manifest.missing(number for number in order
+                                                  if scene_key(number) < scene_key(start_with_scene))
+            if missing:
+                logger.warning(f"No scene files for {', '.join(missing)}; they are left out of the script")
+        elif self.journal is not None:
+            generated_scenes, progress = self.journal.replay(outline)
+        if generated_scenes:
+            for scene in generated_scenes:
+                results[scene['scene_number']] = scene
+                script.set(scene['scene_number'], scene['content'])
+                contexts[_dependency_group(scene['scene_number'], self.scene_dependencies)].set(
+                    scene['scene_number'], scene['content'])
+            if self.context_index is not None:
+                for scene in generated_scenes:
+                    self.context_index.add_scene(scene['scene_number'], script.get(scene['scene_number']))
+            if self.story_elements is not None:
+                for scene in generated_scenes:
+                    if outline.sub_scene(scene['scene_number']) is not None:
+                        self.story_elements.add_scene(scene['scene_number'], script.get(scene['scene_number']),
+                                                      outline.view(scene['scene_number']).reduced_json)
+
+        chains = {}
+        for sub_scene in sub_scenes:
+            if sub_scene['sub_scene_number'] in results or (
+                    start_with_scene and scene_key(sub_scene['sub_scene_number']) < scene_key(start_with_scene)):
+                continue
+            chains.setdefault(_dependency_group(sub_scene['sub_scene_number'], self.scene_dependencies),
+                              []).append(sub_scene)
+
+        lock = threading.Lock()
+        with tqdm(total=len(sub_scenes), desc="Generating scenes", unit="sub-scene") as pbar:
+            pbar.update(len(sub_scenes) - sum(len(chain) for chain in chains.values()))
+
+            def finish(sub_scene: Dict[str, Any], scene_content: Dict[str, Any]):
+                scene_number = sub_scene['sub_scene_number']
+                script.set(scene_number, scene_content['content'])
+                # Scene files get the act header of the canonical order, whatever order the scenes finish in
+                scene_markdown = _parse_json_to_markdown(scene_content['content'], previous_act[scene_number])[0]
+                self.scene_manifest.save_scene(scene_content, scene_markdown)
+                if self.journal is not None:
+                    self.journal.accepted(sub_scene, scene_content)
+                if self.context_index is not None:
+                    self.context_index.add_scene(scene_number, scene_markdown)
+                if self.summaries is not None:
+                    self.summaries.add_scene(script, scene_number)
+                if self.story_elements is not None:
+                    self.story_elements.add_scene(scene_number, scene_markdown, outline.view(scene_number).reduced_json)
+
+                with lock:
+                    results[scene_number] = scene_content
+                    pbar.update(1)
+
+            # Set when a chain fails, so the others stop after the sub-scene they are working on
+            failed = threading.Event()
+
+            def run_chain(context: ScriptBuffer, chain: List[Dict[str, Any]]):
+                def accept(sub_scene: Dict[str, Any], scene_content: Dict[str, Any]):
+                    context.set(sub_scene['sub_scene_number'], scene_content['content'])
+                    finish(sub_scene, scene_content)
+
+                if self.pipeline_scenes:
+                    self._run_pipeline(chain, outline, context, accept, progress, cancel=failed)
+                    return
+                for sub_scene in chain:
+                    if failed.is_set():
+                        return
+                    scene_content = self._generate_single_scene(sub_scene, outline, context,
+                                                                progress.get(sub_scene['sub_scene_number']))
+                    accept(sub_scene, scene_content)
+
+            with ThreadPoolExecutor(max_workers=self.scene_workers) as executor:
+                try:
+                    futures = [executor.submit(run_chain, contexts[group], chain) for group, chain in chains.items()]
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    # Chains still queued are dropped; running ones finish their current sub-scene and stop
+                    failed.set()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+
+        self.scene_manifest.compact()
+
+        # Output is assembled in canonical scene order, whatever order the scenes finished in
+        generated_scenes = [results[number] for number in order if number in results]
 
         # Save initial full script
-        save_txt('output/full_script_initial.md', full_script_markdown)
+        save_txt('output/full_script_initial.md', script.text())
         save_json('output/scenes_initial.json', generated_scenes)
 
         # Evaluate and refine full script
-        evaluation = self._evaluate_full_script(full_script_markdown, story)
-        refined_scenes = self._refine_full_script(generated_scenes, evaluation, story)
+        evaluation = self._evaluate_full_script(script, outline)
+        refined_scenes = self._refine_full_script(generated_scenes, evaluation, outline, script)
 
         # Save refined full script
-        refined_full_script_markdown = "\n".join(
-            [_parse_json_to_markdown(scene['content'])[0] for scene in refined_scenes])
-        save_txt('output/full_script_refined.md', refined_full_script_markdown)
+        save_txt('output/full_script_refined.md', script.text())
         save_json('output/scenes_refined.json', refined_scenes)
+        if self.journal is not None:
+            self.journal.complete()
 
         return refined_scenes
 
-    def _generate_single_scene(self, sub_scene: Dict[str, Any], story: Dict[str, Any],
-                               full_script_markdown: str) -> Dict[str, Any]:
+    def _generate_single_scene(self, sub_scene: Dict[str, Any], outline: OutlineIndex, script: ScriptBuffer,
+                               progress: SceneProgress = None) -> Dict[str, Any]:
+        view = outline.view(sub_scene['sub_scene_number'])
+        if progress is not None:
+            return self._evaluate_and_refine(sub_scene, view, progress.content, script, progress=progress)
+        if self.scene_strategy == "best_of_n":
+            return self._generate_best_of_n(sub_scene, outline, script)
+        scene_content = self._generate_scene(sub_scene, view, script)
+        return self._evaluate_and_refine(sub_scene, view, scene_content, script)
+
+    def _generate_best_of_n(self, sub_scene: Dict[str, Any], outline: OutlineIndex,
+                            script: ScriptBuffer) -> Dict[str, Any]:
+        """
+        Drafts and evaluates `scene_candidates` candidates concurrently and refines only the best one.
+        The remaining candidates are cancelled as soon as one reaches the threshold.
+        """
+        view = outline.view(sub_scene['sub_scene_number'])
+        cancel = threading.Event()
+
+        def candidate(index: int) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+            # Each step starts only while no winner has been chosen
+            if cancel.is_set():
+                return None, None
+            # Candidate 0 shares its cache entry with the regular strategy
+            draft = self._generate_scene(sub_scene, view, script, variant=index or None,
+                                         cancel=cancel)
+            if draft is None or cancel.is_set():
+                return None, None
+            evaluation = self._evaluate_scene(draft, sub_scene, view)
+            if cancel.is_set():
+                return None, None
+            return draft, evaluation
+
+        best_scene, best_evaluation, best_score = None, None, -1
+        executor = ThreadPoolExecutor(max_workers=self.scene_candidates)
+        try:
+            futures = [executor.submit(candidate, index) for index in range(self.scene_candidates)]
+            for future in as_completed(futures):
+                draft, evaluation = future.result()
+                if draft is None:
+                    continue
+                total_score = _total_score(evaluation)
+                if total_score > best_score:
+                    best_scene, best_evaluation, best_score = draft, evaluation, total_score
+                if total_score >= self.good_scene_threshold:
+                    break
+        finally:
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        logger.info(f"Best of {self.scene_candidates} candidates for scene {sub_scene['sub_scene_number']} "
+                    f"scored {best_score}")
+        return self._evaluate_and_refine(sub_scene, view, best_scene, script,
+                                         evaluation=best_evaluation)
+
+    def _run_pipeline(self, chain: List[Dict[str, Any]], outline: OutlineIndex, script: ScriptBuffer,
+                      finish: Callable[[Dict[str, Any], Dict[str, Any]], None],
+                      progress: Dict[str, SceneProgress] = None, cancel: threading.Event = None):
+        """
+        Generates first drafts of a chain of sub-scenes ahead on the generation backend while earlier drafts
+        are evaluated and refined on the validation backend. A draft is written against the drafts of the
+        earlier sub-scenes of the chain; refinement uses their final text. Stops once `cancel` is set.
+        """
+        drafts = queue.Queue(maxsize=self.pipeline_depth)
+        stop = threading.Event()
+        # Drafts go into an overlay of the script; `script` only ever gets accepted scenes (through `finish`)
+        ahead = script.copy()
+
+        def put(item) -> bool:
+            # Blocks while the evaluation stage is behind (backpressure), gives up once it has stopped
+            while not stop.is_set():
+                try:
+                    drafts.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def cancelled() -> bool:
+            return cancel is not None and cancel.is_set()
+
+        def produce():
+            try:
+                for sub_scene in chain:
+                    if cancelled():
+                        return
+                    view = outline.view(sub_scene['sub_scene_number'])
+                    state = (progress or {}).get(sub_scene['sub_scene_number'])
+                    draft = state.content if state is not None else self._generate_scene(sub_scene, view, ahead)
+                    if draft is not None:
+                        ahead.set(sub_scene['sub_scene_number'], draft)
+                    if not put((sub_scene, view, draft, state, None)):
+                        return
+            except Exception as e:
+                put((None, None, None, None, e))
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            for _ in chain:
+                while True:
+                    try:
+                        sub_scene, view, draft, state, error = drafts.get(timeout=0.5)
+                        break
+                    except queue.Empty:
+                        if cancelled():
+                            return
+                if cancelled():
+                    return
+                if error is not None:
+                    raise error
+                scene_content = self._evaluate_and_refine(sub_scene, view, draft, script, progress=state)
+                finish(sub_scene, scene_content)
+        finally:
+            stop.set()
+
+    def _evaluate_and_refine(self, sub_scene: Dict[str, Any], view: OutlineView,
+                             scene_content: Optional[Dict[str, Any]], script: ScriptBuffer,
+                             evaluation: Dict[str, Any] = None, progress: SceneProgress = None) -> Dict[str, Any]:
         best_scene = None
         best_score = 0
-
-        story_truncated = _truncate_story(story, sub_scene)
-
-        scene_content = self._generate_scene(sub_scene, story_truncated, full_script_markdown)
-        for attempt in range(self.max_iterations):
+        start = 0
+
+        if progress is not None:
+            # Continue the loop where the journal says an earlier run stopped
+            evaluation, start = progress.evaluation, progress.attempt
+            best_scene, best_score = progress.best_scene, progress.best_score
+            logger.info(f"Resuming scene {sub_scene['sub_scene_number']} at try {start + 1}")
+        elif self.journal is not None and scene_content is not None:
+            self.journal.draft(sub_scene, scene_content)
+            if evaluation is not None:
+                self.journal.evaluation(sub_scene, 0, evaluation, _total_score(evaluation))
+
+        for attempt in range(start, self.max_iterations):
             if scene_content is None:
                 continue  # Skip evaluation if generation failed
 
-            evaluation = self._evaluate_scene(scene_content, sub_scene, story_truncated)
-            try:
-                total_score = evaluation.get('total_score', 0)
-            except AttributeError:
-                total_score = 0
+            # The first draft may come with its evaluation already (best-of-N, or a resumed loop)
+            if attempt > start or evaluation is None:
+                evaluation = self._evaluate_scene(scene_content, sub_scene, view)
+                if self.journal is not None:
+                    self.journal.evaluation(sub_scene, attempt, evaluation, _total_score(evaluation))
+            total_score = _total_score(evaluation)
 
             if total_score > best_score:
                 best_scene = scene_content
@@ -208,92 +494,243 @@ class SceneGenerator:
 
 
             if attempt < self.max_iterations - 1:  # Don't refine on the last iteration
-                scene_content = self._refine_scene(scene_content, feedback, sub_scene, story_truncated,
-                                                   full_script_markdown)
+                scene_content = self._refine_scene(scene_content, feedback, sub_scene, view, script)
+                if self.journal is not None:
+                    self.journal.refinement(sub_scene, attempt, scene_content)
 
         logger.info(f"Scene {sub_scene['sub_scene_number']} could not be refined further. Using the best attempt (score: {best_score})")
         return {'scene_number': sub_scene['sub_scene_number'], 'content': best_scene, 'score': best_score}
 
-    def _generate_scene(self, sub_scene: Dict[str, Any], story: Dict[str, Any],
-                        full_script_markdown: str) -> Optional[Dict[str, Any]]:
-        context_length = self.config.get('context_length', inf)
-        context = full_script_markdown[-context_length:] if len(
-            full_script_markdown) > context_length else full_script_markdown
-        context_length = len(context)
-
-        prompt = GENERATE_SCENE.format(
+    def _script_context(self, sub_scene: Dict[str, Any], script: ScriptBuffer) -> Tuple[str, str]:
+        """The story so far as summaries (if enabled) and the script text before the sub-scene."""
+        if self.summaries is not None:
+            # Recent text verbatim, everything before it summarized
+            return self.summaries.context(script, sub_scene['sub_scene_number'])
+        # More text than fits is fetched; the prompt budget cuts it to size in tokens
+        context_chars = (self.context_tokens or self.budget.prompt_tokens) * CHARS_PER_TOKEN * 2
+        if self.context_index is not None:
+            # Most relevant earlier passages instead of only the most recent text
+            query = f"{sub_scene.get('title', '')}\n{sub_scene.get('description', '')}"
+            context = self.context_index.retrieve(query, context_chars, before=sub_scene['sub_scene_number'],
+                                                  scenes=set(script.numbers(sub_scene['sub_scene_number'])))
+            if context is not None:
+                return "", context
+        return "", script.tail(context_chars, before=sub_scene['sub_scene_number'])
+
+    def _story_elements(self, sub_scene: Dict[str, Any]) -> str:
+        # Only what is already extracted; extraction never holds up a prompt
+        return self.story_elements.context(sub_scene['sub_scene_number']) if self.story_elements is not None else ""
+
+    def _context_limits(self) -> Optional[Dict[str, int]]:
+        return {"full_script_context": self.context_tokens} if self.context_tokens else None
+
+    def _generate_scene(self, sub_scene: Dict[str, Any], view: OutlineView, script: ScriptBuffer,
+                        variant: Any = None, cancel: threading.Event = None) -> Optional[Dict[str, Any]]:
+        values = dict(
             # characters=self.characters,
             # themes=self.themes,
-            outline=story,
             current_scene=sub_scene,
-            full_script_context=context,
-            context_length=context_length,
             genre=self.config.get('genre', 'unknown'),
-            title=story.get('title', 'Untitled')
+            title=view.get('title', 'Untitled'),
+            context_length=0,
         )
-
-        return generate_scene_with_validation(self.llm_service, prompt)
+        story_so_far, script_context = self._script_context(sub_scene, script)
+        # Older script context goes first, then the detail of other acts, then the summaries
+        sections = self.budget.fit(GENERATE_SCENE, [
+            PromptSection("outline", [view.json, view.reduced_json], priority=1),
+            PromptSection("full_script_context", [script_context], priority=2, trim="start"),
+            PromptSection("story_so_far", [story_so_far, ""], priority=0),
+            PromptSection("story_elements", [self._story_elements(sub_scene), ""], priority=1),
+        ], limits=self._context_limits(), **values)
+        values['context_length'] = len(sections['full_script_context'])
+        prompt = GENERATE_SCENE.format(**values, **sections)
+
+        return generate_scene_with_validation(self.llm_service, prompt, stream=self.stream_scenes, variant=variant,
+                                              cancel=cancel)
 
     def _evaluate_scene(self, scene_content: Dict[str, Any], sub_scene: Dict[str, Any],
-                        story: Dict[str, Any]) -> Dict[str, Any]:
-        scene_markdown = _parse_json_to_markdown(scene_content)
-        prompt = EVALUATE_SCENE.format(
-            outline=story,
+                        view: OutlineView) -> Dict[str, Any]:
+        scene_markdown = _parse_json_to_markdown(scene_content)[0]
+        values = dict(
             scene_content=scene_markdown,
             scene_details=sub_scene,
-            characters=self.characters,
-            themes=self.themes,
             genre=self.config.get('genre', 'movie'),
         )
-        return self.llm_service_validation.generate(prompt, format="json")
+        sections = self.validation_budget.fit(EVALUATE_SCENE, [
+            PromptSection("outline", [view.json, view.reduced_json], priority=2),
+            PromptSection("characters", [str(self.characters)], priority=1, trim="end"),
+            PromptSection("themes", [str(self.themes)], priority=1, trim="end"),
+        ], **values)
+        prompt = EVALUATE_SCENE.format(**values, **sections)
+        return self.llm_service_validation.generate(prompt, format="json", prompt_type="EVALUATE_SCENE")
 
     def _refine_scene(self, scene_content: Dict[str, Any], feedback: str, sub_scene: Dict[str, Any],
-                      story: Dict[str, Any], full_script_markdown: str) -> Optional[Dict[str, Any]]:
-        context_length = self.config.get('context_length', inf)
-        context = full_script_markdown[-context_length:] if len(
-            full_script_markdown) > context_length else full_script_markdown
-
-        prompt = REFINE_SCENE.format(
+                      view: OutlineView, script: ScriptBuffer) -> Optional[Dict[str, Any]]:
+        values = dict(
             scene_content=json.dumps(scene_content),
             feedback=feedback,
             scene_details=sub_scene,
-            characters=self.characters,
-            themes=self.themes,
             genre=self.config.get('genre', 'movie'),
-            full_script_context=context,
-            context_length=context_length,
-        )
-        return generate_scene_with_validation(self.llm_service, prompt)
-
-    def _evaluate_full_script(self, full_script_markdown: str, story: Dict[str, Any]) -> Dict[str, Any]:
-        prompt = EVALUATE_FULL_SCRIPT.format(
-            full_script=full_script_markdown,
-            outline=json.dumps(story),
-            characters=json.dumps(self.characters),
-            themes=json.dumps(self.themes),
-            genre=self.config.get('genre', 'unknown')
+            context_length=0,
         )
-        evaluation = self.llm_service.generate(prompt, format="json")
+        story_so_far, script_context = self._script_context(sub_scene, script)
+        sections = self.budget.fit(REFINE_SCENE, [
+            PromptSection("full_script_context", [script_context], priority=2, trim="start"),
+            PromptSection("story_so_far", [story_so_far, ""], priority=0),
+            PromptSection("story_elements", [self._story_elements(sub_scene), ""], priority=1),
+            PromptSection("characters", [str(self.characters)], priority=1, trim="end"),
+            PromptSection("themes", [str(self.themes)], priority=1, trim="end"),
+        ], limits=self._context_limits(), **values)
+        values['context_length'] = len(sections['full_script_context'])
+        prompt = REFINE_SCENE.format(**values, **sections)
+        return generate_scene_with_validation(self.llm_service, prompt, prompt_type="REFINE_SCENE",
+                                              stream=self.stream_scenes)
+
+    def _evaluate_full_script(self, script: ScriptBuffer, outline: OutlineIndex) -> Dict[str, Any]:
+        full_script = script.text()
+        per_act = self.full_script_evaluation == "per_act"
+        if self.full_script_evaluation == "auto":
+            per_act = (self.budget.count(full_script) + self.budget.count(outline.skeleton_json)
+                       > self.budget.prompt_tokens)
+
+        evaluation = self._evaluate_acts(script, outline) if per_act else None
+        if evaluation is None:
+            values = dict(
+                full_script=full_script,
+                genre=self.config.get('genre', 'unknown')
+            )
+            sections = self.budget.fit(EVALUATE_FULL_SCRIPT, self._script_evaluation_sections(outline), **values)
+            prompt = EVALUATE_FULL_SCRIPT.format(**values, **sections)
+            evaluation = self.llm_service.generate(prompt, format="json", prompt_type="EVALUATE_FULL_SCRIPT")
         save_json('output/full_script_evaluation.json', evaluation)
         return evaluation
 
-    def _refine_full_script(self, scenes: List[Dict[str, Any]], evaluation: Dict[str, Any], story: Dict[str, Any]) -> \
-    List[Dict[str, Any]]:
+    def _script_evaluation_sections(self, outline: OutlineIndex) -> List[PromptSection]:
+        return [
+            PromptSection("outline", [outline.json, outline.skeleton_json], priority=2),
+            PromptSection("characters", [json.dumps(self.characters)], priority=1, trim="end"),
+            PromptSection("themes", [json.dumps(self.themes)], priority=1, trim="end"),
+        ]
+
+    def _evaluate_acts(self, script: ScriptBuffer, outline: OutlineIndex) -> Optional[Dict[str, Any]]:
+        """
+        Evaluates each act in parallel and merges the results. Results are cached by the hash of the act's
+        prompt, so after refinement only the acts that changed are evaluated again. An act that fails is
+        retried on its own; the script is never sent at once, as it may not fit.
+        """
+        acts = defaultdict(list)
+        for scene_number, _, markdown in script.segments():
+            acts[str(_scene_act(scene_number))].append(markdown)
+
+        cache = load_json(self.act_evaluations_path) if os.path.exists(self.act_evaluations_path) else {}
+        results = {}
+        keys = {}
+        prompts = {}
+        for act, segments in acts.items():
+            values = dict(
+                act_number=act,
+                act_script="".join("\n" + markdown for markdown in segments),
+                genre=self.config.get('genre', 'unknown')
+            )
+            sections = self.budget.fit(EVALUATE_ACT, self._script_evaluation_sections(outline), **values)
+            prompt = EVALUATE_ACT.format(**values, **sections)
+            key = keys[act] = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            if key in cache:
+                results[act] = cache[key]
+            else:
+                prompts[key] = (act, prompt)
+
+        if prompts:
+            # The provider's scheduler caps how many of these run at once
+            with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+                futures = {act: executor.submit(self._evaluate_act, act, prompt) for act, prompt in prompts.values()}
+            for act, future in futures.items():
+                if future.result() is not None:
+                    results[act] = future.result()
+            # Only the evaluations of the current acts are kept
+            save_json(self.act_evaluations_path, {keys[act]: evaluation for act, evaluation in results.items()})
+
+        if not results:
+            logger.warning("No act could be evaluated. Evaluating the full script at once.")
+            return None
+        missing = [act for act in acts if act not in results]
+        if missing:
+            logger.warning(f"Act(s) {', '.join(missing)} could not be evaluated. Merging the other acts.")
+        logger.info(f"Evaluated {len(results)} acts, {len(acts) - len(prompts)} of them unchanged")
+        return _merge_evaluations([(act, sum(len(markdown) for markdown in acts[act]), results[act])
+                                   for act in acts if act in results])
+
+    def _evaluate_act(self, act: str, prompt: str, max_attempts: int = 3) -> Optional[Dict[str, Any]]:
+        for attempt in range(max_attempts):
+            try:
+                evaluation = self.llm_service.generate(prompt, format="json", prompt_type="EVALUATE_ACT",
+                                                       attempt=attempt)
+            except Exception as e:
+                evaluation = e
+            if isinstance(evaluation, dict):
+                return evaluation
+            logger.warning(f"Evaluation of act {act} failed (attempt {attempt + 1}): {evaluation}")
+            # Don't let a cached invalid evaluation short-circuit the retry
+            self.llm_service.invalidate(prompt, format="json")
+        return None
+
+    def _refine_full_script(self, scenes: List[Dict[str, Any]], evaluation: Dict[str, Any], outline: OutlineIndex,
+                            script: ScriptBuffer) -> List[Dict[str, Any]]:
+        """
+        Refines the scenes flagged by the full script evaluation concurrently, each against the script as it
+        was evaluated, and re-evaluates each refined scene. A refinement is kept unless it scores lower than
+        the scene it replaces.
+        """
         refined_scenes = scenes.copy()
         total_score = evaluation.get('total_score', 0)
 
         if total_score >= self.full_script_threshold:
             return refined_scenes
 
-        scenes_to_improve = evaluation.get('scenes_to_improve', [])
-        for scene_info in scenes_to_improve:
-            scene_id = scene_info['scene_id']
-            scene_index = next((i for i, scene in enumerate(refined_scenes) if scene['scene_number'] == scene_id), None)
-
-            if scene_index is not None:
-                refined_scene = self._refine_scene(refined_scenes[scene_index]['content'], scene_info['suggestions'],
-                                                   story, "\n".join(
-                        [_parse_json_to_markdown(s['content']) for s in refined_scenes]))
-                refined_scenes[scene_index]['content'] = refined_scene
+        positions = {scene['scene_number']: i for i, scene in enumerate(refined_scenes)}
+        # A scene flagged more than once is refined once with all of its suggestions
+        suggestions = {}
+        for scene_info in evaluation.get('scenes_to_improve', []):
+            scene_id = scene_info.get('scene_id')
+            if scene_id in positions and outline.sub_scene(scene_id) is not None:
+                suggestions.setdefault(scene_id, []).append(str(scene_info.get('suggestions', '')))
+
+        def refine(scene_id: str) -> Tuple[Optional[Dict[str, Any]], Any]:
+            sub_scene = outline.sub_scene(scene_id)
+            view = outline.view(scene_id)
+            refined_scene = self._refine_scene(refined_scenes[positions[scene_id]]['content'],
+                                               "\n".join(suggestions[scene_id]), sub_scene, view, script)
+            if refined_scene is None:
+                return None, None
+            return refined_scene, self._evaluate_scene(refined_scene, sub_scene, view)
+
+        with ThreadPoolExecutor(max_workers=self.refine_workers) as executor:
+            futures = {scene_id: executor.submit(refine, scene_id) for scene_id in suggestions}
+            results = {}
+            for scene_id, future in futures.items():
+                try:
+                    results[scene_id] = future.result()
+                except Exception as e:
+                    # One failed refinement doesn't cost the others; the scene is kept as it was
+                    logger.warning(f"Refinement of scene {scene_id} failed, keeping the original: {str(e)}")
+
+        # Applied in scene order once all are done, so no refinement saw another one's text
+        for scene_id in sorted(results, key=lambda number: positions[number]):
+            refined_scene, scene_evaluation = results[scene_id]
+            if refined_scene is None:
+                continue
+            scene_index = positions[scene_id]
+            previous_score = _total_score(refined_scenes[scene_index].get('evaluation')) or \
+                refined_scenes[scene_index].get('score', 0)
+            score = _total_score(scene_evaluation)
+            if score < previous_score:
+                logger.info(f"Discarding the refinement of scene {scene_id}: score {score} < {previous_score}")
+                continue
+            refined_scenes[scene_index] = {**refined_scenes[scene_index], 'content': refined_scene,
+                                           'evaluation': scene_evaluation}
+            # Only the refined scene's segment is re-rendered
+            script.set(scene_id, refined_scene)
+            if self.story_elements is not None:
+                self.story_elements.add_scene(scene_id, script.get(scene_id), outline.view(scene_id).reduced_json)
 
         return refined_scenes
@@ -1,83 +1,60 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from replicate.exceptions import ModelError
 from tqdm import tqdm
 import json
 
 from prompts.main import DEVELOP_CHARACTERS, IDENTIFY_THEMES
-from prompts.outline import GENERATE_ACTS, VALIDATE_ACTS, GENERATE_KEY_SCENES, VALIDATE_KEY_SCENES, GENERATE_SUB_SCENES, \
-    VALIDATE_SUB_SCENES, REVIEW_OUTLINE, VALIDATE_FINAL_OUTLINE
-from src.llm.LLMService import LLMService
+from prompts.outline import GENERATE_ACTS, REVISE_ACTS, VALIDATE_ACTS, GENERATE_KEY_SCENES, VALIDATE_KEY_SCENES, \
+    GENERATE_SUB_SCENES, VALIDATE_SUB_SCENES, REVIEW_OUTLINE, VALIDATE_FINAL_OUTLINE
+from src.llm.LLMRouter import LLMRouter
+from src.llm.LLMServiceFactory import LLMServiceFactory
+from src.llm.PromptBudget import PromptBudget, PromptSection
+from src.llm.ResponseCache import ResponseCache
+from src.llm.Telemetry import Telemetry
 from src.scene_generator import SceneGenerator
+from src.utils.OutlineIndex import OutlineIndex
+from src.utils.OutlineManifest import OutlineManifest, node_inputs
+from src.utils.OutlineModel import Outline
 from src.utils.file_handlers import load_json, save_json, load_txt, save_txt
 from src.utils.sort_and_compare import sort_json_content
 
+PROMPT_TYPES = {
+    GENERATE_ACTS: "GENERATE_ACTS",
+    REVISE_ACTS: "REVISE_ACTS",
+    VALIDATE_ACTS: "VALIDATE_ACTS",
+    GENERATE_KEY_SCENES: "GENERATE_KEY_SCENES",
+    VALIDATE_KEY_SCENES: "VALIDATE_KEY_SCENES",
+    GENERATE_SUB_SCENES: "GENERATE_SUB_SCENES",
+    VALIDATE_SUB_SCENES: "VALIDATE_SUB_SCENES",
+    REVIEW_OUTLINE: "REVIEW_OUTLINE",
+    VALIDATE_FINAL_OUTLINE: "VALIDATE_FINAL_OUTLINE",
+}
 
-def merge_outlines(original_outline, new_outline):
-    # Merge top-level attributes
-    merged = {
-        "title": new_outline.get("title", original_outline.get("title")),
-        "concept": new_outline.get("concept", original_outline.get("concept")),
-        "acts": []
-    }
-
-    # Create a dictionary of acts for easier merging
-    original_acts = {act["act_number"]: act for act in original_outline.get("acts", [])}
-    new_acts = {act["act_number"]: act for act in new_outline.get("acts", [])}
-
-    # Merge acts
-    for act_number in set(original_acts.keys()) | set(new_acts.keys()):
-        if act_number in new_acts:
-            merged_act = new_acts[act_number]
-            if act_number in original_acts:
-                # Merge scenes
-                original_scenes = {scene["scene_number"]: scene for scene in
-                                   original_acts[act_number].get("scenes", [])}
-                new_scenes = {scene["scene_number"]: scene for scene in merged_act.get("scenes", [])}
-
-                merged_scenes = []
-                for scene_number in set(original_scenes.keys()) | set(new_scenes.keys()):
-                    if scene_number in new_scenes:
-                        merged_scene = new_scenes[scene_number]
-                        if scene_number in original_scenes:
-                            # Merge sub-scenes
-                            original_sub_scenes = {sub["sub_scene_number"]: sub for sub in
-                                                   original_scenes[scene_number].get("sub_scenes", [])}
-                            new_sub_scenes = {sub["sub_scene_number"]: sub for sub in
-                                              merged_scene.get("sub_scenes", [])}
-
-                            merged_sub_scenes = list(new_sub_scenes.values())  # Prioritize new sub-scenes
-                            for sub_number, sub_scene in original_sub_scenes.items():
-                                if sub_number not in new_sub_scenes:
-                                    merged_sub_scenes.append(sub_scene)
-
-                            merged_scene["sub_scenes"] = merged_sub_scenes
-                    else:
-                        merged_scene = original_scenes[scene_number]
-                    merged_scenes.append(merged_scene)
-
-                merged_act["scenes"] = merged_scenes
-        else:
-            merged_act = original_acts[act_number]
-
-        merged["acts"].append(merged_act)
 
-    # Sort acts by act_number
-    merged["acts"].sort(key=lambda x: x["act_number"])
-
-    return merged
+def merge_outlines(original_outline, new_outline):
+    # Acts, scenes and sub-scenes of the new outline replace the ones with the same number, the rest are kept
+    merged = Outline.from_dict(original_outline).merge(Outline.from_dict(new_outline))
+    return merged.sort().to_dict()
 
 
 class ScriptAutomator:
     def __init__(self):
         self.config = load_json('config/settings.json')
-        self.llm_service = LLMService(provider_name=self.config.get('llm_provider', 'ollama'),
-                                      default_model=self.config.get('llm_model', 'gemma2:27b'))
-        self.llm_service_validation = LLMService(provider_name=self.config.get('llm_provider_validation', 'ollama'),
-                                                 default_model=self.config.get('llm_model_validation', 'gemma2:27b'))
+        self.cache = ResponseCache.from_config(self.config)
+        self.telemetry = Telemetry.from_config(self.config)
+        # Both stages route through their provider chain and fall back while a provider's circuit is open
+        self.llm_service = LLMRouter.from_config(self.config, cache=self.cache, telemetry=self.telemetry)
+        self.llm_service_validation = LLMRouter.from_config(self.config, cache=self.cache, telemetry=self.telemetry,
+                                                            validation=True)
+        self.budget = PromptBudget.from_config(self.config, self.llm_service.models)
         self.max_iterations = self.config.get('max_scene_iterations', 5)
         self.good_scene_threshold = self.config.get('good_scene_threshold', 0.8)
         self.use_local_context = self.config.get('use_local_context', True)
+        # Above 1, key scenes and sub-scenes are expanded concurrently with this many workers
+        self.outline_workers = self.config.get('outline_workers', 1)
+        # Outline nodes whose inputs haven't changed since the last run are reused from this manifest
+        self.outline_manifest_path = self.config.get('outline_manifest_path', 'output/outline_manifest.json')
 
     def run(self, generate_outline=False, generate_characters=False, generate_themes=False, generate_scenes=False, start_with_scene=None):
         logging.info("Starting script automation process")
@@ -98,38 +75,134 @@ class ScriptAutomator:
             themes = load_json('output/themes.json')
 
         if generate_scenes:
-            scene_generator = SceneGenerator(self.llm_service, self.llm_service_validation, self.config, characters, themes)
+            scene_generator = SceneGenerator(self.llm_service, self.llm_service_validation, self.config, characters, themes,
+                                             telemetry=self.telemetry)
             scenes = scene_generator.generate_scenes(outline, start_with_scene=start_with_scene)
 
+        if self.cache is not None:
+            logging.info(f"Response cache: {self.cache.stats()}")
+        for stats in LLMServiceFactory.scheduler_stats().values():
+            logging.info(f"Request scheduler: {stats}")
+        for name, stats in LLMServiceFactory.provider_stats().items():
+            logging.info(f"Provider {name}: {stats}")
+        if self.telemetry is not None:
+            self.telemetry.log_summary()
+            self.telemetry.write_prometheus()
         logging.info("Generation complete. Check the 'output' folder for results.")
 
 
     def generate_outline(self, concept):
         logging.info("Generating outline")
-        outline = self._generate_and_validate(GENERATE_ACTS, VALIDATE_ACTS, concept=concept)
-
-        for act in tqdm(outline['acts'], desc="Generating scenes", unit="act"):
-            act_scenes = self._generate_and_validate(GENERATE_KEY_SCENES, VALIDATE_KEY_SCENES,
-                                                     concept=concept, act=act, full_acts=outline['acts'])
-            act['scenes'] = act_scenes['scenes']
+        manifest = OutlineManifest(self.outline_manifest_path)
+        previous_acts = manifest.previous("acts")
+        if previous_acts is not None:
+            # Acts the revised concept doesn't affect come back unchanged, so everything below them is reused
+            outline = self._expand(manifest, "acts", node_inputs(concept), REVISE_ACTS, VALIDATE_ACTS,
+                                   concept=concept, previous_acts=json.dumps(previous_acts))
+        else:
+            outline = self._expand(manifest, "acts", node_inputs(concept), GENERATE_ACTS, VALIDATE_ACTS,
+                                   concept=concept)
 
-            for scene in tqdm(act['scenes'], desc=f"Generating sub-scenes for Act {act['act_number']}", unit="scene"):
-                sub_scenes = self._generate_and_validate(GENERATE_SUB_SCENES, VALIDATE_SUB_SCENES,
-                                                         concept=concept, scene=scene, previous_scene=None,
-                                                         full_scenes=act['scenes'])
-                scene['sub_scenes'] = sub_scenes['sub_scenes']
+        if self.outline_workers > 1:
+            self._expand_outline_concurrently(concept, outline, manifest)
+        else:
+            self._expand_outline(concept, outline, manifest)
 
-        final_outline = self._generate_and_validate(REVIEW_OUTLINE, VALIDATE_FINAL_OUTLINE,
-                                                    concept=concept, outline=outline)
+        final_outline = self._expand(manifest, "review", node_inputs([concept, outline]),
+                                     REVIEW_OUTLINE, VALIDATE_FINAL_OUTLINE, concept=concept, outline=outline)
 
         # Merge the final_outline with the original outline
         merged_outline = sort_json_content(merge_outlines(outline, final_outline))
 
+        manifest.save()
+        logging.info(f"Outline generated, {manifest.reused()} nodes reused from the last run")
         save_json('output/outline.json', merged_outline)
         return merged_outline
 
-    def _generate_and_validate(self, generate_prompt, validate_prompt, **kwargs):
+    def _expand(self, manifest, node_id, inputs, generate_prompt, validate_prompt, **kwargs):
+        """Generates and validates an outline node, unless it was generated from the same inputs before."""
+        content = manifest.get(node_id, inputs)
+        if content is None:
+            content = self._generate_and_validate(generate_prompt, validate_prompt, **kwargs)
+            manifest.put(node_id, inputs, content)
+        return content
+
+    def _drafts(self, manifest, generate_prompt, nodes):
+        """
+        First drafts of the (node id, inputs, prompt values) nodes not generated before, requested as one
+        batch so providers with a predictions API run them in parallel; validation and retries still
+        happen per node. Returns the drafts by node id.
+        """
+        pending = [(node_id, kwargs) for node_id, inputs, kwargs in nodes if manifest.get(node_id, inputs) is None]
+        prompts = [generate_prompt.format(**kwargs) for _, kwargs in pending]
+        drafts = self.llm_service.generate_many(prompts, format="json", prompt_type=PROMPT_TYPES.get(generate_prompt))
+        return {pending[index][0]: draft for index, draft in drafts}
+
+    def _expand_outline(self, concept, outline, manifest):
+        for act in tqdm(outline['acts'], desc="Generating scenes", unit="act"):
+            act_scenes = self._expand(manifest, f"act {act['act_number']}",
+                                      node_inputs(act, 'scenes', concept=concept, full_acts=outline['acts']),
+                                      GENERATE_KEY_SCENES, VALIDATE_KEY_SCENES,
+                                      concept=concept, act=act, full_acts=outline['acts'])
+            act['scenes'] = act_scenes['scenes']
+
+            # The scenes as the act defines them, so every draft is made from the same prompt it is validated with
+            full_scenes = [dict(scene) for scene in act['scenes']]
+            nodes = [(f"scene {scene['scene_number']}",
+                      node_inputs(scene, 'sub_scenes', concept=concept, full_scenes=full_scenes),
+                      dict(concept=concept, scene=scene, previous_scene=None, full_scenes=full_scenes))
+                     for scene in full_scenes]
+            drafts = self._drafts(manifest, GENERATE_SUB_SCENES, nodes)
+
+            for scene, (node_id, inputs, kwargs) in tqdm(zip(act['scenes'], nodes), total=len(nodes),
+                                                         desc=f"Generating sub-scenes for Act {act['act_number']}",
+                                                         unit="scene"):
+                sub_scenes = self._expand(manifest, node_id, inputs, GENERATE_SUB_SCENES, VALIDATE_SUB_SCENES,
+                                          draft=drafts.get(node_id), **kwargs)
+                scene['sub_scenes'] = sub_scenes['sub_scenes']
+
+    def _expand_outline_concurrently(self, concept, outline, manifest):
+        """
+        Expands all acts into key scenes at once, then all scenes into sub-scenes, with at most
+        `outline_workers` expansions in flight. Each expansion sees the acts (or the scenes of its act) as
+        fixed by the previous stage, so the outline doesn't depend on the order expansions finish in.
+        """
+        acts = [dict(act) for act in outline['acts']]
+        with ThreadPoolExecutor(max_workers=self.outline_workers) as executor:
+            try:
+                nodes = [(f"act {act['act_number']}", node_inputs(act, 'scenes', concept=concept, full_acts=acts),
+                          dict(concept=concept, act=act, full_acts=acts)) for act in acts]
+                drafts = self._drafts(manifest, GENERATE_KEY_SCENES, nodes)
+                futures = {executor.submit(self._expand, manifest, node_id, inputs, GENERATE_KEY_SCENES,
+                                           VALIDATE_KEY_SCENES, draft=drafts.get(node_id), **kwargs): index
+                           for index, (node_id, inputs, kwargs) in enumerate(nodes)}
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Generating scenes", unit="act"):
+                    outline['acts'][futures[future]]['scenes'] = future.result()['scenes']
+
+                scenes, nodes = [], []
+                for act in outline['acts']:
+                    full_scenes = [dict(scene) for scene in act['scenes']]
+                    scenes += act['scenes']
+                    nodes += [(f"scene {scene['scene_number']}",
+                               node_inputs(scene, 'sub_scenes', concept=concept, full_scenes=full_scenes),
+                               dict(concept=concept, scene=scene, previous_scene=None, full_scenes=full_scenes))
+                              for scene in full_scenes]
+                drafts = self._drafts(manifest, GENERATE_SUB_SCENES, nodes)
+                futures = {executor.submit(self._expand, manifest, node_id, inputs, GENERATE_SUB_SCENES,
+                                           VALIDATE_SUB_SCENES, draft=drafts.get(node_id), **kwargs): index
+                           for index, (node_id, inputs, kwargs) in enumerate(nodes)}
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Generating sub-scenes",
+                                   unit="scene"):
+                    scenes[futures[future]]['sub_scenes'] = future.result()['sub_scenes']
+            except BaseException:
+                # Expansions still queued are dropped; only the ones running are waited for
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def _generate_and_validate(self, generate_prompt, validate_prompt, draft=None, **kwargs):
         max_attempts = self.config.get('max_outline_generation_attempts', 3)
+        generate_type = PROMPT_TYPES.get(generate_prompt)
+        validate_type = PROMPT_TYPES.get(validate_prompt)
         feedback = None
         for attempt in range(max_attempts):
             # Generate content
@@ -137,50 +210,45 @@ class ScriptAutomator:
             if attempt > 0:
                 # Include previous feedback in the generation prompt
                 generation_prompt += f"\n\nPrevious attempt feedback: {feedback}\nPlease address these issues in your next generation attempt."
-            try:
-                content = self.llm_service.generate(generation_prompt, format="json")
-            except ModelError as e:
-                logging.warning(f"Model Error. Using fallback provider and model. Error: {str(e)}")
-                tmp_llm_service = LLMService(provider_name=self.config.get('llm_fallback_provider', 'openai'),
-                                             default_model=self.config.get('llm_fallback_model', 'gpt-4o'))
-                content = tmp_llm_service.generate(generation_prompt, format="json")
+            if attempt == 0 and isinstance(draft, dict):
+                content = draft
+            else:
+                content = self.llm_service.generate(generation_prompt, format="json", prompt_type=generate_type,
+                                                    attempt=attempt)
 
             # Validate content
             validate_kwargs = kwargs.copy()
             validate_kwargs['content'] = json.dumps(content)
-            try:
-                validation = self.llm_service.generate(validate_prompt.format(**validate_kwargs), format="json")
-            except ModelError as e:
-                logging.warning(f"Model Error. Using fallback provider and model. Error: {str(e)}")
-                tmp_llm_service = LLMService(provider_name=self.config.get('llm_fallback_provider', 'openai'),
-                                             default_model=self.config.get('llm_fallback_model', 'gpt-4o'))
-                validation = tmp_llm_service.generate(validate_prompt.format(**validate_kwargs), format="json")
+            validation = self.llm_service.generate(validate_prompt.format(**validate_kwargs), format="json",
+                                                   prompt_type=validate_type, attempt=attempt)
 
             if isinstance(validation, dict) and validation.get('is_valid', False):
                 return content
             else:
+                # Rejected content must not be replayed from the cache on the next run
+                self.llm_service.invalidate(generation_prompt, format="json")
                 feedback = validation.get('feedback', "No feedback provided.") if isinstance(validation,
                                                                                              dict) else "Invalid validation response"
                 logging.warning(f"Validation failed. Attempt {attempt + 1}/{max_attempts}. Feedback: {feedback}")
 
         raise ValueError(f"Failed to generate valid content after {max_attempts} attempts.")
 
+    def _outline_section(self, template, concept, outline):
+        # Without room for the full outline, the scenes are sent without their sub-scenes
+        return self.budget.fit(template, [
+            PromptSection("outline", [json.dumps(outline), OutlineIndex(outline).skeleton_json], priority=1),
+        ], concept=concept)
+
     def develop_characters(self, concept, outline):
         logging.info("Developing characters")
-        prompt = DEVELOP_CHARACTERS.format(
-            concept=concept,
-            outline=json.dumps(outline),
-        )
-        characters = self.llm_service.generate(prompt, format="json")
+        prompt = DEVELOP_CHARACTERS.format(concept=concept, **self._outline_section(DEVELOP_CHARACTERS, concept, outline))
+        characters = self.llm_service.generate(prompt, format="json", prompt_type="DEVELOP_CHARACTERS")
         save_json('output/characters.json', characters)
         return characters
 
     def identify_themes(self, concept, outline):
         logging.info("Identifying themes")
-        prompt = IDENTIFY_THEMES.format(
-            concept=concept,
-            outline=json.dumps(outline),
-        )
-        themes = self.llm_service.generate(prompt, format="json")
+        prompt = IDENTIFY_THEMES.format(concept=concept, **self._outline_section(IDENTIFY_THEMES, concept, outline))
+        themes = self.llm_service.generate(prompt, format="json", prompt_type="IDENTIFY_THEMES")
         save_json('output/themes.json', themes)
         return themes
\ No newline at end of file
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from typing import Any, Collection, Dict, List, Optional
+
+from src.llm.LLMService import LLMService
+from src.llm.Telemetry import Telemetry
+from src.utils.OutlineModel import scene_key
+from src.utils.file_handlers import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _chunk_markdown(markdown: str, chunk_size: int) -> List[str]:
+    chunks = []
+    current = ""
+    for paragraph in markdown.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ContextIndex:
+    """
+    Local vector index over chunks of the generated script. Chunks are embedded in batches and
+    the most relevant earlier passages for a sub-scene are retrieved within a character budget.
+    Embeddings are persisted by chunk hash, so restarts don't re-embed existing scenes.
+    """
+
+    def __init__(self, llm_service: LLMService, model: str = None, batch_size: int = 16, chunk_size: int = 1500,
+                 path: str = None, max_failures: int = 3):
+        self.llm_service = llm_service
+        self.model = model
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.path = path
+        self.max_failures = max_failures
+        self.enabled = True
+        self._failures = 0
+        self._chunks: List[Dict[str, Any]] = []
+        self._pending: List[Dict[str, Any]] = []
+        self._vectors: Dict[str, List[float]] = load_json(path) if path and os.path.exists(path) else {}
+        # _lock guards the index and is never held across a request; _flush_lock lets one flush run at a time
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], telemetry: Telemetry = None) -> Optional["ContextIndex"]:
+        settings = config.get('retrieval_context', {})
+        if not settings.get('enabled', False):
+            return None
+        service = LLMService(provider_name=settings.get('embedding_provider', 'ollama'),
+                             default_model=settings.get('embedding_model', 'nomic-embed-text'),
+                             telemetry=telemetry)
+        return cls(service,
+                   batch_size=settings.get('batch_size', 16),
+                   chunk_size=settings.get('chunk_size', 1500),
+                   path=settings.get('path', 'output/context_index.json'),
+                   max_failures=settings.get('max_failures', 3))
+
+    def add_scene(self, scene_number: str, markdown: str):
+        with self._lock:
+            # A refined scene replaces its previous chunks
+            self._chunks = [chunk for chunk in self._chunks if chunk['scene_number'] != scene_number]
+            self._pending = [chunk for chunk in self._pending if chunk['scene_number'] != scene_number]
+            for order, text in enumerate(_chunk_markdown(markdown, self.chunk_size)):
+                key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                chunk = {'scene_number': scene_number, 'order': order, 'text': text, 'key': key}
+                if key in self._vectors:
+                    self._chunks.append(chunk)
+                else:
+                    self._pending.append(chunk)
+            full_batch = len(self._pending) >= self.batch_size
+        if full_batch:
+            self.flush()
+
+    def flush(self) -> bool:
+        """Embeds the pending chunks. Returns False if some of them couldn't be embedded this time."""
+        with self._flush_lock:
+            embedded = False
+            while True:
+                with self._lock:
+                    if not self.enabled:
+                        return False
+                    batch = self._pending[:self.batch_size]
+                if not batch:
+                    break
+                vectors = self._embed([chunk['text'] for chunk in batch])
+                if vectors is None:
+                    return False
+                with self._lock:
+                    for chunk, vector in zip(batch, vectors):
+                        self._vectors[chunk['key']] = vector
+                    # Chunks of a scene replaced in the meantime are no longer pending and stay out
+                    done = {id(chunk) for chunk in batch}
+                    self._chunks += [chunk for chunk in self._pending if id(chunk) in done]
+                    self._pending = [chunk for chunk in self._pending if id(chunk) not in done]
+                embedded = True
+            if embedded and self.path:
+                with self._lock:
+                    vectors = dict(self._vectors)
+                save_json(self.path, vectors)
+            return True
+
+    def _embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        try:
+            response = self.llm_service.generate_embeddings(texts, model=self.model)
+        except Exception as e:  # e.g. a network error; only this call falls back to the tail of the script
+            with self._lock:
+                self._failures += 1
+                failures = self._failures
+                if failures >= self.max_failures:
+                    self.enabled = False
+            logger.warning(f"Embedding request failed ({failures} in a row): {str(e)}")
+            if failures >= self.max_failures:
+                logger.warning("Giving up on embeddings. Falling back to the tail of the script as context.")
+            return None
+        embeddings = response.get('embeddings') if isinstance(response, dict) else None
+        if not embeddings or len(embeddings) != len(texts):
+            logger.warning(f"Embeddings unavailable from {self.llm_service.name()}. "
+                           f"Falling back to the tail of the script as context.")
+            self.enabled = False
+            return None
+        with self._lock:
+            self._failures = 0
+        return embeddings
+
+    def retrieve(self, query: str, budget: int, before: str = None,
+                 scenes: Collection[str] = None) -> Optional[str]:
+        """
+        Returns the most relevant passages from scenes before `before` (and among `scenes`, if given), in
+        script order, ending with the most recent passage. Returns None if the index can't be used for
+        this call, e.g. because the latest scenes couldn't be embedded.
+        """
+        if not self.flush():
+            return None
+
+        before_key = scene_key(before) if before is not None else None
+        with self._lock:
+            chunks = [chunk for chunk in self._chunks
+                      if (before_key is None or scene_key(chunk['scene_number']) < before_key)
+                      and (scenes is None or chunk['scene_number'] in scenes)]
+            vectors = {chunk['key']: self._vectors[chunk['key']] for chunk in chunks}
+        if not chunks:
+            return ""
+
+        query_vector = self._embed([query])
+        if query_vector is None:
+            return None
+
+        def position(chunk):
+            return scene_key(chunk['scene_number']), chunk['order']
+
+        # The latest passage is always kept so the new sub-scene continues the script seamlessly
+        latest = max(chunks, key=position)
+        selected = [latest]
+        used = len(latest['text'])
+        ranked = sorted((chunk for chunk in chunks if chunk is not latest),
+                        key=lambda chunk: _cosine(query_vector[0], vectors[chunk['key']]), reverse=True)
+        for chunk in ranked:
+            if used + len(chunk['text']) > budget:
+                continue
+            selected.append(chunk)
+            used += len(chunk['text'])
+
+        selected.sort(key=position)
+        return "\n\n...\n\n".join(f"[Scene {chunk['scene_number']}]\n{chunk['text']}" for chunk in selected)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"chunks": len(self._chunks), "pending": len(self._pending), "enabled": self.enabled}
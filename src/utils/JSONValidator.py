@@ -1,8 +1,34 @@
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+
+
+CONTENT_TYPES = ["dialog", "action", "transition"]
+STORY_ELEMENT_TYPES = ["character_name", "location", "object", "event", "other"]
+STORY_ELEMENT_SCOPES = ["global", "act", "scene"]
 
 
 class JSONValidator:
+    @staticmethod
+    def validate_content_type(content_type: Any):
+        if content_type not in CONTENT_TYPES:
+            raise ValueError(f"Invalid content type: {content_type}")
+
+    @staticmethod
+    def validate_content_item(item: Any):
+        if not isinstance(item, dict):
+            raise TypeError("Each item in 'content' must be a dictionary")
+
+        if "type" not in item:
+            raise KeyError("Each content item must have a 'type'")
+
+        JSONValidator.validate_content_type(item["type"])
+
+        if "text" not in item:
+            raise KeyError("Each content item must have 'text'")
+
+        if item["type"] == "dialog" and "character" not in item:
+            raise KeyError("Dialog items must have a 'character'")
+
     @staticmethod
     def validate_scene_json(scene_json: str) -> Optional[Dict[str, Any]]:
         try:
@@ -17,20 +43,7 @@ class JSONValidator:
                 raise TypeError("'content' must be a list")
 
             for item in scene_json["content"]:
-                if not isinstance(item, dict):
-                    raise TypeError("Each item in 'content' must be a dictionary")
-
-                if "type" not in item:
-                    raise KeyError("Each content item must have a 'type'")
-
-                if item["type"] not in ["dialog", "action", "transition"]:
-                    raise ValueError(f"Invalid content type: {item['type']}")
-
-                if "text" not in item:
-                    raise KeyError("Each content item must have 'text'")
-
-                if item["type"] == "dialog" and "character" not in item:
-                    raise KeyError("Dialog items must have a 'character'")
+                JSONValidator.validate_content_item(item)
 
             return scene_json
         except json.JSONDecodeError as e:
@@ -38,4 +51,20 @@ class JSONValidator:
         except (KeyError, TypeError, ValueError) as e:
             print(f"Validation error: {e}")
 
-        return None
\ No newline at end of file
+        return None
+
+    @staticmethod
+    def validate_story_elements(response: Any) -> Optional[List[Dict[str, Any]]]:
+        """Returns the well-formed story elements of an extraction response, or None if it has none."""
+        if not isinstance(response, dict) or not isinstance(response.get("story_elements"), list):
+            print("Validation error: 'story_elements' must be a list")
+            return None
+
+        elements = []
+        for element in response["story_elements"]:
+            if (isinstance(element, dict) and isinstance(element.get("content"), str) and element["content"].strip()
+                    and element.get("scope") in STORY_ELEMENT_SCOPES):
+                if element.get("type") not in STORY_ELEMENT_TYPES:
+                    element = {**element, "type": "other"}
+                elements.append(element)
+        return elements
@@ -0,0 +1,105 @@
+import json
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
+
+from src.utils.OutlineModel import Outline, SceneKey, scene_key
+
+SEPARATORS = (",", ":")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=SEPARATORS, ensure_ascii=False)
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _compose(obj: Dict[str, Any], key: str, items: List[str]) -> str:
+    # Serializes obj with obj[key] replaced by the already serialized items, keeping the key order
+    fields = [f"{_dumps(name)}:[{','.join(items)}]" if name == key else f"{_dumps(name)}:{_dumps(value)}"
+              for name, value in obj.items()]
+    return "{" + ",".join(fields) + "}"
+
+
+class OutlineView:
+    """
+    The outline as seen by one scene: every other scene without its sub-scenes. Read-only.
+    `reduced_json` only keeps the scene's own act in detail, for prompts that don't fit otherwise.
+    """
+    __slots__ = ("scene_number", "outline", "json", "reduced_json")
+
+    def __init__(self, scene_number: str, outline: Mapping[str, Any], json_text: str, reduced_json: str):
+        self.scene_number = scene_number
+        self.outline = outline
+        self.json = json_text
+        self.reduced_json = reduced_json
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.outline.get(key, default)
+
+
+class OutlineIndex:
+    """
+    Indexes the outline once into one view per scene, shared by all of its sub-scenes. Acts and scenes
+    without sub-scenes are built and serialized once and shared by every view, so building a prompt is a
+    lookup instead of copying and serializing the whole outline.
+    """
+
+    def __init__(self, outline: Dict[str, Any]):
+        self.outline = _freeze(outline)
+        self.json = _dumps(outline)
+        self.model = Outline.from_dict(outline)
+        self._views: Dict[SceneKey, OutlineView] = {}
+        self._sub_scenes: Dict[SceneKey, Dict[str, Any]] = {}
+
+        # The model gives the structure and the parsed numbers; the dicts are what gets serialized
+        acts = [act.to_dict() for act in self.model.acts]
+        stripped_scenes = [[{key: value for key, value in scene.items() if key != 'sub_scenes'}
+                            for scene in act['scenes']] for act in acts]
+        stripped_scene_json = [[_dumps(scene) for scene in scenes] for scenes in stripped_scenes]
+        stripped_acts = [{**act, 'scenes': scenes} for act, scenes in zip(acts, stripped_scenes)]
+        frozen_acts = [_freeze(act) for act in stripped_acts]
+        stripped_act_json = [_compose(act, 'scenes', scene_json)
+                             for act, scene_json in zip(stripped_acts, stripped_scene_json)]
+        act_summary_json = [_dumps({key: value for key, value in act.items() if key != 'scenes'}) for act in acts]
+        # The whole outline without sub-scenes
+        self.skeleton_json = _compose(outline, 'acts', stripped_act_json)
+
+        for act_index, (act_node, act) in enumerate(zip(self.model.acts, acts)):
+            for scene_index, (scene_node, scene) in enumerate(zip(act_node.scenes, act['scenes'])):
+                if not scene_node.sub_scenes:
+                    continue
+                scenes = list(stripped_scenes[act_index])
+                scenes[scene_index] = scene
+                scene_json = list(stripped_scene_json[act_index])
+                scene_json[scene_index] = _dumps(scene)
+                act_view = {**act, 'scenes': scenes}
+                act_json = list(stripped_act_json)
+                act_json[act_index] = _compose(act_view, 'scenes', scene_json)
+                act_views = list(frozen_acts)
+                act_views[act_index] = _freeze(act_view)
+
+                reduced_json = list(act_summary_json)
+                reduced_json[act_index] = act_json[act_index]
+
+                view = OutlineView(scene['scene_number'],
+                                   MappingProxyType({**self.outline, 'acts': tuple(act_views)}),
+                                   _compose(outline, 'acts', act_json),
+                                   _compose(outline, 'acts', reduced_json))
+                for sub_scene_node, sub_scene in zip(scene_node.sub_scenes, scene['sub_scenes']):
+                    self._views[sub_scene_node.key] = view
+                    self._sub_scenes[sub_scene_node.key] = sub_scene
+
+    def view(self, sub_scene_number: str) -> OutlineView:
+        return self._views[scene_key(sub_scene_number)]
+
+    def sub_scene(self, sub_scene_number: str) -> Optional[Dict[str, Any]]:
+        return self._sub_scenes.get(scene_key(sub_scene_number))
+
+    def sub_scenes(self) -> List[Dict[str, Any]]:
+        return list(self._sub_scenes.values())
@@ -0,0 +1,66 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from src.utils.file_handlers import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+
+def node_inputs(value: Any, *excluded: str, **context: Any) -> str:
+    """
+    Hash of the inputs a node was generated from: `value` without its `excluded` keys (e.g. the node's own
+    children), together with the other values of its prompt given as `context`.
+    """
+    if isinstance(value, dict):
+        value = {key: item for key, item in value.items() if key not in excluded}
+    if context:
+        value = {"node": value, **context}
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class OutlineManifest:
+    """
+    What each node of the last generated outline (the acts, the key scenes of each act, the sub-scenes of
+    each scene) was generated from and what it produced. A node whose inputs are unchanged is reused on
+    the next run; a changed node changes the inputs of its children, so they are regenerated too.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._nodes: Dict[str, Dict[str, Any]] = load_json(path) if path and os.path.exists(path) else {}
+        self._used: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, node_id: str, inputs: str) -> Optional[Any]:
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is None or node['inputs'] != inputs:
+                return None
+            self._used[node_id] = node
+            return copy.deepcopy(node['output'])
+
+    def previous(self, node_id: str) -> Optional[Any]:
+        """The node as generated on the last run, whatever its inputs were."""
+        with self._lock:
+            node = self._nodes.get(node_id)
+            return copy.deepcopy(node['output']) if node is not None else None
+
+    def put(self, node_id: str, inputs: str, output: Any):
+        with self._lock:
+            self._used[node_id] = {'inputs': inputs, 'output': copy.deepcopy(output)}
+
+    def reused(self) -> int:
+        with self._lock:
+            return sum(1 for node_id, node in self._used.items() if self._nodes.get(node_id) is node)
+
+    def save(self):
+        """Keeps the nodes of this run only, so nodes of dropped acts and scenes don't linger."""
+        with self._lock:
+            self._nodes = dict(self._used)
+            if self.path:
+                save_json(self.path, self._nodes)
@@ -0,0 +1,223 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+SceneKey = Tuple[int, ...]
+
+# Marks where a node's children were among its fields, so they are written back in the same place
+_CHILDREN = object()
+
+
+def scene_key(number: Union[str, int]) -> SceneKey:
+    """Parses a scene number such as "1.2.3" into (1, 2, 3). Trailing zeros are ignored ("1.2" == "1.2.0")."""
+    parts = [int(part) for part in str(number).split('.')]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+class _Node:
+    """
+    A JSON object with a list of child objects. Fields other than the children are kept as they are, in
+    their original order, so converting back to JSON is lossless. Children are indexed by number.
+    """
+    __slots__ = ("fields", "children", "_index")
+    CHILDREN: Optional[str] = None
+    CHILD: Optional[type] = None
+
+    def __init__(self, fields: Dict[str, Any] = None, children: List["_NumberedNode"] = None):
+        self.fields = dict(fields or {})
+        self.children = list(children or [])
+        self._index: Optional[Dict[SceneKey, "_NumberedNode"]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        fields = dict(data)
+        children = None
+        if cls.CHILDREN is not None and isinstance(data.get(cls.CHILDREN), list):
+            children = [cls.CHILD.from_dict(child) for child in data[cls.CHILDREN]]
+            fields[cls.CHILDREN] = _CHILDREN
+        return cls(fields, children)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: [child.to_dict() for child in self.children] if value is _CHILDREN else value
+                for name, value in self.fields.items()}
+        if self.children and self.CHILDREN not in data:
+            data[self.CHILDREN] = [child.to_dict() for child in self.children]
+        return data
+
+    def copy(self, children: List["_NumberedNode"] = None):
+        node = type(self)(self.fields, self.children)
+        if children is not None:
+            node.set_children(children)
+        return node
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = self.fields.get(name, default)
+        return default if value is _CHILDREN else value
+
+    def child(self, number: Union[str, int]) -> Optional["_NumberedNode"]:
+        if self._index is None:
+            self._index = {child.key: child for child in self.children}
+        return self._index.get(scene_key(number))
+
+    def set_children(self, children: List["_NumberedNode"]):
+        self.children = list(children)
+        self._index = None
+        if self.CHILDREN in self.fields:
+            self.fields[self.CHILDREN] = _CHILDREN
+
+    def sort(self):
+        """Sorts the children, and theirs, by number."""
+        self.children.sort(key=lambda child: child.key)
+        for child in self.children:
+            child.sort()
+        return self
+
+
+class _NumberedNode(_Node):
+    __slots__ = ("key",)
+    NUMBER = ""
+
+    def __init__(self, fields: Dict[str, Any] = None, children: List["_NumberedNode"] = None):
+        super().__init__(fields, children)
+        self.key = scene_key(self.fields[self.NUMBER])
+
+    @property
+    def number(self) -> Any:
+        return self.fields[self.NUMBER]
+
+
+class SubScene(_NumberedNode):
+    __slots__ = ()
+    NUMBER = "sub_scene_number"
+
+
+class Scene(_NumberedNode):
+    __slots__ = ()
+    NUMBER = "scene_number"
+    CHILDREN = "sub_scenes"
+    CHILD = SubScene
+
+    @property
+    def sub_scenes(self) -> List[SubScene]:
+        return self.children
+
+
+class Act(_NumberedNode):
+    __slots__ = ()
+    NUMBER = "act_number"
+    CHILDREN = "scenes"
+    CHILD = Scene
+
+    @property
+    def scenes(self) -> List[Scene]:
+        return self.children
+
+
+class Outline(_Node):
+    """
+    The outline as acts, scenes and sub-scenes, with parsed scene-number keys. Every act, scene and sub-scene
+    can be looked up by number in O(1); iteration is in outline order.
+    """
+    __slots__ = ("_scenes", "_sub_scenes")
+    CHILDREN = "acts"
+    CHILD = Act
+
+    def __init__(self, fields: Dict[str, Any] = None, children: List[Act] = None):
+        super().__init__(fields, children)
+        self._scenes: Optional[Dict[SceneKey, Scene]] = None
+        self._sub_scenes: Optional[Dict[SceneKey, SubScene]] = None
+
+    @property
+    def acts(self) -> List[Act]:
+        return self.children
+
+    def act(self, number: Union[str, int]) -> Optional[Act]:
+        return self.child(number)
+
+    def scenes(self) -> Iterator[Scene]:
+        for act in self.children:
+            yield from act.children
+
+    def sub_scenes(self) -> Iterator[SubScene]:
+        for scene in self.scenes():
+            yield from scene.children
+
+    def scene(self, number: str) -> Optional[Scene]:
+        if self._scenes is None:
+            self._scenes = {scene.key: scene for scene in self.scenes()}
+        return self._scenes.get(scene_key(number))
+
+    def sub_scene(self, number: str) -> Optional[SubScene]:
+        if self._sub_scenes is None:
+            self._sub_scenes = {sub_scene.key: sub_scene for sub_scene in self.sub_scenes()}
+        return self._sub_scenes.get(scene_key(number))
+
+    def set_children(self, children: List[Act]):
+        super().set_children(children)
+        self._scenes = self._sub_scenes = None
+
+    def sort(self) -> "Outline":
+        super().sort()
+        self._scenes = self._sub_scenes = None
+        return self
+
+    def merge(self, new: "Outline") -> "Outline":
+        """
+        Merges a revised outline into this one. Acts, scenes and sub-scenes of `new` replace the ones with the
+        same number; the ones only in this outline are kept. Only title, concept and acts are carried over.
+        """
+        fields = {"title": new.fields.get("title", self.fields.get("title")),
+                  "concept": new.fields.get("concept", self.fields.get("concept")),
+                  "acts": _CHILDREN}
+        return Outline(fields, _merge_children(self.children, new.children, depth=2))
+
+
+def _merge_children(original: List[_NumberedNode], new: List[_NumberedNode], depth: int) -> List[_NumberedNode]:
+    # A node in both lists is taken from `new`; down to `depth` levels it gets the merged children of both
+    originals = {node.key: node for node in original}
+    merged = []
+    for node in new:
+        previous = originals.pop(node.key, None)
+        if previous is not None and depth > 0:
+            node = node.copy(_merge_children(previous.children, node.children, depth - 1))
+        merged.append(node)
+    return merged + list(originals.values())
+
+
+class SceneContent:
+    """A generated scene (scene number, location, time and content items), kept losslessly like the outline."""
+    __slots__ = ("fields", "key")
+
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = dict(fields)
+        try:
+            self.key = scene_key(self.fields.get('scene_number', ''))
+        except ValueError:
+            self.key = None  # e.g. "Scene 3" instead of "1.2.3"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SceneContent":
+        return cls(data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.fields)
+
+    @property
+    def scene_number(self) -> str:
+        return self.fields['scene_number']
+
+    @property
+    def location(self) -> str:
+        return self.fields['location']
+
+    @property
+    def time(self) -> str:
+        return self.fields['time']
+
+    @property
+    def content(self) -> List[Dict[str, Any]]:
+        return self.fields['content']
+
+    @property
+    def act(self) -> Optional[int]:
+        return self.key[0] if self.key else None
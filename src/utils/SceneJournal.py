@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.OutlineIndex import OutlineIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _outline_digest(sub_scene: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(sub_scene, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class SceneProgress:
+    """Where the generate/evaluate/refine loop of a sub-scene stood when the journal was last written."""
+    __slots__ = ("content", "evaluation", "attempt", "best_scene", "best_score")
+
+    def __init__(self, content: Dict[str, Any]):
+        self.content = content
+        self.evaluation = None
+        self.attempt = 0
+        self.best_scene = None
+        self.best_score = 0
+
+
+class SceneJournal:
+    """
+    Append-only log of every draft, evaluation, refinement and accepted sub-scene. After a crash or an
+    interrupted run, one sequential read of the journal gives back the accepted sub-scenes and where the
+    loop of each unfinished one stood, so generation continues mid-loop. Entries of a sub-scene whose
+    outline has changed since are ignored. A torn last line (a crash while writing) is skipped.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["SceneJournal"]:
+        settings = config.get('scene_journal', {})
+        if not settings.get('enabled', True):
+            return None
+        return cls(settings.get('path', 'output/scene_journal.jsonl'), fsync=settings.get('fsync', False))
+
+    def _append(self, event: str, sub_scene: Dict[str, Any], **fields: Any):
+        entry = {"event": event, "scene_number": sub_scene['sub_scene_number'], "outline": _outline_digest(sub_scene),
+                 "timestamp": time.time(), **fields}
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _open(self):
+        # A crash may have left a torn last line; start on a new line so the next entry stays readable
+        torn = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        file = open(self.path, 'a')
+        if torn:
+            file.write("\n")
+        return file
+
+    def draft(self, sub_scene: Dict[str, Any], content: Dict[str, Any]):
+        self._append("draft", sub_scene, content=content)
+
+    def evaluation(self, sub_scene: Dict[str, Any], attempt: int, evaluation: Any, score: float):
+        self._append("evaluation", sub_scene, attempt=attempt, evaluation=evaluation, score=score)
+
+    def refinement(self, sub_scene: Dict[str, Any], attempt: int, content: Optional[Dict[str, Any]]):
+        self._append("refinement", sub_scene, attempt=attempt, content=content)
+
+    def accepted(self, sub_scene: Dict[str, Any], scene: Dict[str, Any]):
+        self._append("accepted", sub_scene, scene=scene)
+
+    def replay(self, outline: OutlineIndex) -> Tuple[List[Dict[str, Any]], Dict[str, SceneProgress]]:
+        """Returns the accepted sub-scenes in outline order and the progress of the unfinished ones."""
+        if not os.path.exists(self.path):
+            return [], {}
+
+        digests = {sub_scene['sub_scene_number']: _outline_digest(sub_scene) for sub_scene in outline.sub_scenes()}
+        accepted: Dict[str, Dict[str, Any]] = {}
+        progress: Dict[str, SceneProgress] = {}
+        with open(self.path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping unreadable line {line_number} of {self.path}")
+                    continue
+                scene_number = entry.get('scene_number')
+                if digests.get(scene_number) != entry.get('outline'):
+                    continue
+
+                event = entry.get('event')
+                if event == "draft":
+                    accepted.pop(scene_number, None)
+                    progress[scene_number] = SceneProgress(entry['content'])
+                elif event == "accepted":
+                    accepted[scene_number] = entry['scene']
+                    progress.pop(scene_number, None)
+                elif scene_number in progress:
+                    state = progress[scene_number]
+                    if event == "evaluation":
+                        state.evaluation = entry['evaluation']
+                        state.attempt = entry['attempt']
+                        if state.content is not None and entry['score'] > state.best_score:
+                            state.best_scene, state.best_score = state.content, entry['score']
+                    elif event == "refinement":
+                        state.content = entry['content']
+                        state.evaluation = None
+                        state.attempt = entry['attempt'] + 1
+
+        if accepted or progress:
+            logger.info(f"Resuming from {self.path}: {len(accepted)} accepted sub-scenes, "
+                        f"{len(progress)} in progress")
+        return [accepted[number] for number in digests if number in accepted], progress
+
+    def complete(self):
+        """Sets the journal of a finished run aside, so the next run starts from scratch."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.complete")
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional
+
+from src.utils.OutlineModel import SceneKey, scene_key
+from src.utils.file_handlers import load_json, save_json, save_json_atomic, save_txt
+
+logger = logging.getLogger(__name__)
+
+
+class SceneManifest:
+    """
+    Index of the scene files in the scenes directory: per sub-scene the paths of its JSON and markdown
+    files, the hash of its text, its score, its status and how often it was written. Kept in scene order,
+    so "the scenes before X", "the latest version of Y" and "the scenes still missing" are answered from
+    the index alone; only the scenes that are actually loaded are read from disk.
+
+    A saved scene is appended to a log next to the manifest rather than rewriting it; the log is folded
+    into the manifest (written atomically) when the manifest is opened again.
+    """
+
+    def __init__(self, directory: str = 'output/scenes', path: str = None):
+        self.directory = directory
+        self.path = path or os.path.join(directory, 'manifest.json')
+        self.log_path = f"{self.path}.log"
+        self._log = None
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = load_json(self.path) if os.path.exists(self.path) else {}
+        if self._replay_log():
+            self.compact()
+        if not self._records and os.path.isdir(directory):
+            self._records = self._scan()
+        self._numbers = sorted(self._records, key=scene_key)
+        self._keys: List[SceneKey] = [scene_key(number) for number in self._numbers]
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SceneManifest":
+        settings = config.get('scene_manifest', {})
+        return cls(settings.get('directory', 'output/scenes'), settings.get('path'))
+
+    def _replay_log(self) -> bool:
+        """Applies the scenes saved since the manifest was last written; returns whether there were any."""
+        if not os.path.exists(self.log_path):
+            return False
+        with open(self.log_path) as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash while writing
+                    logger.warning(f"Skipping unreadable line {line_number} of {self.log_path}")
+                    continue
+                self._records[record.pop('scene_number')] = record
+        return True
+
+    def compact(self):
+        """Writes the manifest with every saved scene and starts a new log."""
+        with self._lock:
+            save_json_atomic(self.path, self._records)
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+
+    def _scan(self) -> Dict[str, Dict[str, Any]]:
+        # Scenes written before there was a manifest; indexed once, from then on the manifest is kept current
+        records = {}
+        for filename in os.listdir(self.directory):
+            if filename.startswith('scene_') and filename.endswith('.json'):
+                scene_number = filename[len('scene_'):-len('.json')]
+                try:
+                    scene_key(scene_number)
+                except ValueError:
+                    logger.warning(f"Skipping {filename}: not a scene number")
+                    continue
+                records[scene_number] = {'json': os.path.join(self.directory, filename),
+                                         'markdown': os.path.join(self.directory, f"scene_{scene_number}.md"),
+                                         'digest': None, 'score': None, 'status': 'accepted', 'version': 1,
+                                         'updated': os.path.getmtime(os.path.join(self.directory, filename))}
+        if records:
+            logger.info(f"Indexed {len(records)} existing scenes in {self.directory}")
+            save_json_atomic(self.path, records)
+        return records
+
+    def save_scene(self, scene_content: Dict[str, Any], markdown: str, status: str = 'accepted'):
+        """Writes the scene files of a sub-scene and records them; a rewritten scene becomes its latest version."""
+        scene_number = scene_content['scene_number']
+        json_path = os.path.join(self.directory, f"scene_{scene_number}.json")
+        markdown_path = os.path.join(self.directory, f"scene_{scene_number}.md")
+        save_json(json_path, scene_content)
+        save_txt(markdown_path, markdown)
+
+        with self._lock:
+            previous = self._records.get(scene_number)
+            record = {
+                'json': json_path, 'markdown': markdown_path,
+                'digest': hashlib.sha256(markdown.encode("utf-8")).hexdigest(),
+                'score': scene_content.get('score'), 'status': status,
+                'version': previous['version'] + 1 if previous else 1, 'updated': time.time()}
+            self._records[scene_number] = record
+            if previous is None:
+                key = scene_key(scene_number)
+                index = bisect_left(self._keys, key)
+                self._keys.insert(index, key)
+                self._numbers.insert(index, scene_number)
+            if self._log is None:
+                self._log = self._open_log()
+            self._log.write(json.dumps({'scene_number': scene_number, **record}) + "\n")
+            self._log.flush()
+
+    def _open_log(self):
+        # A crash may have left a torn last line; start on a new line so the next record stays readable
+        if os.path.dirname(self.log_path):
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        torn = False
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+            with open(self.log_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        file = open(self.log_path, 'a')
+        if torn:
+            file.write("\n")
+        return file
+
+    def latest(self, scene_number: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._records.get(scene_number)
+
+    def before(self, scene_number: str) -> List[str]:
+        """The recorded scene numbers before `scene_number`, in scene order."""
+        with self._lock:
+            return self._numbers[:bisect_left(self._keys, scene_key(scene_number))]
+
+    def missing(self, scene_numbers: Iterable[str]) -> List[str]:
+        with self._lock:
+            return [number for number in scene_numbers if number not in self._records]
+
+    def load(self, scene_numbers: Iterable[str]) -> List[Dict[str, Any]]:
+        """Reads the JSON files of the given scenes; scenes whose file has gone are left out."""
+        scenes = []
+        for scene_number in scene_numbers:
+            record = self.latest(scene_number)
+            if record is None or not os.path.exists(record['json']):
+                logger.warning(f"Scene file of scene {scene_number} not found, skipping it")
+                continue
+            scenes.append(load_json(record['json']))
+        return scenes
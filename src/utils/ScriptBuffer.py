@@ -0,0 +1,128 @@
+import hashlib
+import json
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.utils.sort_and_compare import scene_number_key
+
+# Renders a scene's content given the act of the scene before it; returns the markdown and the scene's act
+Renderer = Callable[[Dict[str, Any], Optional[int]], Tuple[str, int]]
+
+
+class _Segment:
+    __slots__ = ("content", "digest", "previous_act", "act", "markdown")
+
+    def __init__(self, content: Dict[str, Any], digest: str):
+        self.content = content
+        self.digest = digest
+        self.previous_act = None
+        self.act = None
+        self.markdown = ""
+
+
+class ScriptBuffer:
+    """
+    The script as rendered per-scene markdown segments in scene order. A segment is only re-rendered
+    when its content changes (or the act of the scene before it does), and the full text is cached
+    until the next change, so updating one scene doesn't re-render the whole script.
+    """
+
+    def __init__(self, render: Renderer):
+        self._render = render
+        self._keys: List[Tuple[int, ...]] = []
+        self._numbers: List[str] = []
+        self._segments: Dict[str, _Segment] = {}
+        self._full: Optional[str] = None
+        self._lock = threading.RLock()
+
+    def set(self, scene_number: str, content: Dict[str, Any]) -> str:
+        """Adds or replaces a scene and returns its rendered markdown."""
+        digest = hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+        with self._lock:
+            segment = self._segments.get(scene_number)
+            if segment is not None and segment.digest == digest:
+                return segment.markdown
+
+            key = scene_number_key(scene_number)
+            index = bisect_left(self._keys, key)
+            if segment is None:
+                self._keys.insert(index, key)
+                self._numbers.insert(index, scene_number)
+            self._segments[scene_number] = _Segment(content, digest)
+            self._render_from(index)
+            self._full = None
+            return self._segments[scene_number].markdown
+
+    def copy(self) -> "ScriptBuffer":
+        """A separate buffer with the same scenes, e.g. to write drafts into without touching this one."""
+        with self._lock:
+            contents = [(number, self._segments[number].content) for number in self._numbers]
+        buffer = ScriptBuffer(self._render)
+        for number, content in contents:
+            buffer.set(number, content)
+        return buffer
+
+    def _render_from(self, index: int):
+        previous_act = self._segments[self._numbers[index - 1]].act if index > 0 else None
+        for position in range(index, len(self._numbers)):
+            segment = self._segments[self._numbers[position]]
+            if position > index and segment.previous_act == previous_act:
+                break  # The act header of the remaining scenes is unaffected
+            segment.markdown, segment.act = self._render(segment.content, previous_act)
+            segment.previous_act = previous_act
+            previous_act = segment.act
+
+    def get(self, scene_number: str) -> Optional[str]:
+        with self._lock:
+            segment = self._segments.get(scene_number)
+            return segment.markdown if segment is not None else None
+
+    def segment(self, scene_number: str) -> Optional[Tuple[str, str]]:
+        """The content digest and markdown of a scene."""
+        with self._lock:
+            segment = self._segments.get(scene_number)
+            return (segment.digest, segment.markdown) if segment is not None else None
+
+    def segments(self, before: str = None) -> List[Tuple[str, str, str]]:
+        """Scene number, content digest and markdown of each scene before scene `before`, in order."""
+        with self._lock:
+            return [(number, self._segments[number].digest, self._segments[number].markdown)
+                    for number in self._numbers[:self._end(before)]]
+
+    def numbers(self, before: str = None) -> List[str]:
+        """The scene numbers before scene `before`, in order."""
+        with self._lock:
+            return self._numbers[:self._end(before)]
+
+    def __contains__(self, scene_number: str) -> bool:
+        return scene_number in self._segments
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def _end(self, before: Optional[str]) -> int:
+        return len(self._numbers) if before is None else bisect_left(self._keys, scene_number_key(before))
+
+    def text(self, before: str = None) -> str:
+        """The script up to (excluding) scene `before`, or the full script."""
+        with self._lock:
+            if before is None and self._full is not None:
+                return self._full
+            text = "".join("\n" + self._segments[number].markdown for number in self._numbers[:self._end(before)])
+            if before is None:
+                self._full = text
+            return text
+
+    def tail(self, length: float, before: str = None) -> str:
+        """The last `length` characters of the script before scene `before`, without joining all of it."""
+        with self._lock:
+            parts = []
+            size = 0
+            for number in reversed(self._numbers[:self._end(before)]):
+                parts.append("\n" + self._segments[number].markdown)
+                size += len(parts[-1])
+                if size >= length:
+                    break
+            text = "".join(reversed(parts))
+            return text[-int(length):] if len(text) > length else text
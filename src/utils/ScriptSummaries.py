@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import groupby
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prompts.scene import SUMMARIZE_SCENE, SUMMARIZE_SECTION
+from src.llm.LLMService import LLMService
+from src.llm.PromptBudget import CHARS_PER_TOKEN
+from src.utils.ScriptBuffer import ScriptBuffer
+from src.utils.file_handlers import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+
+def _units(scene_number: str) -> Tuple[str, str]:
+    # The act and the scene a sub-scene belongs to, e.g. ("1", "1.2") for "1.2.3"
+    parts = scene_number.split('.')
+    return parts[0], ".".join(parts[:2])
+
+
+def _done(result: Optional[str]) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class ScriptSummaries:
+    """
+    Hierarchical summaries of the script: one per sub-scene, rolled up per scene and per act once they
+    are complete. Prompts get the most recent text verbatim and summaries of everything before it, so
+    their size stays nearly constant as the script grows. Summaries are cached on disk by the hash of
+    what they summarize: a refined sub-scene (and so its scene and act) is summarized again, everything
+    else is reused across runs.
+    """
+
+    def __init__(self, llm_service: LLMService, genre: str = "unknown", recent_tokens: int = 1500,
+                 sub_scene_words: int = 80, section_words: int = 150, max_workers: int = 2, path: str = None):
+        self.llm_service = llm_service
+        self.genre = genre
+        self.recent_tokens = recent_tokens
+        self.sub_scene_words = sub_scene_words
+        self.section_words = section_words
+        self.path = path
+        self._summaries: Dict[str, str] = load_json(path) if path and os.path.exists(path) else {}
+        self._pending: Dict[str, Future] = {}
+        # Which summary currently stands for a sub-scene, scene or act, to drop the superseded one
+        self._current: Dict[str, str] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summaries")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], llm_service: LLMService) -> Optional["ScriptSummaries"]:
+        settings = config.get('script_summaries', {})
+        if not settings.get('enabled', False):
+            return None
+        return cls(llm_service,
+                   genre=config.get('genre', 'unknown'),
+                   recent_tokens=settings.get('recent_tokens', 1500),
+                   sub_scene_words=settings.get('sub_scene_words', 80),
+                   section_words=settings.get('section_words', 150),
+                   max_workers=settings.get('max_workers', 2),
+                   path=settings.get('path', 'output/cache/script_summaries.json'))
+
+    def add_scene(self, script: ScriptBuffer, scene_number: str):
+        """Starts summarizing a finished sub-scene in the background, before a prompt needs it."""
+        segment = script.segment(scene_number)
+        if segment is not None:
+            self._sub_scene(scene_number, *segment)
+
+    def context(self, script: ScriptBuffer, before: str) -> Tuple[str, str]:
+        """
+        Returns the summaries of the script before scene `before` that are not part of the recent text,
+        and the recent text itself (at least `recent_tokens` tokens of the latest sub-scenes, verbatim).
+        """
+        segments = script.segments(before)
+        start = len(segments)
+        size = 0
+        while start > 0 and size < self.recent_tokens * CHARS_PER_TOKEN:
+            start -= 1
+            size += len(segments[start][2]) + 1
+        recent = "".join("\n" + markdown for _, _, markdown in segments[start:])
+        earlier = segments[:start]
+        if not earlier:
+            return "", recent
+
+        leaves = {number: self._sub_scene(number, digest, markdown) for number, digest, markdown in earlier}
+        # Scenes and acts are rolled up once none of their text is recent or still to be written
+        open_units = set(_units(before)).union(*(_units(number) for number, _, _ in segments[start:]))
+
+        entries: List[Tuple[str, Future]] = []
+        for act, act_segments in groupby(earlier, key=lambda segment: _units(segment[0])[0]):
+            scenes = [(scene, [(f"Scene {number}", leaves[number]) for number, _, _ in scene_segments])
+                      for scene, scene_segments in groupby(act_segments, key=lambda segment: _units(segment[0])[1])]
+            if act not in open_units:
+                entries.append((f"Act {act}", self._roll_up(f"act {act}", [
+                    (f"Scene {scene}", self._roll_up(f"scene {scene}", children)) for scene, children in scenes])))
+                continue
+            for scene, children in scenes:
+                if scene not in open_units:
+                    entries.append((f"Scene {scene}", self._roll_up(f"scene {scene}", children)))
+                else:
+                    entries.extend(children)
+
+        lines = [f"{label}: {summary}" for label, summary in
+                 ((label, self._result(label, future)) for label, future in entries) if summary]
+        if not lines:
+            return "", recent
+        story = "\n".join(lines)
+        return f"\nStory So Far (summaries of the script before the script context):\n{story}\n", recent
+
+    def _sub_scene(self, scene_number: str, digest: str, markdown: str) -> Future:
+        return self._submit(f"sub_scene {scene_number}", f"sub_scene:{digest}",
+                            lambda: SUMMARIZE_SCENE.format(scene_content=markdown, genre=self.genre,
+                                                           length=self.sub_scene_words),
+                            "SUMMARIZE_SCENE")
+
+    def _roll_up(self, section: str, children: List[Tuple[str, Future]]) -> Future:
+        summaries = [(label, self._result(label, future)) for label, future in children]
+        text = "\n".join(f"{label}: {summary}" for label, summary in summaries if summary)
+        if any(summary is None for _, summary in summaries):
+            # Not rolled up (nor cached) while parts are missing; the parts are used as they are
+            return _done(text or None)
+        key = "section:" + hashlib.sha256(f"{section}\n{text}".encode("utf-8")).hexdigest()
+        return self._submit(section, key,
+                            lambda: SUMMARIZE_SECTION.format(section=section, summaries=text, genre=self.genre,
+                                                             length=self.section_words),
+                            "SUMMARIZE_SECTION")
+
+    def _submit(self, slot: str, key: str, prompt: Callable[[], str], prompt_type: str) -> Future:
+        with self._lock:
+            previous = self._current.get(slot)
+            if previous is not None and previous != key and previous not in self._pending:
+                self._summaries.pop(previous, None)  # Superseded, e.g. by a refined scene
+            self._current[slot] = key
+            if key in self._summaries:
+                return _done(self._summaries[key])
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._summarize, key, prompt(), prompt_type)
+                self._pending[key] = future
+            return future
+
+    def _summarize(self, key: str, prompt: str, prompt_type: str) -> str:
+        try:
+            summary = self.llm_service.generate(prompt, prompt_type=prompt_type)
+            summary = (summary if isinstance(summary, str) else str(summary)).strip()
+            with self._lock:
+                self._summaries[key] = summary
+                if self.path:
+                    save_json(self.path, self._summaries)
+            return summary
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    @staticmethod
+    def _result(label: str, future: Future) -> Optional[str]:
+        try:
+            return future.result()
+        except Exception as e:
+            logger.warning(f"Could not summarize {label}: {str(e)}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"summaries": len(self._summaries), "pending": len(self._pending)}
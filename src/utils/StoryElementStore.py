@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from prompts.scene import EXTRACT_STORY_ELEMENTS
+from src.llm.LLMService import LLMService
+from src.utils.JSONValidator import JSONValidator
+from src.utils.file_handlers import load_json, save_json
+from src.utils.sort_and_compare import scene_number_key
+
+logger = logging.getLogger(__name__)
+
+
+def _scope_key(scope: str, scene_number: str) -> Tuple[str, str]:
+    # "global" elements apply to the whole story, "act" ones to the rest of their act, "scene" ones to the
+    # remaining sub-scenes of their scene
+    parts = scene_number.split('.')
+    if scope == "act":
+        return scope, parts[0]
+    if scope == "scene":
+        return scope, ".".join(parts[:2])
+    return "global", ""
+
+
+class StoryElementStore:
+    """
+    Characters, locations, objects and events extracted from each accepted sub-scene, indexed by scope.
+    Extraction runs in the background, off the scene generation path; a prompt gets the elements in
+    scope for its sub-scene that are known by then. Extractions are stored on disk per sub-scene with
+    the hash of its text, so a refined sub-scene is extracted again and unchanged ones are reused.
+    """
+
+    def __init__(self, llm_service: LLMService, max_workers: int = 1, max_elements: int = 60, path: str = None):
+        self.llm_service = llm_service
+        self.max_elements = max_elements
+        self.path = path
+        self._records: Dict[str, Dict[str, Any]] = load_json(path) if path and os.path.exists(path) else {}
+        self._index: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None
+        self._pending: Dict[str, str] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="story-elements")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], llm_service: LLMService) -> Optional["StoryElementStore"]:
+        settings = config.get('story_elements', {})
+        if not settings.get('enabled', False):
+            return None
+        return cls(llm_service,
+                   max_workers=settings.get('max_workers', 1),
+                   max_elements=settings.get('max_elements', 60),
+                   path=settings.get('path', 'output/cache/story_elements.json'))
+
+    def add_scene(self, scene_number: str, markdown: str, outline: str):
+        """Queues the extraction of an accepted sub-scene, unless its text was already extracted."""
+        digest = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+        with self._lock:
+            record = self._records.get(scene_number)
+            if (record is not None and record['digest'] == digest) or self._pending.get(scene_number) == digest:
+                return
+            self._pending[scene_number] = digest
+        self._executor.submit(self._extract, scene_number, digest, markdown, outline)
+
+    def _extract(self, scene_number: str, digest: str, markdown: str, outline: str):
+        prompt = EXTRACT_STORY_ELEMENTS.format(outline=outline, scene_content=markdown, scene_number=scene_number)
+        try:
+            response = self.llm_service.generate(prompt, format="json", prompt_type="EXTRACT_STORY_ELEMENTS")
+            elements = JSONValidator.validate_story_elements(response)
+        except Exception as e:
+            logger.warning(f"Could not extract story elements of scene {scene_number}: {str(e)}")
+            elements = None
+
+        with self._lock:
+            if self._pending.get(scene_number) != digest:
+                return  # Superseded by a newer version of the scene
+            del self._pending[scene_number]
+            if elements is None:
+                return
+            self._records[scene_number] = {'digest': digest, 'elements': [
+                {'type': element['type'], 'content': element['content'].strip(), 'scope': element['scope']}
+                for element in elements]}
+            self._index = None
+            if self.path:
+                save_json(self.path, self._records)
+
+    def _build_index(self) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        index = defaultdict(list)
+        for scene_number in sorted(self._records, key=scene_number_key):
+            for element in self._records[scene_number]['elements']:
+                index[_scope_key(element['scope'], scene_number)].append({**element, 'scene_number': scene_number})
+        return index
+
+    def in_scope(self, scene_number: str) -> List[Dict[str, Any]]:
+        """The elements from sub-scenes before `scene_number` that apply to it, most specific first."""
+        key = scene_number_key(scene_number)
+        with self._lock:
+            if self._index is None:
+                self._index = self._build_index()
+            candidates = [element for scope in ("scene", "act", "global")
+                          for element in self._index.get(_scope_key(scope, scene_number), [])]
+
+        elements = []
+        seen = set()
+        for element in candidates:
+            identity = (element['type'], element['content'].lower())
+            if scene_number_key(element['scene_number']) >= key or identity in seen:
+                continue
+            seen.add(identity)
+            elements.append(element)
+        return elements[:self.max_elements]
+
+    def context(self, scene_number: str) -> str:
+        elements = self.in_scope(scene_number)
+        if not elements:
+            return ""
+        lines = "\n".join(f"- [{element['type']}, scene {element['scene_number']}] {element['content']}"
+                          for element in elements)
+        return f"\nEstablished Story Elements (continuity facts from earlier scenes):\n{lines}\n"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"scenes": len(self._records), "pending": len(self._pending),
+                    "elements": sum(len(record['elements']) for record in self._records.values())}
@@ -0,0 +1,151 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from src.utils.JSONValidator import JSONValidator
+
+WHITESPACE = " \t\r\n"
+
+
+class SceneStreamError(ValueError):
+    pass
+
+
+class _Container:
+    __slots__ = ("kind", "expect_key", "key", "start")
+
+    def __init__(self, kind: str, start: int):
+        self.kind = kind
+        self.expect_key = kind == "{"
+        self.key = None
+        self.start = start
+
+
+class StreamingSceneParser:
+    """
+    Incremental parser for scene JSON as it is streamed from the LLM.
+
+    Tracks the JSON structure character by character and validates every item of the
+    'content' list as soon as it is complete, raising SceneStreamError the moment the
+    scene is clearly invalid so the request can be cancelled early.
+    """
+
+    def __init__(self, max_preamble: int = 200):
+        self.max_preamble = max_preamble
+        self.items_validated = 0
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._root_start = None
+        self._root_end = None
+        self._stack: List[_Container] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._awaiting_value = False
+
+    def _in_content_list(self) -> bool:
+        return len(self._stack) == 2 and self._stack[0].key == "content" and self._stack[1].kind == "["
+
+    def feed(self, chunk: str):
+        if self.done or not chunk:
+            return
+        self._text += chunk
+        text = self._text
+
+        while self._pos < len(text) and not self.done:
+            char = text[self._pos]
+
+            if self._root_start is None:
+                if char == "{":
+                    self._root_start = self._pos
+                    self._stack.append(_Container("{", self._pos))
+                elif self._pos >= self.max_preamble:
+                    raise SceneStreamError("Response does not start with a JSON object")
+                self._pos += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._on_string(self._loads(text[self._string_start:self._pos + 1]))
+                self._pos += 1
+                continue
+
+            if char in WHITESPACE:
+                self._pos += 1
+                continue
+
+            if self._awaiting_value:
+                self._awaiting_value = False
+                if len(self._stack) == 1 and self._stack[0].key == "content" and char != "[":
+                    raise SceneStreamError("'content' must be a list")
+
+            if self._in_content_list() and char not in "{,]":
+                raise SceneStreamError("Each item in 'content' must be a dictionary")
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif char in "{[":
+                self._stack.append(_Container(char, self._pos))
+            elif char in "}]":
+                self._close(char)
+            elif char == ":":
+                self._stack[-1].expect_key = False
+                self._awaiting_value = True
+            elif char == ",":
+                if self._stack[-1].kind == "{":
+                    self._stack[-1].expect_key = True
+                    self._stack[-1].key = None
+            self._pos += 1
+
+    def _on_string(self, value: str):
+        container = self._stack[-1]
+        if container.kind == "{" and container.expect_key:
+            container.key = value
+        elif (len(self._stack) == 3 and self._stack[0].key == "content" and self._stack[1].kind == "["
+              and container.key == "type"):
+            # Unknown content types are rejected before the rest of the item arrives
+            self._validate(JSONValidator.validate_content_type, value)
+
+    def _close(self, char: str):
+        container = self._stack.pop()
+        if (char == "}") != (container.kind == "{"):
+            raise SceneStreamError(f"Unbalanced '{char}' in scene JSON")
+
+        if char == "}" and self._in_content_list():
+            item = self._loads(self._text[container.start:self._pos + 1])
+            self._validate(JSONValidator.validate_content_item, item)
+            self.items_validated += 1
+        elif not self._stack:
+            self._root_end = self._pos + 1
+            self.done = True
+
+    @staticmethod
+    def _loads(text: str) -> Any:
+        # Malformed JSON (e.g. a raw newline in a string) fails the scene like any other invalid structure
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            raise SceneStreamError(f"Invalid JSON: {e}") from e
+
+    @staticmethod
+    def _validate(validator, value: Any):
+        try:
+            validator(value)
+        except (KeyError, TypeError, ValueError) as e:
+            raise SceneStreamError(str(e.args[0] if e.args else e)) from e
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        if not self.done:
+            return None
+        try:
+            scene_json = json.loads(self._text[self._root_start:self._root_end])
+        except json.JSONDecodeError as e:
+            print(f"Invalid JSON: {e}")
+            return None
+        return JSONValidator.validate_scene_json(scene_json)
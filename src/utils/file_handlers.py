@@ -21,6 +21,15 @@ def save_json(file_path: str, data: Union[dict, list]):
         json.dump(data, f, indent=2)
     logging.info(f"Saved JSON to {file_path}")
 
+def save_json_atomic(file_path: str, data: Union[dict, list]):
+    """Like save_json, but readers (or a crash) never see a half-written file: write-then-rename."""
+    if os.path.dirname(file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, file_path)
+
 def load_txt(file_path: str) -> str:
     try:
         with open(file_path, 'r') as f:
@@ -1,35 +1,19 @@
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+
+from src.utils.OutlineModel import Outline, scene_key
 
 
 def compare_scene_numbers(scene_num1: str, scene_num2: str) -> int:
-    # Convert scene numbers to lists of integers
-    num1 = list(map(int, scene_num1.split('.')))
-    num2 = list(map(int, scene_num2.split('.')))
+    # Compare the parsed scene numbers (trailing zeros are ignored, so "1.2" == "1.2.0")
+    key1, key2 = scene_key(scene_num1), scene_key(scene_num2)
+    return (key1 > key2) - (key1 < key2)
 
-    # Pad the shorter list with zeros
-    max_length = max(len(num1), len(num2))
-    num1 += [0] * (max_length - len(num1))
-    num2 += [0] * (max_length - len(num2))
 
-    # Compare the lists
-    if num1 < num2:
-        return -1
-    elif num1 > num2:
-        return 1
-    else:
-        return 0
+def scene_number_key(scene_number: str) -> Tuple[int, ...]:
+    # Sort key that orders like compare_scene_numbers
+    return scene_key(scene_number)
 
 
 def sort_json_content(json_data: Dict[str, Any]) -> Dict[str, Any]:
-    # Sort acts
-    json_data['acts'] = sorted(json_data['acts'], key=lambda x: x['act_number'])
-
-    # Sort scenes and sub-scenes within each act
-    for act in json_data['acts']:
-        act['scenes'] = sorted(act['scenes'], key=lambda x: float(x['scene_number']))
-
-        for scene in act['scenes']:
-            if 'sub_scenes' in scene:
-                scene['sub_scenes'] = sorted(scene['sub_scenes'], key=lambda x: x['sub_scene_number'])
-
-    return json_data
+    # Sort acts, scenes and sub-scenes by their parsed numbers ("1.10" comes after "1.9")
+    return Outline.from_dict(json_data).sort().to_dict()
@@ -0,0 +1,86 @@
+import pytest
+
+from src.llm import LLMRouter as llm_router_module
+from src.llm.LLMRouter import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(llm_router_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_opens_at_the_failure_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_lets_one_trial_through_after_the_cooldown(breaker, clock):
+    clock[0] += 9
+    assert not breaker.allow()
+
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes(breaker, clock):
+    clock[0] += 10
+    breaker.allow()
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_for_another_cooldown(breaker, clock):
+    clock[0] += 10
+    breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock[0] += 9
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_abandoned_trial_lets_the_next_request_try(breaker, clock):
+    clock[0] += 10
+    breaker.allow()
+    breaker.record_abandoned()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_abandoned_request_leaves_a_closed_circuit_closed(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+    breaker.record_abandoned()
+    assert breaker.state == CircuitBreaker.CLOSED
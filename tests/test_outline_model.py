@@ -0,0 +1,51 @@
+from src.script_automator import merge_outlines
+from src.utils.OutlineModel import Outline
+
+
+def _act(number, *scenes, **fields):
+    return {"act_number": number, **fields, "scenes": list(scenes)}
+
+
+def _scene(number, *sub_scenes, **fields):
+    return {"scene_number": number, **fields, "sub_scenes": [{"sub_scene_number": sub_scene, "title": title}
+                                                            for sub_scene, title in sub_scenes]}
+
+
+ORIGINAL = {"title": "Old", "concept": "c", "acts": [
+    _act(1, _scene("1.1", ("1.1.1", "a"), ("1.1.2", "b")), _scene("1.2"), title="One"),
+    _act(2, _scene("2.1"), title="Two"),
+]}
+
+
+def test_merge_replaces_nodes_with_the_same_number_and_keeps_the_rest():
+    new = {"title": "New", "acts": [
+        _act(1, _scene("1.1", ("1.1.2", "B"), ("1.1.3", "c")), title="One revised"),
+        _act(3, _scene("3.1"), title="Three"),
+    ]}
+    merged = Outline.from_dict(ORIGINAL).merge(Outline.from_dict(new)).sort().to_dict()
+
+    assert merged["title"] == "New"
+    assert merged["concept"] == "c"
+    assert [act["title"] for act in merged["acts"]] == ["One revised", "Two", "Three"]
+    act = merged["acts"][0]
+    assert [scene["scene_number"] for scene in act["scenes"]] == ["1.1", "1.2"]
+    assert act["scenes"][0]["sub_scenes"] == [{"sub_scene_number": "1.1.1", "title": "a"},
+                                              {"sub_scene_number": "1.1.2", "title": "B"},
+                                              {"sub_scene_number": "1.1.3", "title": "c"}]
+
+
+def test_merge_outlines_sorts_numerically():
+    original = {"title": "T", "acts": [_act(2), _act(10)]}
+    new = {"acts": [_act(1, _scene("1.10"), _scene("1.9"))]}
+    merged = merge_outlines(original, new)
+
+    assert merged["title"] == "T"
+    assert [act["act_number"] for act in merged["acts"]] == [1, 2, 10]
+    assert [scene["scene_number"] for scene in merged["acts"][0]["scenes"]] == ["1.9", "1.10"]
+
+
+def test_merge_does_not_change_either_outline():
+    original = Outline.from_dict(ORIGINAL)
+    new = Outline.from_dict({"acts": [_act(1, title="Changed")]})
+    original.merge(new)
+    assert original.to_dict() == ORIGINAL
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from src.llm import RequestScheduler as request_scheduler_module
+from src.llm.RequestScheduler import RequestScheduler, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(request_scheduler_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_waiters_are_admitted_in_priority_order():
+    scheduler = RequestScheduler("test", max_concurrency=1)
+    scheduler.acquire()
+    admitted = []
+
+    def request(priority):
+        scheduler.acquire(priority)
+        admitted.append(priority)
+        scheduler.release()
+
+    threads = []
+    for priority in (5, 0, 2):
+        thread = threading.Thread(target=request, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: scheduler.stats()["queue_depth"] == len(threads))
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == [0, 2, 5]
+    assert scheduler.stats()["admitted"] == 4
+
+
+def test_equal_priorities_are_first_come_first_served():
+    scheduler = RequestScheduler("test", max_concurrency=1)
+    scheduler.acquire()
+    admitted = []
+
+    def request(name):
+        scheduler.acquire(1)
+        admitted.append(name)
+        scheduler.release()
+
+    threads = []
+    for name in ("first", "second", "third"):
+        thread = threading.Thread(target=request, args=(name,))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: scheduler.stats()["queue_depth"] == len(threads))
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == ["first", "second", "third"]
+
+
+def test_try_acquire_does_not_jump_the_queue():
+    scheduler = RequestScheduler("test", max_concurrency=1)
+    scheduler.acquire()
+    assert not scheduler.try_acquire()
+
+    waiter = threading.Thread(target=scheduler.acquire, args=(2,))
+    waiter.start()
+    _wait_for(lambda: scheduler.stats()["queue_depth"] == 1)
+    scheduler.release()
+    waiter.join(5)
+    scheduler.release()
+
+    assert scheduler.try_acquire(priority=0)
+    assert scheduler.stats()["active"] == 1
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(60)
+    assert bucket.time_until(60) == 0
+    bucket.consume(60)
+    assert bucket.time_until(30) == pytest.approx(30)
+
+    clock[0] += 30
+    assert bucket.time_until(30) == 0
+    assert bucket.time_until(31) == pytest.approx(1)
+
+
+def test_token_bucket_caps_requests_larger_than_capacity(clock):
+    bucket = TokenBucket(60, capacity=10)
+    assert bucket.time_until(100) == 0
+    bucket.consume(100)
+    assert bucket.tokens == 0
+    assert bucket.time_until(100) == pytest.approx(10)
+
+
+def test_token_rate_limit(clock):
+    scheduler = RequestScheduler("test", tokens_per_minute=100)
+    assert scheduler.try_acquire(tokens=80)
+    scheduler.release()
+    assert not scheduler.try_acquire(tokens=80)
+
+    clock[0] += 40
+    assert scheduler.try_acquire(tokens=80)
+
+
+def test_request_rate_limit(clock):
+    scheduler = RequestScheduler("test", requests_per_minute=2)
+    assert scheduler.try_acquire()
+    assert scheduler.try_acquire()
+    assert not scheduler.try_acquire()
+
+    clock[0] += 31
+    assert scheduler.try_acquire()
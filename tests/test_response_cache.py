@@ -0,0 +1,97 @@
+import pytest
+
+from src.llm import ResponseCache as response_cache_module
+from src.llm.ResponseCache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Distinct access times, so the least recently used entry is well defined
+    now = [1000.0]
+
+    def time():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(response_cache_module.time, "time", time)
+
+
+def test_make_key_depends_on_every_part():
+    key = ResponseCache.make_key("openai", "gpt-4o", "prompt", "json", {"temperature": 0})
+    assert key == ResponseCache.make_key("openai", "gpt-4o", "prompt", "json", {"temperature": 0})
+    assert key != ResponseCache.make_key("ollama", "gpt-4o", "prompt", "json", {"temperature": 0})
+    assert key != ResponseCache.make_key("openai", "gpt-4o", "prompt", "json", {"temperature": 1})
+
+
+def test_hit_and_miss(cache):
+    assert cache.get("key") is None
+    cache.set("key", {"scene_number": "1.1.1"})
+
+    assert cache.get("key") == {"scene_number": "1.1.1"}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_none_is_not_cached(cache):
+    cache.set("key", None)
+    assert cache.stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used_entry(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.get("a")
+    cache.set("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    cache.close()
+
+
+def test_evicts_down_to_max_bytes(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=10)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "bbbb"
+    cache.close()
+
+
+def test_expired_entry_is_a_miss(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_age_seconds=1.5)
+    cache.set("key", "value")
+    cache.get("other")
+
+    assert cache.get("key") is None
+    cache.close()
+
+
+def test_invalidate(cache):
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert cache.get("b") == "B"
+
+    cache.clear()
+    assert cache.get("b") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_bypass_by_prompt_type(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), bypass=["EVALUATE_SCENE"])
+    assert cache.should_bypass("EVALUATE_SCENE")
+    assert not cache.should_bypass("GENERATE_SCENE")
+    assert not cache.should_bypass()
+    assert cache.stats()["bypassed"] == 1
+    cache.close()
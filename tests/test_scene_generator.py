@@ -0,0 +1,37 @@
+from src.scene_generator import _merge_evaluations
+
+
+def _evaluation(score, plot, feedback, scenes=()):
+    return {"criteria": {"plot": {"score": plot, "justification": f"plot {plot}"}},
+            "scenes_to_improve": list(scenes), "total_score": score, "feedback": feedback}
+
+
+def test_merge_evaluations_weights_scores_by_act_length():
+    merged = _merge_evaluations([
+        ("1", 3, _evaluation(80, 6, "good", [{"scene_id": "1.1.1", "suggestions": "a"}])),
+        ("2", 1, _evaluation(40, 10, "weak", [{"scene_id": "2.1.1", "suggestions": "b"}])),
+    ])
+
+    assert merged == {
+        "criteria": {"plot": {"score": 7, "justification": "Act 1: plot 6\nAct 2: plot 10"}},
+        "scenes_to_improve": [{"scene_id": "1.1.1", "suggestions": "a"}, {"scene_id": "2.1.1", "suggestions": "b"}],
+        "total_score": 70,
+        "feedback": "Act 1: good\n\nAct 2: weak",
+    }
+
+
+def test_merge_evaluations_skips_malformed_parts():
+    merged = _merge_evaluations([
+        ("1", 1, {"criteria": {"plot": "n/a", "pacing": {"score": 8}}, "scenes_to_improve": ["1.1.1"],
+                  "total_score": 50}),
+        ("2", 1, {"criteria": None, "scenes_to_improve": None}),
+    ])
+
+    assert merged["criteria"] == {"pacing": {"score": 8, "justification": "Act 1:"}}
+    assert merged["scenes_to_improve"] == []
+    assert merged["total_score"] == 25
+    assert merged["feedback"] == "Act 1: \n\nAct 2: "
+
+
+def test_merge_evaluations_of_nothing():
+    assert _merge_evaluations([]) == {"criteria": {}, "scenes_to_improve": [], "total_score": 0, "feedback": ""}
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from src.utils.OutlineIndex import OutlineIndex
+from src.utils.SceneJournal import SceneJournal
+
+OUTLINE = {"title": "T", "acts": [{"act_number": 1, "scenes": [{"scene_number": "1.1", "sub_scenes": [
+    {"sub_scene_number": "1.1.1", "description": "first"},
+    {"sub_scene_number": "1.1.2", "description": "second"},
+    {"sub_scene_number": "1.1.3", "description": "third"}]}]}]}
+
+
+def _scene(number, text="text"):
+    return {"scene_number": number, "location": "L", "time": "T", "content": [{"type": "action", "text": text}]}
+
+
+@pytest.fixture
+def outline():
+    return OutlineIndex(OUTLINE)
+
+
+@pytest.fixture
+def sub_scenes(outline):
+    return {sub_scene['sub_scene_number']: sub_scene for sub_scene in outline.sub_scenes()}
+
+
+def test_replay_skips_a_torn_last_line(tmp_path, outline, sub_scenes):
+    path = str(tmp_path / "journal.jsonl")
+    journal = SceneJournal(path)
+    journal.draft(sub_scenes["1.1.1"], _scene("1.1.1", "draft"))
+    journal.accepted(sub_scenes["1.1.1"], _scene("1.1.1"))
+    journal.draft(sub_scenes["1.1.2"], _scene("1.1.2", "draft"))
+    journal.evaluation(sub_scenes["1.1.2"], 0, {"total_score": 70}, 70)
+    journal._file.close()
+    with open(path, "a") as f:
+        f.write(json.dumps({"event": "accepted", "scene_number": "1.1.2"})[:30])
+
+    accepted, progress = SceneJournal(path).replay(outline)
+
+    assert accepted == [_scene("1.1.1")]
+    assert list(progress) == ["1.1.2"]
+    assert progress["1.1.2"].evaluation == {"total_score": 70}
+    assert progress["1.1.2"].best_scene == _scene("1.1.2", "draft")
+    assert progress["1.1.2"].best_score == 70
+
+
+def test_appending_after_a_torn_line_starts_a_new_line(tmp_path, outline, sub_scenes):
+    path = str(tmp_path / "journal.jsonl")
+    journal = SceneJournal(path)
+    journal.accepted(sub_scenes["1.1.1"], _scene("1.1.1"))
+    journal._file.close()
+    with open(path, "a") as f:
+        f.write('{"event": "acc')
+
+    SceneJournal(path).accepted(sub_scenes["1.1.2"], _scene("1.1.2"))
+    accepted, progress = SceneJournal(path).replay(outline)
+
+    assert accepted == [_scene("1.1.1"), _scene("1.1.2")]
+    assert progress == {}
+
+
+def test_replay_follows_refinements(tmp_path, outline, sub_scenes):
+    path = str(tmp_path / "journal.jsonl")
+    journal = SceneJournal(path)
+    journal.draft(sub_scenes["1.1.3"], _scene("1.1.3", "draft"))
+    journal.evaluation(sub_scenes["1.1.3"], 0, {"total_score": 60}, 60)
+    journal.refinement(sub_scenes["1.1.3"], 0, _scene("1.1.3", "refined"))
+
+    _, progress = SceneJournal(path).replay(outline)
+
+    state = progress["1.1.3"]
+    assert state.content == _scene("1.1.3", "refined")
+    assert state.evaluation is None
+    assert state.attempt == 1
+    assert state.best_scene == _scene("1.1.3", "draft")
+
+
+def test_replay_ignores_scenes_whose_outline_changed(tmp_path, sub_scenes):
+    path = str(tmp_path / "journal.jsonl")
+    SceneJournal(path).accepted(sub_scenes["1.1.1"], _scene("1.1.1"))
+
+    changed = json.loads(json.dumps(OUTLINE))
+    changed["acts"][0]["scenes"][0]["sub_scenes"][0]["description"] = "rewritten"
+    assert SceneJournal(path).replay(OutlineIndex(changed)) == ([], {})
+
+
+def test_replay_without_a_journal(tmp_path, outline):
+    assert SceneJournal(str(tmp_path / "missing.jsonl")).replay(outline) == ([], {})
@@ -0,0 +1,59 @@
+from src.utils.ScriptBuffer import ScriptBuffer
+
+
+def _render(content, previous_act):
+    return f"## {content['scene_number']}\n{content['text']}\n", int(content['scene_number'].split('.')[0])
+
+
+def _buffer(*numbers):
+    buffer = ScriptBuffer(_render)
+    for number in numbers:
+        buffer.set(number, {"scene_number": number, "text": f"text of {number}"})
+    return buffer
+
+
+def test_tail_before_a_scene_excludes_it_and_the_ones_after():
+    buffer = _buffer("1.1.1", "1.1.2", "1.2.1", "2.1.1")
+    tail = buffer.tail(10 ** 9, before="1.2.1")
+
+    assert tail == buffer.text(before="1.2.1")
+    assert "## 1.1.2" in tail
+    assert "## 1.2.1" not in tail
+    assert "## 2.1.1" not in tail
+
+
+def test_tail_is_the_end_of_the_text():
+    buffer = _buffer("1.1.1", "1.1.2", "1.1.3")
+    text = buffer.text(before="1.1.3")
+    for length in (1, 5, len(text) - 1, len(text), len(text) + 10):
+        assert buffer.tail(length, before="1.1.3") == text[-length:]
+
+
+def test_tail_orders_scene_numbers_numerically():
+    buffer = _buffer("1.1.10", "1.1.2", "1.1.1")
+    tail = buffer.tail(10 ** 9, before="1.1.10")
+
+    assert "## 1.1.10" not in tail
+    assert tail.index("## 1.1.1\n") < tail.index("## 1.1.2")
+
+
+def test_tail_before_a_scene_not_in_the_buffer():
+    buffer = _buffer("1.1.1", "1.1.3")
+    assert buffer.tail(10 ** 9, before="1.1.2") == buffer.text(before="1.1.2") == buffer.text(before="1.1.3")
+    assert buffer.tail(10 ** 9, before="1.1.1") == ""
+
+
+def test_tail_follows_replaced_scenes():
+    buffer = _buffer("1.1.1", "1.1.2")
+    buffer.set("1.1.1", {"scene_number": "1.1.1", "text": "rewritten"})
+    assert buffer.tail(10 ** 9, before="1.1.2") == "\n## 1.1.1\nrewritten\n"
+
+
+def test_copy_is_independent():
+    buffer = _buffer("1.1.1")
+    copy = buffer.copy()
+    copy.set("1.1.2", {"scene_number": "1.1.2", "text": "draft"})
+
+    assert "1.1.2" not in buffer
+    assert buffer.tail(10 ** 9) == "\n## 1.1.1\ntext of 1.1.1\n"
+    assert copy.numbers() == ["1.1.1", "1.1.2"]
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from src.utils.StreamingSceneParser import SceneStreamError, StreamingSceneParser
+
+SCENE = {
+    "scene_number": "1.2.3",
+    "location": "INT. KITCHEN {NIGHT}",
+    "time": "NIGHT",
+    "content": [
+        {"type": "action", "text": "Rain against the window, \"hard\"."},
+        {"type": "dialog", "character": "ANNA", "text": "Close it. [beat] Please: now}"},
+        {"type": "transition", "text": "CUT TO:"},
+    ],
+}
+RESPONSE = "Here is the scene:\n```json\n" + json.dumps(SCENE, indent=2) + "\n```\nLet me know!"
+
+
+def _parse(chunks):
+    parser = StreamingSceneParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser
+
+
+def _chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(RESPONSE)])
+def test_result_does_not_depend_on_chunk_boundaries(size):
+    parser = _parse(_chunked(RESPONSE, size))
+    assert parser.done
+    assert parser.items_validated == 3
+    assert parser.result() == SCENE
+
+
+def test_split_inside_escapes_and_keys():
+    text = json.dumps(SCENE)
+    key = text.index('"content"') + 4
+    escape = text.index('\\"')
+    parser = _parse([text[:key], text[key:escape + 1], text[escape + 1:]])
+    assert parser.result() == SCENE
+
+
+def test_incomplete_scene_has_no_result():
+    text = json.dumps(SCENE)
+    parser = _parse([text[:-1]])
+    assert not parser.done
+    assert parser.result() is None
+    assert parser.items_validated == 3
+
+
+def test_text_after_the_scene_is_ignored():
+    parser = _parse([json.dumps(SCENE), "{not json"])
+    assert parser.result() == SCENE
+
+
+def test_rejects_an_unknown_content_type_before_the_item_is_complete():
+    parser = StreamingSceneParser()
+    with pytest.raises(SceneStreamError):
+        for chunk in _chunked('{"scene_number": "1", "content": [{"type": "montage", "text": "', 5):
+            parser.feed(chunk)
+
+
+def test_rejects_an_invalid_item_as_soon_as_it_closes():
+    parser = StreamingSceneParser()
+    parser.feed('{"scene_number": "1", "content": [{"type": "action", "text": "a"}, {"type": "dialog", "te')
+    assert parser.items_validated == 1
+    with pytest.raises(SceneStreamError):
+        parser.feed('xt": "Hello"}')
+
+
+def test_rejects_content_that_is_not_a_list_of_objects():
+    with pytest.raises(SceneStreamError):
+        _parse(['{"content": "text"}'])
+    with pytest.raises(SceneStreamError):
+        _parse(['{"content": ["text"]}'])
+
+
+def test_rejects_a_response_without_json():
+    with pytest.raises(SceneStreamError):
+        _parse(["I'm sorry, " * 10, "I can't write that scene." * 10])